@@ -10,7 +10,17 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
+from corsheaders.defaults import default_headers
+
+
+def env_bool(name, default):
+    """Read a boolean setting from the environment (1/true/yes/on)"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -20,23 +30,26 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = "django-insecure-ytx(4#!=bek29mq(@(2sg9z^%k$(v9jy&k3ed1b8ht=mspbj3*"
+SECRET_KEY = os.environ.get("WISP_SECRET_KEY", "django-insecure-ytx(4#!=bek29mq(@(2sg9z^%k$(v9jy&k3ed1b8ht=mspbj3*")
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = env_bool("WISP_DEBUG", True)
 
+# Django's stock middlewares, in versions that do not hop to a thread under ASGI
+# (see wispapp/middleware.py)
 MIDDLEWARE = [
+    "wispapp.instrumentation.InstrumentationMiddleware",
     "corsheaders.middleware.CorsMiddleware",
-    "django.middleware.common.CommonMiddleware",
-    "django.middleware.security.SecurityMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
-    "django.middleware.csrf.CsrfViewMiddleware",
-    "django.contrib.auth.middleware.AuthenticationMiddleware",
-    "django.contrib.messages.middleware.MessageMiddleware",
-    "django.middleware.clickjacking.XFrameOptionsMiddleware"
+    "wispapp.middleware.AsyncCommonMiddleware",
+    "wispapp.middleware.AsyncSecurityMiddleware",
+    "wispapp.middleware.AsyncSessionMiddleware",
+    "wispapp.middleware.AsyncCsrfViewMiddleware",
+    "wispapp.middleware.AsyncAuthenticationMiddleware",
+    "wispapp.middleware.AsyncMessageMiddleware",
+    "wispapp.middleware.AsyncXFrameOptionsMiddleware"
 ]
 
-ALLOWED_HOSTS = ['localhost', '127.0.0.1', '0.0.0.0']
+ALLOWED_HOSTS = os.environ.get("WISP_ALLOWED_HOSTS", "localhost,127.0.0.1,0.0.0.0").split(",")
 
 
 # Application definition
@@ -58,10 +71,54 @@ INSTALLED_APPS = [
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-            'rest_framework_simplejwt.authentication.JWTAuthentication',
+            'wispapp.authentication.MemberJWTAuthentication',
         )
 }
 
+# Default page size for the cursor paginated endpoints (movements, salaries)
+WISP_PAGE_SIZE = 50
+
+# Cache of serialized household reads (see wispapp/caching.py). Local memory by
+# default; point WISP_CACHE_BACKEND/WISP_CACHE_LOCATION at a shared backend such
+# as django.core.cache.backends.redis.RedisCache when running several workers.
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get("WISP_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("WISP_CACHE_LOCATION", "wisp"),
+        "OPTIONS": {},
+    }
+}
+if "locmem" in CACHES["default"]["BACKEND"]:
+    CACHES["default"]["OPTIONS"]["MAX_ENTRIES"] = int(os.environ.get("WISP_CACHE_MAX_ENTRIES", "5000"))
+WISP_RESPONSE_CACHE = env_bool("WISP_RESPONSE_CACHE", True)
+WISP_RESPONSE_CACHE_TIMEOUT = int(os.environ.get("WISP_RESPONSE_CACHE_TIMEOUT", "300"))
+# Period rows resolved from dates are cached too; with a per-process cache this
+# bounds how long other processes keep a renamed or deleted period
+WISP_PERIOD_CACHE_TIMEOUT = int(os.environ.get("WISP_PERIOD_CACHE_TIMEOUT", "300"))
+
+# Delta sync: how far back each sync re-reads to catch late commits, and how
+# long deletions are remembered (older tokens get a full sync)
+WISP_SYNC_OVERLAP_SECONDS = 60
+WISP_SYNC_TOMBSTONE_DAYS = 90
+
+# Prorrata recomputes after salary edits run on `manage.py run_wisp_worker`
+# (see wispapp/jobs.py). WISP_RECOMPUTE_ASYNC=0 runs them in the request instead.
+WISP_RECOMPUTE_ASYNC = env_bool("WISP_RECOMPUTE_ASYNC", True)
+WISP_RECOMPUTE_DELAY_SECONDS = int(os.environ.get("WISP_RECOMPUTE_DELAY_SECONDS", "2"))
+WISP_RECOMPUTE_TIMEOUT_SECONDS = 600
+WISP_RECOMPUTE_MAX_ATTEMPTS = 3
+WISP_RECOMPUTE_RETRY_SECONDS = 10
+WISP_RECOMPUTE_JOB_RETENTION_DAYS = 7
+
+# How long an Idempotency-Key replays the response of the write it was sent with
+WISP_IDEMPOTENCY_KEY_HOURS = 24
+# After this long, a key whose write committed without storing its response
+# (the request failed after the commit) rebuilds it from the created rows
+WISP_IDEMPOTENCY_PENDING_SECONDS = 60
+
+# Most movements accepted by one POST /api/movements/batch/
+WISP_BATCH_MAX_MOVEMENTS = 500
+
 ROOT_URLCONF = "wisp.urls"
 
 SIMPLE_JWT = {
@@ -89,13 +146,59 @@ WSGI_APPLICATION = "wisp.wsgi.application"
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
-
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+#
+# WISP_DB_ENGINE selects the backend: "sqlite" (default) or "postgresql".
+
+DB_ENGINE = os.environ.get("WISP_DB_ENGINE", "sqlite")
+
+if DB_ENGINE == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("WISP_DB_NAME", "wisp"),
+            "USER": os.environ.get("WISP_DB_USER", "wisp"),
+            "PASSWORD": os.environ.get("WISP_DB_PASSWORD", ""),
+            "HOST": os.environ.get("WISP_DB_HOST", "localhost"),
+            "PORT": os.environ.get("WISP_DB_PORT", "5432"),
+            # Keep connections open between requests instead of reconnecting every time
+            "CONN_MAX_AGE": int(os.environ.get("WISP_DB_CONN_MAX_AGE", "60")),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {},
+        }
     }
-}
+    if env_bool("WISP_DB_POOL", False):
+        # Server side connection pool (needs psycopg[pool]); incompatible with persistent connections
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": int(os.environ.get("WISP_DB_POOL_MIN_SIZE", "2")),
+            "max_size": int(os.environ.get("WISP_DB_POOL_MAX_SIZE", "10")),
+        }
+elif DB_ENGINE == "sqlite":
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get("WISP_SQLITE_TIMEOUT", "20"))
+    # WAL lets readers run alongside the single writer. The mode is stored in the
+    # database file, so it is opt-in: the checked-in dev database stays untouched
+    SQLITE_WAL = env_bool("WISP_SQLITE_WAL", False)
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("WISP_SQLITE_PATH", BASE_DIR / "db.sqlite3"),
+            "OPTIONS": {
+                # Seconds a writer waits for the lock before failing with "database is locked"
+                "timeout": SQLITE_BUSY_TIMEOUT,
+                # Take the write lock when the transaction starts, so concurrent writers
+                # queue on the busy timeout instead of failing on a lock upgrade
+                "transaction_mode": "IMMEDIATE",
+                "init_command": (
+                    ("PRAGMA journal_mode=WAL;PRAGMA synchronous=NORMAL;" if SQLITE_WAL else "")
+                    + f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT * 1000};"
+                    "PRAGMA temp_store=MEMORY;"
+                    "PRAGMA cache_size=-20000;"
+                ),
+            },
+        }
+    }
+else:
+    raise ValueError(f"Unsupported WISP_DB_ENGINE: {DB_ENGINE}")
 
 
 # Password validation
@@ -141,21 +244,48 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
-DEBUG = True  # Ensure this is on for detailed error messages
+# Let browser clients send idempotency keys and see replayed responses
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key")
+CORS_EXPOSE_HEADERS = ["Idempotent-Replayed"]
+
+# Per request metrics (see wispapp/instrumentation.py), logged as one JSON line
+# per request to WISP_REQUEST_LOG or the console. Requests over the slow
+# thresholds are logged at WARNING.
+WISP_INSTRUMENTATION = env_bool("WISP_INSTRUMENTATION", True)
+WISP_SLOW_REQUEST_MS = int(os.environ.get("WISP_SLOW_REQUEST_MS", "500"))
+WISP_SLOW_REQUEST_QUERIES = int(os.environ.get("WISP_SLOW_REQUEST_QUERIES", "20"))
 
-# Add logging for CORS
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'formatters': {
+        'json_lines': {
+            'format': '%(message)s',
+        },
+    },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
         },
+        'requests': {
+            'class': 'logging.FileHandler',
+            'filename': os.environ["WISP_REQUEST_LOG"],
+            'formatter': 'json_lines',
+        } if os.environ.get("WISP_REQUEST_LOG") else {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json_lines',
+        },
     },
     'loggers': {
+        # Add logging for CORS
         'corsheaders': {
             'handlers': ['console'],
             'level': 'DEBUG',
         },
+        'wispapp.requests': {
+            'handlers': ['requests'],
+            'level': os.environ.get("WISP_REQUEST_LOG_LEVEL", "INFO"),
+            'propagate': False,
+        },
     },
 }
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class WispappConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "wispapp"
+
+    def ready(self):
+        # Connect the period cache invalidation signals
+        from . import periods  # noqa: F401
@@ -0,0 +1,120 @@
+from functools import partial, wraps
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from .authentication import MemberJWTAuthentication
+from .caching import acached_data, household_key
+from .ledger import ensure_ledgers
+from .models import Member, Movement
+from .pagination import encode_movement_cursor, movements_after, requested_page_size
+from .representation import representation_options
+from .serializers import MemberSerializer, MovementSerializer
+from .settlements import apairwise_matrix, member_balances
+from .versions import add_validators, not_modified
+
+# Async variants of the hot read endpoints, served under /api/async/. They use the
+# async ORM so an ASGI worker can serve many concurrent polls without a thread each,
+# and share the response cache entries of the sync views. The middlewares in
+# wispapp/middleware.py keep the rest of the request off Django's sync thread.
+
+
+def member_view(view):
+    """Authenticate an async read with the API JWT and call it with the current member.
+
+    Like the sync reads, it answers 304 Not Modified from the household change version.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            authenticated = await MemberJWTAuthentication().aauthenticate(request)
+        except (AuthenticationFailed, InvalidToken) as e:
+            return JsonResponse({'detail': e.detail}, status=e.status_code)
+        if authenticated is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+        request.user = authenticated[0]
+        try:
+            member = request.user.member
+        except Member.DoesNotExist:
+            return JsonResponse({'error': 'Member not found'}, status=404)
+        # Unchanged households are answered before running any query
+        response = not_modified(request, member)
+        if response is None:
+            response = await view(request, member, *args, **kwargs)
+        return add_validators(response, member)
+    return wrapper
+
+
+async def with_ledgers(members):
+    # Only members that never had a balance built need a (sync) write
+    if any(member.get_ledger() is None for member in members):
+        await sync_to_async(ensure_ledgers)(members)
+    return members
+
+
+@require_GET
+@member_view
+async def movement_list(request, member):
+    """Household movements, newest first, paginated with ?cursor= and filterable by ?period= and ?category="""
+    if not member.household_id:
+        return JsonResponse({'next': None, 'results': []})
+    # Rows are slim like the sync list, with the same ?fields= and ?expand=
+    options = representation_options(request.GET, slim=True)
+    key = household_key('movements', member.household, request.build_absolute_uri())
+    try:
+        data = await acached_data('movements', key, partial(movement_page, request, member, options))
+    except ValueError:
+        return JsonResponse({'detail': 'Invalid filter or cursor.'}, status=400)
+    return JsonResponse(data)
+
+
+async def movement_page(request, member, options):
+    queryset = Movement.objects.filter(household_id=member.household_id).select_related(
+        'member',
+        'category__distribution_type'
+    )
+    expand_member = 'member' in options['expand']
+    if expand_member:
+        queryset = queryset.select_related('member__household', 'member__ledger')
+    page_size = requested_page_size(request.GET)
+    for field in ['period', 'category']:
+        if request.GET.get(field):
+            queryset = queryset.filter(**{f'{field}_id': int(request.GET[field])})
+    queryset = movements_after(queryset, request.GET.get('cursor'))
+
+    movements = [movement async for movement in queryset[:page_size + 1]]
+    next_url = None
+    if len(movements) > page_size:
+        movements = movements[:page_size]
+        query = request.GET.copy()
+        query['cursor'] = encode_movement_cursor(movements[-1])
+        next_url = request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+
+    if expand_member:
+        await with_ledgers([movement.member for movement in movements])
+    return {'next': next_url, 'results': MovementSerializer(movements, many=True, context=options).data}
+
+
+@require_GET
+@member_view
+async def member_me(request, member):
+    """The current member with their household and balance"""
+    await with_ledgers([member])
+    return JsonResponse(MemberSerializer(member).data)
+
+
+@require_GET
+@member_view
+async def detailed_balances(request, member):
+    """What the current member owes and is owed by each other household member"""
+    if not member.household_id:
+        return JsonResponse({'error': 'No household found'}, status=404)
+    # Same cache entry as MemberViewSet.detailed_balances
+    key = household_key('detailed_balances', member.household, member.id)
+    return JsonResponse(await acached_data('detailed_balances', key, partial(balances_of, member)), safe=False)
+
+
+async def balances_of(member):
+    members = [household_member async for household_member in Member.objects.filter(household_id=member.household_id)]
+    matrix = await apairwise_matrix(member.household_id)
+    return member_balances(member, members, matrix)
@@ -0,0 +1,63 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+class MemberJWTAuthentication(JWTAuthentication):
+    """JWT authentication that loads the user's member, household and balance with the user.
+
+    Views and serializers read `request.user.member` and `member.household`
+    without further queries, so the whole request resolves them once.
+    """
+
+    def user_queryset(self):
+        return self.user_model.objects.select_related(
+            'member__household',
+            'member__ledger'
+        )
+
+    def user_lookup(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        return {api_settings.USER_ID_FIELD: user_id}
+
+    def check_user(self, user, validated_token):
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if getattr(api_settings, 'CHECK_REVOKE_TOKEN', False):
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
+
+    def get_user(self, validated_token):
+        try:
+            user = self.user_queryset().get(**self.user_lookup(validated_token))
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        return self.check_user(user, validated_token)
+
+    async def aget_user(self, validated_token):
+        try:
+            user = await self.user_queryset().aget(**self.user_lookup(validated_token))
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        return self.check_user(user, validated_token)
+
+    async def aauthenticate(self, request):
+        """Async version of authenticate for plain Django async views"""
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
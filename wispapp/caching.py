@@ -0,0 +1,114 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+from .models import PeriodVersion
+
+# Serialized household reads cached in the Django cache framework.
+#
+# Household-wide responses (movement pages, categories, balances) are keyed on the
+# household change version loaded at authentication, so every write that bumps
+# it invalidates them. Period summaries are keyed on the PeriodVersion of each of
+# their periods, bumped when that period's movements or distributions change,
+# and on the household's shared_changed_at, set when data shared by every period
+# (categories, members) changes. All of them live in the database, so writes
+# made by another process invalidate cached reads even with a per-process cache.
+
+PREFIX = 'wisp'
+KINDS = ['movements', 'categories', 'detailed_balances', 'household_balances', 'period_summary']
+
+
+def enabled():
+    return getattr(settings, 'WISP_RESPONSE_CACHE', True)
+
+
+def count(kind, outcome):
+    """Increment the shared hit or miss counter of a kind of response"""
+    key = f'{PREFIX}:stats:{kind}:{outcome}'
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted in between, the count restarts
+            cache.add(key, 1, timeout=None)
+
+
+def stats():
+    """Hits, misses and hit rate of every kind of cached response"""
+    counters = cache.get_many([f'{PREFIX}:stats:{kind}:{outcome}' for kind in KINDS for outcome in ['hits', 'misses']])
+    report = {}
+    for kind in KINDS:
+        hits = counters.get(f'{PREFIX}:stats:{kind}:hits', 0)
+        misses = counters.get(f'{PREFIX}:stats:{kind}:misses', 0)
+        report[kind] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None
+        }
+    return report
+
+
+def reset_stats():
+    cache.delete_many([f'{PREFIX}:stats:{kind}:{outcome}' for kind in KINDS for outcome in ['hits', 'misses']])
+
+
+def digest(*parts):
+    return hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+def household_key(kind, household, *parts):
+    """Key of a response that changes with any write to `household`"""
+    if not enabled():
+        return None
+    version = f'{household.change_version}.{household.changed_at.timestamp()}'
+    return f'{PREFIX}:{kind}:{household.id}:{version}:{digest(*parts)}'
+
+
+def period_key(kind, household, period_ids, *parts):
+    """Key of a response that only depends on the given periods of a household"""
+    if not enabled():
+        return None
+    period_ids = sorted(period_ids)
+    versions = dict(
+        PeriodVersion.objects.filter(household_id=household.id, period_id__in=period_ids)
+        .values_list('period_id', 'version')
+    )
+    version = [household.shared_changed_at.timestamp()] + [versions.get(period_id, 0) for period_id in period_ids]
+    return f'{PREFIX}:{kind}:{household.id}:{digest(*period_ids, *version, *parts)}'
+
+
+def cached_response(kind, key, build):
+    """Response with the data cached under `key`, or build() and cache its data if it succeeds.
+
+    A None key (cache disabled) always builds.
+    """
+    if key is None:
+        return build()
+    data = cache.get(key)
+    if data is not None:
+        count(kind, 'hits')
+        return Response(data)
+    count(kind, 'misses')
+    response = build()
+    if response.status_code == 200:
+        cache.set(key, response.data, timeout=getattr(settings, 'WISP_RESPONSE_CACHE_TIMEOUT', 300))
+    return response
+
+
+async def acached_data(kind, key, build):
+    """cached_response for async views: the data cached under `key`, or await build() and cache it.
+
+    build() signals errors by raising, so only successful data is cached. The
+    cache is called synchronously: its async methods hop to a thread, which costs
+    more than a local memory lookup.
+    """
+    if key is None:
+        return await build()
+    data = cache.get(key)
+    if data is not None:
+        count(kind, 'hits')
+        return data
+    count(kind, 'misses')
+    data = await build()
+    cache.set(key, data, timeout=getattr(settings, 'WISP_RESPONSE_CACHE_TIMEOUT', 300))
+    return data
@@ -0,0 +1,241 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.utils import timezone
+from .ledger import add_to_balances, balance_changes
+from .models import Member, Movement, MovementDistribution, Salary, Tombstone
+from .periods import period_offset, shift_period_string
+from .strategies import get_strategy, salary_based_types
+from .sync import record_deletions
+from .versions import household_changed
+
+
+def get_previous_period(current_period):
+    """Get the period before the given one, whose salaries split prorrata movements"""
+    return period_offset(current_period, -1)
+
+
+def load_salaries(household_id, periods):
+    """Salaries of a household for the given periods in a single query, as {period_id: {member_id: amount}}"""
+    salaries = {period.id: {} for period in periods}
+    rows = Salary.objects.filter(
+        member__household_id=household_id,
+        period__in=periods
+    ).values_list('period_id', 'member_id', 'amount')
+    for period_id, member_id, amount in rows:
+        salaries[period_id][member_id] = amount
+    return salaries
+
+
+def compute_shares(movement, members, salaries=None, salary_period=None, options=None):
+    """Split a movement amount among household members with the strategy of its category distribution type.
+
+    `salaries` maps member id to salary amount and is only used by salary based
+    strategies. `options` holds per-movement strategy options. Returns a list of
+    (member, amount) pairs.
+    """
+    strategy = get_strategy(movement.category.distribution_type.name)
+    return strategy(movement, members, {
+        'salaries': salaries,
+        'salary_period': salary_period,
+        'options': options or {},
+    })
+
+
+def load_previous_salaries(household_id, movements):
+    """Salary vectors used by the salary based movements among `movements`.
+
+    Returns {period_id: (previous_period, {member_id: amount})}, loaded with a
+    single salary query whatever the number of movements.
+    """
+    previous_periods = {}
+    for movement in movements:
+        if movement.period_id not in previous_periods and get_strategy(movement.category.distribution_type.name).uses_salaries:
+            previous_periods[movement.period_id] = get_previous_period(movement.period)
+    if not previous_periods:
+        return {}
+
+    salaries = load_salaries(household_id, previous_periods.values())
+    return {
+        period_id: (previous_period, salaries[previous_period.id])
+        for period_id, previous_period in previous_periods.items()
+    }
+
+
+def movement_shares(movement, members, previous_salaries, options=None):
+    """Shares of one movement, using salary vectors from load_previous_salaries"""
+    previous_period, salaries = previous_salaries.get(movement.period_id, (None, None))
+    return compute_shares(movement, members, salaries=salaries, salary_period=previous_period, options=options)
+
+
+def distribution_rows(movement, shares):
+    """Unsaved MovementDistribution rows for a saved movement and its shares"""
+    return [
+        MovementDistribution(
+            movement=movement,
+            member=member,
+            amount=amount,
+            is_payer=(member.id == movement.member_id)
+        )
+        for member, amount in shares
+    ]
+
+
+def build_distributions(movements, members, options=None):
+    """Unsaved MovementDistribution rows for the given movements of one household.
+
+    Salaries for every previous period involved are loaded with one query.
+    `options` is an optional list of per-movement strategy options, aligned with
+    `movements`.
+    """
+    members = list(members)
+    if not movements:
+        return []
+
+    household_id = members[0].household_id if members else None
+    previous_salaries = load_previous_salaries(household_id, movements)
+
+    options = options or [None] * len(movements)
+    distributions = []
+    for movement, movement_options in zip(movements, options):
+        distributions += distribution_rows(movement, movement_shares(movement, members, previous_salaries, movement_options))
+    return distributions
+
+
+def distribute_movements(movements, members=None, options=None):
+    """Create the distributions of freshly saved movements with a single bulk insert.
+
+    All movements must belong to the same household. When `members` is not given
+    the household members of the first movement's payer are used. `options` is
+    passed on to build_distributions.
+    """
+    movements = list(movements)
+    if not movements:
+        return []
+    if members is None:
+        members = Member.objects.filter(household_id=movements[0].member.household_id)
+    members = list(members)
+
+    return save_distributions(movements, members, build_distributions(movements, members, options))
+
+
+def save_distributions(movements, members, distributions):
+    """Insert distributions built for `movements` and refresh the balances and versions they change.
+
+    The movements must be saved first, in the same transaction when they are new.
+    Nothing catches errors in between, so no savepoint is needed when nested.
+    """
+    with transaction.atomic(savepoint=False):
+        distributions = MovementDistribution.objects.bulk_create(distributions)
+        add_to_balances(*balance_changes(movements, distributions))
+        household_changed(
+            *{movement.household_id for movement in movements},
+            period_ids={movement.period_id for movement in movements}
+        )
+    return distributions
+
+
+def split_options(distributions, members):
+    """Strategy options that reproduce an existing split: the members left out and the share of each"""
+    shares = {distribution.member_id: distribution.amount for distribution in distributions}
+    return {
+        'excluded_member_ids': [member.id for member in members if member.id not in shares],
+        'shares': shares,
+    }
+
+
+def replace_distributions(movement, members, distributions):
+    """Save an updated movement with new distributions from build_distributions in place of its stored ones.
+
+    The stored amount and distributions are read and locked in the transaction
+    that replaces them, so the balances lose exactly what they held, even if a
+    recompute changed the shares since the new ones were built. save_distributions
+    adds the whole movement back. The payer does not change on update.
+    """
+    with transaction.atomic():
+        previous_amount = Movement.objects.select_for_update().values_list('amount', flat=True).get(pk=movement.pk)
+        previous = list(MovementDistribution.objects.filter(movement=movement).select_for_update())
+        movement.save()
+        previous_ids = [distribution.id for distribution in previous]
+        MovementDistribution.objects.filter(id__in=previous_ids).delete()
+        record_deletions(movement.household_id, Tombstone.DISTRIBUTION, previous_ids)
+        add_to_balances(
+            paid={movement.member_id: -previous_amount},
+            owed=balance_changes(distributions=previous, sign=-1)[1]
+        )
+        return save_distributions([movement], members, distributions)
+
+
+def recompute_prorrata(household_id, salary_period):
+    """Recompute salary based distributions after a salary of `salary_period` changed.
+
+    Prorrata (and any other salary based strategy) movements are split using the
+    salaries of the period before them, so the affected movements are the ones in
+    the period following `salary_period`.
+    Existing rows are updated in place with bulk_update; rows for members that
+    gained or lost a salary are created or deleted. Returns the number of
+    movements recomputed.
+    """
+    next_period_str = shift_period_string(salary_period.period, 1)
+    # Read and write in one transaction, with the movements and their distributions
+    # locked (PostgreSQL; SQLite takes its write lock when the transaction starts),
+    # so a concurrent update or delete cannot change them under the owed deltas
+    with transaction.atomic():
+        movements = list(Movement.objects.filter(
+            household_id=household_id,
+            period__period=next_period_str,
+            category__distribution_type__name__in=salary_based_types()
+        ).select_related('category__distribution_type').select_for_update(of=('self',)))
+        if not movements:
+            return 0
+
+        salaries = load_salaries(household_id, [salary_period])[salary_period.id]
+        if sum(salaries.values()) == 0:
+            return 0
+        # Members without a salary in the period get no share
+        members = [
+            member for member in Member.objects.filter(household_id=household_id)
+            if member.id in salaries
+        ]
+
+        existing = {
+            (distribution.movement_id, distribution.member_id): distribution
+            for distribution in MovementDistribution.objects.filter(movement__in=movements).select_for_update()
+        }
+
+        now = timezone.now()
+        to_update = []
+        to_create = []
+        # What each member owes more, or less, after the recompute
+        owed = defaultdict(Decimal)
+        for movement in movements:
+            for member, amount in compute_shares(movement, members, salaries, salary_period):
+                owed[member.id] += amount
+                distribution = existing.pop((movement.id, member.id), None)
+                if distribution is None:
+                    to_create.append(MovementDistribution(
+                        movement=movement,
+                        member=member,
+                        amount=amount,
+                        is_payer=(member.id == movement.member_id)
+                    ))
+                else:
+                    owed[member.id] -= distribution.amount
+                    distribution.amount = amount
+                    distribution.is_payer = (member.id == movement.member_id)
+                    distribution.updated_at = now
+                    to_update.append(distribution)
+        # Whatever is left belongs to members that no longer have a salary
+        stale_ids = []
+        for distribution in existing.values():
+            owed[distribution.member_id] -= distribution.amount
+            stale_ids.append(distribution.id)
+
+        MovementDistribution.objects.bulk_update(to_update, ['amount', 'is_payer', 'updated_at'])
+        MovementDistribution.objects.bulk_create(to_create)
+        if stale_ids:
+            MovementDistribution.objects.filter(id__in=stale_ids).delete()
+            record_deletions(household_id, Tombstone.DISTRIBUTION, stale_ids)
+        add_to_balances(owed=owed)
+        household_changed(household_id, period_ids={movement.period_id for movement in movements})
+    return len(movements)
@@ -0,0 +1,93 @@
+import csv
+import json
+from django.db.models import Prefetch
+from .models import Movement, MovementDistribution
+from .periods import periods_between
+
+EXPORT_FORMATS = ['csv', 'ndjson']
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+CSV_HEADER = [
+    'movement_id', 'date', 'period', 'amount', 'category', 'distribution_type',
+    'payer', 'description', 'member', 'share', 'is_payer'
+]
+
+
+class Echo:
+    """File-like object whose write returns the value, so csv.writer can feed a generator"""
+
+    def write(self, value):
+        return value
+
+
+def export_movements(household_id, start=None, end=None, chunk_size=2000):
+    """Iterate over a household's movements and their distributions, oldest first.
+
+    `start` and `end` are optional period strings (YYYY-MM), both included. Rows
+    are fetched with a server-side iterator in chunks of `chunk_size`, each chunk
+    with its distributions prefetched in one query, so memory stays flat.
+    """
+    movements = Movement.objects.filter(household_id=household_id)
+    if start or end:
+        movements = movements.filter(period__in=periods_between(start, end))
+
+    movements = movements.select_related(
+        'member', 'period', 'category__distribution_type'
+    ).prefetch_related(
+        Prefetch(
+            'movementdistribution_set',
+            queryset=MovementDistribution.objects.select_related('member').order_by('member_id')
+        )
+    ).order_by('date', 'id')
+    return movements.iterator(chunk_size=chunk_size)
+
+
+def movement_record(movement):
+    return {
+        'id': movement.id,
+        'date': movement.date.isoformat(),
+        'period': movement.period.period,
+        'amount': str(movement.amount),
+        'category': movement.category.name,
+        'distribution_type': movement.category.distribution_type.name,
+        'payer': movement.member.name,
+        'description': movement.description,
+        'distributions': [
+            {
+                'member': distribution.member.name,
+                'amount': str(distribution.amount),
+                'is_payer': distribution.is_payer
+            }
+            for distribution in movement.movementdistribution_set.all()
+        ]
+    }
+
+
+def stream_ndjson(movements):
+    """One JSON object per movement, distributions nested"""
+    for movement in movements:
+        yield json.dumps(movement_record(movement)) + '\n'
+
+
+def stream_csv(movements):
+    """One CSV row per distribution, with the movement columns repeated"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for movement in movements:
+        record = movement_record(movement)
+        columns = [
+            record['id'], record['date'], record['period'], record['amount'], record['category'],
+            record['distribution_type'], record['payer'], record['description'] or ''
+        ]
+        if not record['distributions']:
+            yield writer.writerow(columns + ['', '', ''])
+        for distribution in record['distributions']:
+            yield writer.writerow(columns + [distribution['member'], distribution['amount'], distribution['is_payer']])
+
+
+STREAMERS = {
+    'csv': stream_csv,
+    'ndjson': stream_ndjson,
+}
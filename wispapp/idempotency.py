@@ -0,0 +1,154 @@
+import hashlib
+from datetime import timedelta
+from functools import wraps
+from django.conf import settings
+from django.db import IntegrityError
+from django.utils import timezone
+from rest_framework import serializers, status
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from .models import IdempotencyRecord
+
+# Idempotency-Key support for writes.
+#
+# The key is looked up before the view runs, and the view validates, splits and
+# serializes outside any transaction. Its write transaction inserts the
+# IdempotencyRecord next to the movements (save_record), so the key is taken
+# exactly when the write commits and the lock is held no longer than the
+# inserts, with the ids of the created rows. The response is stored on the
+# record once serialized; until then a retry gets 409 Conflict. If it never is
+# (the request failed after its commit), a retry after
+# WISP_IDEMPOTENCY_PENDING_SECONDS rebuilds it from the created rows. Two requests with the same key racing each other
+# collide on the unique (user, key) constraint: the loser's write rolls back and
+# it replays the winner's response. Failed requests are not recorded, they
+# wrote nothing and can be retried with the same key.
+
+HEADER = 'Idempotency-Key'
+
+
+def retention():
+    return timedelta(hours=getattr(settings, 'WISP_IDEMPOTENCY_KEY_HOURS', 24))
+
+
+def pending_timeout():
+    return timedelta(seconds=getattr(settings, 'WISP_IDEMPOTENCY_PENDING_SECONDS', 60))
+
+
+def fingerprint(request):
+    """Hash of what a key promises to repeat: method, path and body"""
+    digest = hashlib.sha256(f'{request.method} {request.path}\n'.encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def find_record(user, key):
+    """The live record of `key`, dropping an expired one so the key can be reused"""
+    record = IdempotencyRecord.objects.filter(user=user, key=key).first()
+    if record is not None and record.created_at < timezone.now() - retention():
+        record.delete()
+        return None
+    return record
+
+
+def replay(record, request_fingerprint):
+    if record.fingerprint != request_fingerprint:
+        return Response(
+            {'error': f'{HEADER} {record.key!r} was already used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    if record.status_code is None:
+        return Response(
+            {'error': f'A request with {HEADER} {record.key!r} is still being processed'},
+            status=status.HTTP_409_CONFLICT
+        )
+    response = Response(record.response_body, status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def store_response(record, response):
+    record.status_code = response.status_code
+    record.response_body = response.data
+    record.save(update_fields=['status_code', 'response_body'])
+
+
+def save_record(request, objects):
+    """Insert the IdempotencyRecord that `idempotent` reserved for `request`, if any.
+
+    Call it inside the write's transaction, after inserting `objects`. Does
+    nothing for requests without an Idempotency-Key or when the record is
+    already saved.
+    """
+    record = getattr(request, 'idempotency_record', None)
+    if record is not None and record.pk is None:
+        record.object_ids = [obj.pk for obj in objects]
+        record.save(force_insert=True)
+
+
+def idempotent(rebuild):
+    """Make a write view method safe to retry with an Idempotency-Key header.
+
+    The view must call save_record in its write transaction. `rebuild(view,
+    object_ids)` returns its response again from the ids of the created rows,
+    for a write that committed but never stored its response. Requests without
+    the header run as usual.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return view_method(self, request, *args, **kwargs)
+            if len(key) > 255:
+                raise serializers.ValidationError(f"{HEADER} must be at most 255 characters")
+
+            request_fingerprint = fingerprint(request)
+            record = find_record(request.user, key)
+            if record is not None:
+                if (record.status_code is None and record.fingerprint == request_fingerprint
+                        and record.created_at < timezone.now() - pending_timeout()):
+                    store_response(record, rebuild(self, record.object_ids))
+                return replay(record, request_fingerprint)
+
+            record = request.idempotency_record = IdempotencyRecord(
+                user=request.user,
+                key=key,
+                method=request.method,
+                path=request.path[:255],
+                fingerprint=request_fingerprint
+            )
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except IntegrityError:
+                # A concurrent request with the same key committed first: this one's write rolled back
+                record = find_record(request.user, key)
+                if record is None:
+                    raise
+                return replay(record, request_fingerprint)
+            if record.pk is not None and status.is_success(response.status_code):
+                store_response(record, response)
+            return response
+        return wrapper
+    return decorator
+
+
+def rebuild_created(view, object_ids):
+    """The 201 response of CreateModelMixin.create for the created object"""
+    instance = view.get_queryset().filter(pk__in=object_ids).first()
+    if instance is None:
+        raise NotFound(f"The object created with this {HEADER} was deleted")
+    serializer = view.get_serializer(instance)
+    return Response(serializer.data, status=status.HTTP_201_CREATED, headers=view.get_success_headers(serializer.data))
+
+
+class IdempotentCreateMixin:
+    """Idempotency-Key support on create"""
+
+    @idempotent(rebuild=rebuild_created)
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+
+def prune_idempotency_records():
+    """Delete records older than WISP_IDEMPOTENCY_KEY_HOURS"""
+    return IdempotencyRecord.objects.filter(created_at__lt=timezone.now() - retention()).delete()[0]
@@ -0,0 +1,219 @@
+import csv
+import json
+from django.db import transaction
+from rest_framework import serializers
+from .distributions import distribution_rows, load_previous_salaries, movement_shares
+from .ledger import add_to_balances, balance_changes
+from .models import Category, Member, Movement, MovementDistribution
+from .periods import period_for_date
+from .versions import household_changed
+
+FORMATS = ['csv', 'ndjson']
+
+
+def guess_format(filename):
+    """Import format from a file name, defaulting to CSV"""
+    if filename and filename.lower().endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return 'csv'
+
+
+def read_rows(stream, format):
+    """Yield (line_number, row, error) for every record of a CSV or NDJSON text stream.
+
+    Records are parsed one at a time so the file is never fully loaded. `error`
+    is set instead of `row` when a record cannot be parsed.
+    """
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row, None
+    elif format == 'ndjson':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(row, dict):
+                yield line_number, None, "Each line must be a JSON object"
+                continue
+            yield line_number, row, None
+    else:
+        raise serializers.ValidationError(f"Unknown import format: {format}")
+
+
+class MovementImporter:
+    """Import movements for the household of `member` from parsed rows.
+
+    Each row has `date` (YYYY-MM-DD), `amount` and `category` (name or id), and
+    optionally `description`, `member` (name of the paying household member,
+    defaults to `member`) and the `excluded_member_ids` and `shares` options of
+    the exclude and custom distribution types. Categories and members are resolved through lookup
+    tables loaded once and periods through the period cache. Valid rows are written in chunks of `batch_size`
+    movements, each chunk with a bulk insert of the movements and of their
+    distributions inside one transaction. Invalid rows are reported and skipped
+    without aborting the import.
+
+    With `choose_payer=False` the `member` column is ignored and `member` pays
+    every movement, as for a single POST /movements/. `on_write` is called with
+    the movements of every written chunk inside its transaction.
+    """
+    amount_field = serializers.DecimalField(max_digits=10, decimal_places=2)
+    date_field = serializers.DateField()
+    option_fields = {
+        'excluded_member_ids': serializers.ListField(child=serializers.IntegerField()),
+        'shares': serializers.DictField(child=serializers.DecimalField(max_digits=10, decimal_places=2)),
+    }
+
+    def __init__(self, member, batch_size=1000, choose_payer=True, on_write=None):
+        if not member.household_id:
+            raise serializers.ValidationError("You must belong to a household to import movements")
+        self.member = member
+        self.household_id = member.household_id
+        self.batch_size = batch_size
+        self.choose_payer = choose_payer
+        self.on_write = on_write
+
+        self.members = list(Member.objects.filter(household_id=self.household_id))
+        self.members_by_name = {household_member.name: household_member for household_member in self.members}
+        self.categories = {}
+        for category in Category.objects.filter(household_id=self.household_id).select_related('distribution_type'):
+            self.categories[category.name] = category
+            self.categories[str(category.id)] = category
+
+        self.pending = []
+        self.created = 0
+        self.errors = []
+
+    def run(self, rows):
+        """Import every (line_number, row, error) of `rows` and return a report"""
+        for line_number, row, error in rows:
+            if error:
+                self.errors.append({'row': line_number, 'errors': [error]})
+                continue
+            try:
+                movement, options = self.build_movement(row)
+            except serializers.ValidationError as e:
+                self.errors.append({'row': line_number, 'errors': self.error_messages(e)})
+                continue
+            self.pending.append((line_number, movement, options))
+            if len(self.pending) >= self.batch_size:
+                self.flush()
+        self.flush()
+        # Rows that could not be split are reported when their chunk is written
+        self.errors.sort(key=lambda error: error['row'])
+        return {'created': self.created, 'errors': self.errors}
+
+    def create_all(self, rows):
+        """Create every row of `rows` in one transaction, or none of them if any row is invalid.
+
+        Returns the created movements in row order, empty when `self.errors` lists the invalid rows.
+        """
+        for line_number, row, error in rows:
+            try:
+                if error:
+                    raise serializers.ValidationError(error)
+                self.pending.append((line_number, *self.build_movement(row)))
+            except serializers.ValidationError as e:
+                self.errors.append({'row': line_number, 'errors': self.error_messages(e)})
+        pending, self.pending = self.pending, []
+        movements, shares = self.split(pending)
+        if self.errors:
+            self.errors.sort(key=lambda error: error['row'])
+            return []
+        self.write(movements, shares)
+        return movements
+
+    def build_movement(self, row):
+        """Validate a row and turn it into an unsaved Movement and its distribution options"""
+        errors = []
+        try:
+            amount = self.amount_field.run_validation(row.get('amount'))
+        except serializers.ValidationError as e:
+            errors += [f"amount: {message}" for message in self.error_messages(e)]
+        try:
+            movement_date = self.date_field.run_validation(row.get('date'))
+        except serializers.ValidationError as e:
+            errors += [f"date: {message}" for message in self.error_messages(e)]
+
+        category = self.categories.get(str(row.get('category', row.get('category_id', ''))).strip())
+        if category is None:
+            errors.append(f"category: Unknown category {row.get('category', row.get('category_id'))!r}")
+
+        payer = self.member
+        if self.choose_payer and row.get('member'):
+            payer = self.members_by_name.get(row['member'])
+            if payer is None:
+                errors.append(f"member: Unknown household member {row['member']!r}")
+
+        options = {}
+        for name, field in self.option_fields.items():
+            if row.get(name) is None:
+                continue
+            try:
+                options[name] = field.run_validation(row[name])
+            except serializers.ValidationError as e:
+                errors += [f"{name}: {message}" for message in self.error_messages(e)]
+
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        return Movement(
+            amount=amount,
+            date=movement_date,
+            member=payer,
+            household_id=self.household_id,
+            category=category,
+            description=row.get('description') or None,
+            period=period_for_date(movement_date),
+        ), options or None
+
+    def flush(self):
+        """Write the pending movements and their distributions in one transaction"""
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        self.write(*self.split(pending))
+
+    def split(self, pending):
+        """Shares of the pending (line_number, movement, options), loading every salary vector once.
+
+        Returns the movements that could be split and their shares; the others are reported.
+        """
+        previous_salaries = load_previous_salaries(self.household_id, [movement for _, movement, _ in pending])
+        movements = []
+        shares = []
+        for line_number, movement, options in pending:
+            try:
+                shares.append(movement_shares(movement, self.members, previous_salaries, options))
+            except serializers.ValidationError as e:
+                self.errors.append({'row': line_number, 'errors': self.error_messages(e)})
+                continue
+            movements.append(movement)
+        return movements, shares
+
+    def write(self, movements, shares):
+        """Bulk insert movements and their distributions in one transaction"""
+        if not movements:
+            return
+        with transaction.atomic():
+            Movement.objects.bulk_create(movements)
+            distributions = []
+            for movement, split in zip(movements, shares):
+                distributions += distribution_rows(movement, split)
+            MovementDistribution.objects.bulk_create(distributions)
+            add_to_balances(*balance_changes(movements, distributions))
+            household_changed(self.household_id, period_ids={movement.period_id for movement in movements})
+            if self.on_write is not None:
+                self.on_write(movements)
+        self.created += len(movements)
+
+    @staticmethod
+    def error_messages(error):
+        detail = error.detail
+        if isinstance(detail, dict):
+            return [f"{field}: {message}" for field, messages in detail.items() for message in messages]
+        return [str(message) for message in detail]
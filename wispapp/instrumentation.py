@@ -0,0 +1,250 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger('wispapp.requests')
+
+# QueryTimer of the request running in the current context. Context variables
+# follow a request into the threads sync_to_async runs its ORM calls in, so
+# concurrent async requests sharing a thread and its connection are counted apart.
+current_timer = ContextVar('wisp_query_timer', default=None)
+
+
+class QueryTimer:
+    """Database execute wrapper counting the queries of a request and the time spent running them"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+def count_query(execute, sql, params, many, context):
+    """Execute wrapper installed once on every connection: times the query for the current request, if any"""
+    timer = current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def install_query_counter():
+    """Add count_query to the connections of the current thread that do not have it yet"""
+    for alias in connections:
+        wrappers = connections[alias].execute_wrappers
+        if count_query not in wrappers:
+            wrappers.insert(0, count_query)
+
+
+@receiver(connection_created)
+def count_new_connection_queries(sender, connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, count_query)
+
+
+def view_label(view_func, method):
+    """Name of the view handling a request, e.g. MovementViewSet.list or async_views.movement_list"""
+    cls = getattr(view_func, 'cls', None)
+    if cls is not None:
+        actions = getattr(view_func, 'actions', None) or {}
+        return f'{cls.__name__}.{actions.get(method.lower(), method.lower())}'
+    return f"{view_func.__module__.rsplit('.', 1)[-1]}.{view_func.__name__}"
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def summarize(records):
+    """Per endpoint summary of request records, slowest total time first"""
+    by_endpoint = defaultdict(list)
+    for record in records:
+        by_endpoint[record['endpoint']].append(record)
+
+    summary = []
+    for endpoint, rows in by_endpoint.items():
+        durations = [row['duration_ms'] for row in rows]
+        queries = [row['queries'] for row in rows]
+        sizes = [row['response_bytes'] for row in rows if row['response_bytes'] is not None]
+        summary.append({
+            'endpoint': endpoint,
+            'requests': len(rows),
+            'p50_ms': round(percentile(durations, 0.5), 1),
+            'p95_ms': round(percentile(durations, 0.95), 1),
+            'max_ms': round(max(durations), 1),
+            'avg_queries': round(sum(queries) / len(rows), 1),
+            'max_queries': max(queries),
+            'avg_db_ms': round(sum(row['db_ms'] for row in rows) / len(rows), 1),
+            'avg_serialize_ms': round(sum(row['serialize_ms'] for row in rows) / len(rows), 1),
+            'avg_response_bytes': round(sum(sizes) / len(sizes)) if sizes else None,
+            'total_ms': round(sum(durations), 1),
+        })
+    return sorted(summary, key=lambda row: row['total_ms'], reverse=True)
+
+
+class EndpointStats:
+    """Recent request records of this process, a bounded window per endpoint"""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.records = defaultdict(lambda: deque(maxlen=self.window))
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        with self.lock:
+            self.records[record['endpoint']].append(record)
+
+    def summary(self):
+        with self.lock:
+            records = [record for rows in self.records.values() for record in rows]
+        return summarize(records)
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+
+
+endpoint_stats = EndpointStats()
+
+
+class InstrumentationMiddleware:
+    """Record query count, DB time, serialization time and response size of every API request.
+
+    Each request is logged as one JSON line on the `wispapp.requests` logger, at
+    WARNING level when it goes over WISP_SLOW_REQUEST_MS or WISP_SLOW_REQUEST_QUERIES,
+    and added to the in-process endpoint_stats. serialize_ms is the time spent
+    in the view outside the database (mostly serializers) plus rendering.
+
+    It runs natively under both WSGI and ASGI, so async views are not pushed
+    through a thread by it.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        # Connections opened later get count_query from the connection_created signal
+        self.counter_installed = False
+        if self.async_mode:
+            markcoroutinefunction(self)
+            # Coroutine hooks, which Django calls without a thread
+            self.process_view = self.aprocess_view
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not getattr(settings, 'WISP_INSTRUMENTATION', True):
+            return self.get_response(request)
+
+        install_query_counter()
+        timer = QueryTimer()
+        request.wisp_metrics = self.new_metrics()
+        start = time.perf_counter()
+        token = current_timer.set(timer)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        return self.finish(request, response, timer, start)
+
+    async def __acall__(self, request):
+        if not getattr(settings, 'WISP_INSTRUMENTATION', True):
+            return await self.get_response(request)
+
+        if not self.counter_installed:
+            # Connections are per thread: cover the ones already open in the thread ORM calls run in
+            await sync_to_async(install_query_counter)()
+            self.counter_installed = True
+        timer = QueryTimer()
+        request.wisp_metrics = self.new_metrics()
+        start = time.perf_counter()
+        token = current_timer.set(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        return self.finish(request, response, timer, start)
+
+    @staticmethod
+    def new_metrics():
+        return {'endpoint': None, 'view_start': None, 'view_end': None, 'render_seconds': 0.0}
+
+    def finish(self, request, response, timer, start):
+        end = time.perf_counter()
+        metrics = request.wisp_metrics
+        if metrics['endpoint'] is not None:
+            self.record(request, response, timer, end - start, metrics)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.view_started(request, view_func)
+
+    def process_template_response(self, request, response):
+        return self.render(request, response)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        self.view_started(request, view_func)
+
+    async def aprocess_template_response(self, request, response):
+        return self.render(request, response)
+
+    @staticmethod
+    def view_started(request, view_func):
+        metrics = getattr(request, 'wisp_metrics', None)
+        if metrics is not None:
+            metrics['endpoint'] = view_label(view_func, request.method)
+            metrics['view_start'] = time.perf_counter()
+
+    @staticmethod
+    def render(request, response):
+        # DRF responses render lazily: render here to time it apart from the view
+        metrics = getattr(request, 'wisp_metrics', None)
+        if metrics is not None:
+            metrics['view_end'] = time.perf_counter()
+            response.render()
+            metrics['render_seconds'] = time.perf_counter() - metrics['view_end']
+        return response
+
+    def record(self, request, response, timer, duration, metrics):
+        view_seconds = 0.0
+        if metrics['view_start'] is not None:
+            view_seconds = (metrics['view_end'] or time.perf_counter()) - metrics['view_start']
+        serialize_seconds = max(view_seconds - timer.seconds, 0.0) + metrics['render_seconds']
+
+        record = {
+            'endpoint': metrics['endpoint'],
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'queries': timer.count,
+            'db_ms': round(timer.seconds * 1000, 2),
+            'serialize_ms': round(serialize_seconds * 1000, 2),
+            'response_bytes': None if response.streaming else len(response.content),
+        }
+        endpoint_stats.add(record)
+
+        slow = (
+            record['duration_ms'] > getattr(settings, 'WISP_SLOW_REQUEST_MS', 500)
+            or record['queries'] > getattr(settings, 'WISP_SLOW_REQUEST_QUERIES', 20)
+        )
+        level = logging.WARNING if slow else logging.INFO
+        if logger.isEnabledFor(level):
+            logger.log(level, json.dumps(record))
@@ -0,0 +1,128 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .distributions import recompute_prorrata
+from .models import RecomputeJob
+
+# Background recomputes of salary based distributions.
+#
+# A salary write queues a job in its own transaction and returns. Jobs wait
+# WISP_RECOMPUTE_DELAY_SECONDS before they are due, and edits of the same
+# (household, period) made while one is pending join it, so a burst of edits
+# costs one recompute. The recompute reads the salaries when it runs. Workers
+# (manage.py run_wisp_worker) claim due jobs with a conditional update, so
+# several of them can share the queue.
+
+logger = logging.getLogger(__name__)
+
+
+def async_enabled():
+    return getattr(settings, 'WISP_RECOMPUTE_ASYNC', True)
+
+
+def setting_delta(name, default):
+    return timedelta(seconds=getattr(settings, name, default))
+
+
+def enqueue_recompute(household_id, period):
+    """Queue a recompute of the prorrata movements split with the salaries of `period`.
+
+    Joins the pending job of the same household and period if there is one.
+    Returns the job, or None when WISP_RECOMPUTE_ASYNC is off and the recompute
+    ran right away.
+    """
+    if not household_id:
+        return None
+    if not async_enabled():
+        recompute_prorrata(household_id, period)
+        return None
+
+    pending = RecomputeJob.objects.filter(household_id=household_id, period=period, status=RecomputeJob.PENDING)
+    # The update locks the pending row, so a worker cannot claim it before this transaction commits
+    if not pending.update(requests=F('requests') + 1, updated_at=timezone.now()):
+        try:
+            with transaction.atomic():
+                return RecomputeJob.objects.create(
+                    household_id=household_id,
+                    period=period,
+                    run_after=timezone.now() + setting_delta('WISP_RECOMPUTE_DELAY_SECONDS', 2)
+                )
+        except IntegrityError:
+            # Queued by a concurrent edit in between
+            pending.update(requests=F('requests') + 1, updated_at=timezone.now())
+    return pending.get()
+
+
+def claim_job():
+    """Mark the next due job running and return it, or None if no job is due.
+
+    Jobs left running longer than WISP_RECOMPUTE_TIMEOUT_SECONDS belong to a
+    worker that died and are claimed again.
+    """
+    now = timezone.now()
+    due = (
+        Q(status=RecomputeJob.PENDING, run_after__lte=now)
+        | Q(status=RecomputeJob.RUNNING, started_at__lt=now - setting_delta('WISP_RECOMPUTE_TIMEOUT_SECONDS', 600))
+    )
+    for job_id in RecomputeJob.objects.filter(due).order_by('run_after', 'id').values_list('id', flat=True)[:10]:
+        claimed = RecomputeJob.objects.filter(due, id=job_id).update(
+            status=RecomputeJob.RUNNING,
+            started_at=now,
+            attempts=F('attempts') + 1,
+            updated_at=now
+        )
+        if claimed:
+            return RecomputeJob.objects.select_related('period').get(id=job_id)
+    return None
+
+
+def run_job(job):
+    """Run a claimed job and record its outcome; failed jobs are retried with a backoff"""
+    try:
+        job.movements = recompute_prorrata(job.household_id, job.period)
+    except Exception as e:
+        logger.exception("Recompute job %s failed", job.id)
+        job.error = repr(e)
+        job.finished_at = timezone.now()
+        job.status = RecomputeJob.FAILED
+        if job.attempts < getattr(settings, 'WISP_RECOMPUTE_MAX_ATTEMPTS', 3):
+            job.status = RecomputeJob.PENDING
+            job.run_after = job.finished_at + setting_delta('WISP_RECOMPUTE_RETRY_SECONDS', 10) * 2 ** (job.attempts - 1)
+        try:
+            with transaction.atomic():
+                job.save()
+        except IntegrityError:
+            # A newer pending job of the same period will redo the recompute
+            job.status = RecomputeJob.FAILED
+            job.save()
+        return job
+
+    job.status = RecomputeJob.DONE
+    job.error = ''
+    job.finished_at = timezone.now()
+    job.save()
+    return job
+
+
+def run_pending(limit=None):
+    """Run due jobs until none is left or `limit` ran; returns how many ran"""
+    ran = 0
+    while limit is None or ran < limit:
+        job = claim_job()
+        if job is None:
+            break
+        run_job(job)
+        ran += 1
+    return ran
+
+
+def prune_jobs():
+    """Delete finished jobs older than WISP_RECOMPUTE_JOB_RETENTION_DAYS"""
+    cutoff = timezone.now() - timedelta(days=getattr(settings, 'WISP_RECOMPUTE_JOB_RETENTION_DAYS', 7))
+    return RecomputeJob.objects.filter(
+        status__in=[RecomputeJob.DONE, RecomputeJob.FAILED],
+        finished_at__lt=cutoff
+    ).delete()[0]
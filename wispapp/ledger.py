@@ -0,0 +1,123 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+from django.utils import timezone
+from .models import Member, MemberBalance, Movement, MovementDistribution
+
+
+def refresh_balances(member_ids):
+    """Rebuild the MemberBalance rows of the given members.
+
+    Totals come from two grouped aggregates over the members' whole history,
+    written with a single upsert. Writes use add_to_balances instead; this is
+    for rebuilds and for deletes that cascade through many movements. Call it
+    inside the same transaction as the write that changed the members'
+    movements or distributions.
+    """
+    member_ids = list(set(member_ids))
+    if not member_ids:
+        return []
+
+    paid = dict(
+        Movement.objects.filter(member_id__in=member_ids)
+        .values('member_id')
+        .annotate(total=Sum('amount'))
+        .values_list('member_id', 'total')
+    )
+    owed = dict(
+        MovementDistribution.objects.filter(member_id__in=member_ids)
+        .values('member_id')
+        .annotate(total=Sum('amount'))
+        .values_list('member_id', 'total')
+    )
+
+    now = timezone.now()
+    balances = [
+        MemberBalance(
+            member_id=member_id,
+            total_paid=paid.get(member_id) or 0,
+            total_owed=owed.get(member_id) or 0,
+            updated_at=now
+        )
+        for member_id in member_ids
+    ]
+    return MemberBalance.objects.bulk_create(
+        balances,
+        update_conflicts=True,
+        unique_fields=['member'],
+        update_fields=['total_paid', 'total_owed', 'updated_at']
+    )
+
+
+def balance_changes(movements=(), distributions=(), sign=1):
+    """({member_id: paid}, {member_id: owed}) amounts of movements and distributions, times `sign`"""
+    paid = defaultdict(Decimal)
+    owed = defaultdict(Decimal)
+    for movement in movements:
+        paid[movement.member_id] += sign * Decimal(movement.amount)
+    for distribution in distributions:
+        owed[distribution.member_id] += sign * Decimal(distribution.amount)
+    return paid, owed
+
+
+def add_to_balances(paid=None, owed=None):
+    """Add {member_id: amount} changes to the paid and owed totals of the members' MemberBalance rows.
+
+    A single UPDATE whatever the members' history. Call it after the write, in
+    the same transaction: members without a row yet get it built from the
+    aggregates, which then already include the write.
+    """
+    paid = {member_id: amount for member_id, amount in (paid or {}).items() if amount}
+    owed = {member_id: amount for member_id, amount in (owed or {}).items() if amount}
+    member_ids = set(paid) | set(owed)
+    if not member_ids:
+        return
+
+    changes = {'updated_at': timezone.now()}
+    for field, amounts in [('total_paid', paid), ('total_owed', owed)]:
+        if amounts:
+            changes[field] = F(field) + Case(
+                *[When(member_id=member_id, then=Value(amount)) for member_id, amount in amounts.items()],
+                default=Value(Decimal('0')),
+                output_field=DecimalField(max_digits=12, decimal_places=2)
+            )
+    if MemberBalance.objects.filter(member_id__in=member_ids).update(**changes) < len(member_ids):
+        built = set(MemberBalance.objects.filter(member_id__in=member_ids).values_list('member_id', flat=True))
+        refresh_balances(member_ids - built)
+
+
+def reload_ledger(member):
+    """Re-read the loaded MemberBalance row of `member` after add_to_balances changed it"""
+    ledger = member.get_ledger()
+    if ledger is not None:
+        ledger.refresh_from_db(fields=['total_paid', 'total_owed', 'updated_at'])
+
+
+def movement_member_ids(movements):
+    """Members whose balances change when a queryset of movements is deleted: payers and sharers"""
+    return set(movements.values_list('member_id', flat=True)) | set(
+        MovementDistribution.objects.filter(movement__in=movements).values_list('member_id', flat=True)
+    )
+
+
+def refresh_household_balances(household_id):
+    """Rebuild the MemberBalance rows of every member of a household"""
+    member_ids = Member.objects.filter(household_id=household_id).values_list('id', flat=True)
+    return refresh_balances(member_ids)
+
+
+def ensure_ledgers(members):
+    """Build the missing MemberBalance rows of loaded members and attach them.
+
+    Members loaded with select_related('ledger') can then be serialized without
+    falling back to aggregate queries, which async views cannot run.
+    """
+    missing = defaultdict(list)
+    for member in members:
+        if member.get_ledger() is None:
+            missing[member.id].append(member)
+    if missing:
+        for balance in refresh_balances(missing):
+            for member in missing[balance.member_id]:
+                member.ledger = balance
+    return members
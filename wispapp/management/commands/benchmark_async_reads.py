@@ -0,0 +1,122 @@
+import asyncio
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from wispapp.distributions import distribute_movements
+from wispapp.models import Category, Distribution_type, Household, Member, Movement
+from wispapp.periods import period_for_date
+
+# (sync endpoint, async endpoint)
+ENDPOINTS = [
+    ('/api/movements/', '/api/async/movements/'),
+    ('/api/members/me/', '/api/async/members/me/'),
+    ('/api/members/detailed_balances/', '/api/async/members/detailed_balances/'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare requests/s of the sync (WSGI) read endpoints with their async (ASGI) "
+        "variants under concurrency. Sync requests run on a thread pool, async ones are "
+        "gathered on one event loop. A throwaway household is created and deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=20, help="Requests in flight at once")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint and mode")
+        parser.add_argument('--members', type=int, default=4, help="Members of the generated household")
+        parser.add_argument('--movements', type=int, default=200, help="Movements of the generated household")
+
+    def handle(self, *args, **options):
+        household, users = self.setup_household(options['members'], options['movements'])
+        headers = {'Authorization': f'Bearer {RefreshToken.for_user(users[0]).access_token}'}
+        concurrency = options['concurrency']
+        total = options['requests']
+        self.stdout.write(f"{connection.vendor}: {total} requests per endpoint, {concurrency} in flight")
+
+        try:
+            # The in-process test clients send requests for the 'testserver' host
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                for sync_url, async_url in ENDPOINTS:
+                    self.report(sync_url, 'sync', self.run_sync(sync_url, headers, total, concurrency))
+                    self.report(async_url, 'async', asyncio.run(self.run_async(async_url, headers, total, concurrency)))
+        finally:
+            household.delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+
+    def run_sync(self, url, headers, total, concurrency):
+        def request(_):
+            client = Client()
+            start = time.perf_counter()
+            try:
+                status = client.get(url, headers=headers).status_code
+            finally:
+                connections.close_all()
+            return time.perf_counter() - start, status
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(request, range(total)))
+        return time.perf_counter() - started, results
+
+    async def run_async(self, url, headers, total, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def request():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(url, headers=headers)
+                return time.perf_counter() - start, response.status_code
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(request() for _ in range(total)))
+        return time.perf_counter() - started, results
+
+    def report(self, url, mode, run):
+        elapsed, results = run
+        latencies = sorted(latency for latency, _ in results)
+        errors = [status for _, status in results if status != 200]
+        line = (
+            f"  {mode:5} {url:45} {len(results) / elapsed:8.1f} req/s"
+            f"  p50 {latencies[len(latencies) // 2] * 1000:7.1f} ms"
+            f"  p95 {latencies[int(len(latencies) * 0.95)] * 1000:7.1f} ms"
+        )
+        self.stdout.write(line)
+        if errors:
+            self.stdout.write(self.style.ERROR(f"        {len(errors)} failed requests ({sorted(set(errors))})"))
+
+    def setup_household(self, size, count):
+        tag = uuid.uuid4().hex[:8]
+        household = Household.objects.create(name=f'benchmark-{tag}')
+        users = []
+        for i in range(size):
+            user = User.objects.create_user(f'benchmark-{tag}-{i}')
+            Member.objects.create(user=user, name=user.username, household=household)
+            household.members.add(user)
+            users.append(user)
+
+        equal = Distribution_type.objects.get_or_create(name='equal')[0]
+        category = Category.objects.create(name=f'benchmark-{tag}', household=household, distribution_type=equal)
+        members = list(Member.objects.filter(household=household))
+        movements = []
+        for i in range(count):
+            movement_date = date(2025, i % 12 + 1, i % 28 + 1)
+            movements.append(Movement(
+                amount=100,
+                date=movement_date,
+                member=members[i % size],
+                household=household,
+                category=category,
+                period=period_for_date(movement_date),
+            ))
+        distribute_movements(Movement.objects.bulk_create(movements), members)
+        return household, users
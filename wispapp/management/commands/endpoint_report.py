@@ -0,0 +1,66 @@
+import json
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from wispapp.instrumentation import summarize
+
+SORT_KEYS = {
+    'total': 'total_ms',
+    'p95': 'p95_ms',
+    'queries': 'max_queries',
+    'db': 'avg_db_ms',
+    'serialize': 'avg_serialize_ms',
+    'size': 'avg_response_bytes',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Summarize the per request JSON lines of the wispapp.requests logger by endpoint: "
+        "latency percentiles, query counts, DB and serialization time and response size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('logs', nargs='*', help="Request log files (WISP_REQUEST_LOG), stdin when omitted")
+        parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='total', help="Column to sort endpoints by")
+        parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+
+    def handle(self, *args, **options):
+        records = []
+        for stream in self.streams(options['logs']):
+            for line in stream:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Other log lines sharing the file
+                    continue
+                if isinstance(record, dict) and 'endpoint' in record:
+                    records.append(record)
+        if not records:
+            raise CommandError("No request records found")
+
+        key = SORT_KEYS[options['sort']]
+        summary = sorted(summarize(records), key=lambda row: row[key] or 0, reverse=True)
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+
+        self.stdout.write(
+            f"{'endpoint':45} {'reqs':>6} {'p50 ms':>8} {'p95 ms':>8} {'queries':>9} {'db ms':>7} {'ser ms':>7} {'bytes':>8}"
+        )
+        for row in summary:
+            self.stdout.write(
+                f"{row['endpoint']:45} {row['requests']:>6} {row['p50_ms']:>8} {row['p95_ms']:>8} "
+                f"{row['avg_queries']:>5}/{row['max_queries']:<3} {row['avg_db_ms']:>7} {row['avg_serialize_ms']:>7} "
+                f"{row['avg_response_bytes'] if row['avg_response_bytes'] is not None else '-':>8}"
+            )
+
+    def streams(self, paths):
+        if not paths:
+            yield sys.stdin
+            return
+        for path in paths:
+            try:
+                with open(path) as stream:
+                    yield stream
+            except OSError as e:
+                raise CommandError(f"Cannot read {path}: {e}")
@@ -0,0 +1,98 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from wispapp.models import Household, Member, Movement, MovementDistribution, Salary
+
+INDEXED_MODELS = [Movement, Salary, MovementDistribution]
+
+
+class Command(BaseCommand):
+    help = (
+        "Print query plans and timings of the main household access patterns before "
+        "and after the composite indexes and the movement household column. The "
+        "'before' run drops the indexes inside a transaction that is rolled back and "
+        "uses the old join-based filters. Do not run it against a live database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--household', type=int, help="Household id to run the queries for (defaults to the one with most movements)")
+        parser.add_argument('--repeat', type=int, default=20, help="Executions per query when timing")
+
+    def handle(self, *args, **options):
+        household = self.get_household(options['household'])
+        member = Member.objects.filter(household=household).first()
+        movement = Movement.objects.filter(household=household).first()
+        if member is None or movement is None:
+            raise CommandError(f"Household {household.id} has no members or movements")
+
+        with transaction.atomic():
+            self.drop_indexes()
+            before = self.measure(self.patterns(household, member, movement, legacy=True), options['repeat'])
+            transaction.set_rollback(True)
+        after = self.measure(self.patterns(household, member, movement, legacy=False), options['repeat'])
+
+        for title in before:
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            for label, (elapsed, plan) in [('before', before[title]), ('after', after[title])]:
+                self.stdout.write(f"  {label}: {elapsed * 1000:.3f} ms/query")
+                for line in plan.splitlines():
+                    self.stdout.write(f"    {line}")
+
+    def get_household(self, household_id):
+        if household_id is not None:
+            try:
+                return Household.objects.get(pk=household_id)
+            except Household.DoesNotExist:
+                raise CommandError(f"Household {household_id} does not exist")
+        household = (
+            Household.objects.annotate(total=Count('movements'))
+            .filter(total__gt=0)
+            .order_by('-total')
+            .first()
+        )
+        if household is None:
+            raise CommandError("No household with movements found, generate some data first")
+        return household
+
+    def patterns(self, household, member, movement, legacy):
+        """The querysets behind the hot endpoints, written with or without the household column"""
+        if legacy:
+            movements = Movement.objects.filter(member__household=household)
+            distributions = MovementDistribution.objects.filter(movement__member__household=household)
+        else:
+            movements = Movement.objects.filter(household=household)
+            distributions = MovementDistribution.objects.filter(movement__household=household)
+
+        return {
+            "Movement list page": movements.order_by('-date', '-id')[:50],
+            "Movements by period": movements.filter(period=movement.period_id),
+            "Movements by category": movements.filter(category=movement.category_id),
+            "Salary by member and period": Salary.objects.filter(member=member, period=movement.period_id),
+            "Non-payer shares of a member": (
+                MovementDistribution.objects.filter(member=member, is_payer=False)
+                .values('member_id')
+                .annotate(total=Sum('amount'))
+            ),
+            "Settlement matrix": (
+                distributions.filter(is_payer=False)
+                .values('member_id', 'movement__member_id')
+                .annotate(total=Sum('amount'))
+            ),
+        }
+
+    def measure(self, patterns, repeat):
+        results = {}
+        for title, queryset in patterns.items():
+            start = time.perf_counter()
+            for _ in range(repeat):
+                list(queryset.all())
+            elapsed = (time.perf_counter() - start) / repeat
+            results[title] = (elapsed, queryset.explain())
+        return results
+
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            for model in INDEXED_MODELS:
+                for index in model._meta.indexes:
+                    cursor.execute(f"DROP INDEX {connection.ops.quote_name(index.name)}")
@@ -0,0 +1,54 @@
+import random
+import time
+import uuid
+from django.core.management.base import BaseCommand, CommandError
+from wispapp.models import Household
+from wispapp.synthetic import delete_households, generate_household
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic households: members, monthly salaries and movements of equal "
+        "and prorrata categories over several years, written through the bulk importer. "
+        "Households are named '<prefix>-<tag>-<n>' so --purge can remove them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--households', type=int, default=10)
+        parser.add_argument('--members', type=int, default=3, help="Members per household")
+        parser.add_argument('--years', type=int, default=2, help="Years of monthly periods")
+        parser.add_argument('--movements-per-month', type=int, default=30, help="Movements per household and month")
+        parser.add_argument('--start', default='2023-01', help="First period (YYYY-MM)")
+        parser.add_argument('--seed', type=int, default=None, help="Random seed, for reproducible amounts and dates")
+        parser.add_argument('--prefix', default='synthetic', help="Name prefix of the generated households")
+        parser.add_argument('--purge', action='store_true', help="Delete the households generated with --prefix and exit")
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if options['purge']:
+            deleted = delete_households(Household.objects.filter(name__startswith=f'{prefix}-'))
+            self.stdout.write(f"Deleted {deleted} households")
+            return
+        if options['members'] < 1 or options['years'] < 1:
+            raise CommandError("--members and --years must be at least 1")
+
+        rng = random.Random(options['seed'])
+        tag = uuid.uuid4().hex[:8]
+        started = time.perf_counter()
+        movements = 0
+        for index in range(options['households']):
+            household, _, report = generate_household(
+                f'{prefix}-{tag}-{index}',
+                members=options['members'],
+                months=options['years'] * 12,
+                movements_per_month=options['movements_per_month'],
+                start=options['start'],
+                rng=rng,
+            )
+            movements += report['created']
+            if report['errors']:
+                self.stdout.write(self.style.WARNING(f"{household.name}: {len(report['errors'])} rows rejected"))
+        self.stdout.write(
+            f"Generated {options['households']} households ({prefix}-{tag}-*) with "
+            f"{movements} movements in {time.perf_counter() - started:.1f}s"
+        )
@@ -0,0 +1,38 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+from wispapp.importers import FORMATS, MovementImporter, guess_format, read_rows
+from wispapp.models import Member
+
+
+class Command(BaseCommand):
+    help = "Bulk import movements for a user's household from a CSV or NDJSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - to read from stdin")
+        parser.add_argument('--user', required=True, help="Username of the member importing the movements (default payer)")
+        parser.add_argument('--format', choices=FORMATS, help="File format, guessed from the extension when omitted")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Movements written per transaction")
+
+    def handle(self, *args, **options):
+        try:
+            member = Member.objects.get(user__username=options['user'])
+        except Member.DoesNotExist:
+            raise CommandError(f"No member found for user {options['user']}")
+
+        file_format = options['format'] or guess_format(options['path'])
+        try:
+            importer = MovementImporter(member, batch_size=options['batch_size'])
+            if options['path'] == '-':
+                report = importer.run(read_rows(sys.stdin, file_format))
+            else:
+                with open(options['path'], newline='', encoding='utf-8-sig') as stream:
+                    report = importer.run(read_rows(stream, file_format))
+        except ValidationError as e:
+            raise CommandError(e.detail)
+
+        for error in report['errors']:
+            self.stderr.write(f"Row {error['row']}: {'; '.join(error['errors'])}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report['created']} movements, {len(report['errors'])} rows rejected"
+        ))
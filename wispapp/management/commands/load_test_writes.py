@@ -0,0 +1,104 @@
+import threading
+import time
+import uuid
+from datetime import date
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+from wispapp.models import Category, Distribution_type, Household, Member, Period, Salary
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure concurrent movement write throughput against the configured database. "
+        "Each thread posts movements through the API for its own member of a throwaway "
+        "household, which is deleted afterwards unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help="Concurrent writers")
+        parser.add_argument('--movements', type=int, default=50, help="Movements posted per writer")
+        parser.add_argument('--prorrata', action='store_true', help="Post prorrata movements instead of equal ones")
+        parser.add_argument('--keep', action='store_true', help="Keep the generated household")
+
+    def handle(self, *args, **options):
+        household, users, category = self.setup_household(options['threads'], options['prorrata'])
+        self.stdout.write(
+            f"{connection.vendor}: {options['threads']} writers x {options['movements']} movements"
+        )
+
+        results = []
+        lock = threading.Lock()
+
+        def writer(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            latencies, errors = [], []
+            try:
+                for i in range(options['movements']):
+                    start = time.perf_counter()
+                    response = client.post('/api/movements/', {
+                        'amount': '100.00',
+                        'date': date(2025, 5, i % 28 + 1).isoformat(),
+                        'category_id': category.id,
+                    }, format='json')
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code != 201:
+                        errors.append(response.status_code)
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                connections.close_all()
+            with lock:
+                results.append((latencies, errors))
+
+        threads = [threading.Thread(target=writer, args=(user,)) for user in users]
+        # The in-process API client sends requests for the 'testserver' host
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for thread_latencies, _ in results for latency in thread_latencies)
+        errors = [error for _, thread_errors in results for error in thread_errors]
+        written = len(latencies) - len(errors)
+        self.stdout.write(f"  written:     {written} movements in {elapsed:.2f}s")
+        self.stdout.write(f"  throughput:  {written / elapsed:.1f} movements/s")
+        if latencies:
+            self.stdout.write(f"  latency p50: {latencies[len(latencies) // 2] * 1000:.1f} ms")
+            self.stdout.write(f"  latency p95: {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms")
+            self.stdout.write(f"  latency max: {latencies[-1] * 1000:.1f} ms")
+        if errors:
+            self.stdout.write(self.style.ERROR(f"  errors:      {len(errors)} ({sorted(set(map(str, errors)))})"))
+
+        if not options['keep']:
+            household.delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+
+    def setup_household(self, size, prorrata):
+        tag = uuid.uuid4().hex[:8]
+        household = Household.objects.create(name=f'loadtest-{tag}')
+        users = []
+        for i in range(size):
+            user = User.objects.create_user(f'loadtest-{tag}-{i}')
+            Member.objects.create(user=user, name=user.username, household=household)
+            household.members.add(user)
+            users.append(user)
+
+        distribution_type = Distribution_type.objects.get_or_create(name='prorrata' if prorrata else 'equal')[0]
+        category = Category.objects.create(name=f'loadtest-{tag}', household=household, distribution_type=distribution_type)
+        if prorrata:
+            period = Period.objects.get_or_create(period='2025-04')[0]
+            Salary.objects.bulk_create([
+                Salary(member=user.member, period=period, amount=1000 * (i + 1))
+                for i, user in enumerate(users)
+            ])
+        # Reload the users with their members so the writers do not race on lazy lookups
+        users = list(User.objects.filter(id__in=[user.id for user in users]).select_related('member__household'))
+        return household, users, category
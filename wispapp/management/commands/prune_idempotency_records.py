@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from wispapp.idempotency import prune_idempotency_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete Idempotency-Key records older than WISP_IDEMPOTENCY_KEY_HOURS. "
+        "Retries after that run as new requests."
+    )
+
+    def handle(self, *args, **options):
+        deleted = prune_idempotency_records()
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} idempotency records"))
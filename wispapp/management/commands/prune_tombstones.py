@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from wispapp.sync import prune_tombstones
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete sync tombstones older than WISP_SYNC_TOMBSTONE_DAYS. "
+        "Clients with an older token get a full sync instead."
+    )
+
+    def handle(self, *args, **options):
+        deleted = prune_tombstones()
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} tombstones"))
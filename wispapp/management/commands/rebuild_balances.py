@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from wispapp.ledger import refresh_balances
+from wispapp.models import Household, Member, MemberBalance
+from wispapp.versions import household_changed
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized member balance ledger from movements and distributions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Members refreshed per upsert")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        member_ids = list(Member.objects.order_by('id').values_list('id', flat=True))
+
+        with transaction.atomic():
+            MemberBalance.objects.all().delete()
+            for start in range(0, len(member_ids), batch_size):
+                refresh_balances(member_ids[start:start + batch_size])
+            household_changed(*Household.objects.values_list('id', flat=True), period_ids=[])
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt balances for {len(member_ids)} members"))
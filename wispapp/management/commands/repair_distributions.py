@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from wispapp.ledger import refresh_balances
+from wispapp.models import Movement, MovementDistribution
+from wispapp.strategies import allocate
+from wispapp.versions import household_changed
+
+
+class Command(BaseCommand):
+    help = (
+        "Repair distributions whose shares do not add up to their movement amount. "
+        "Shares are re-allocated in exact cents proportionally to their current amounts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Movements repaired per transaction")
+        parser.add_argument('--dry-run', action='store_true', help="Only report the movements that would be repaired")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        drifted = list(
+            Movement.objects.annotate(distributed=Sum('movementdistribution__amount'))
+            .filter(distributed__isnull=False)
+            .exclude(distributed=F('amount'))
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+
+        if options['dry_run']:
+            self.stdout.write(f"{len(drifted)} movements have distributions that do not add up to their amount")
+            return
+
+        repaired_rows = 0
+        for start in range(0, len(drifted), batch_size):
+            repaired_rows += self.repair(drifted[start:start + batch_size])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Repaired {len(drifted)} movements ({repaired_rows} distribution rows updated)"
+        ))
+
+    def repair(self, movement_ids):
+        movements = Movement.objects.in_bulk(movement_ids)
+        rows = {}
+        for distribution in MovementDistribution.objects.filter(movement_id__in=movement_ids).order_by('movement_id', 'id'):
+            rows.setdefault(distribution.movement_id, []).append(distribution)
+
+        now = timezone.now()
+        to_update = []
+        for movement_id, distributions in rows.items():
+            # Refunds have negative shares: weigh by size, allocate gives the parts the movement's sign
+            weights = [abs(distribution.amount) for distribution in distributions]
+            if not any(weights):
+                # Nothing to be proportional to, split evenly
+                weights = [1] * len(distributions)
+            amounts = allocate(movements[movement_id].amount, weights)
+            for distribution, amount in zip(distributions, amounts):
+                if distribution.amount != amount:
+                    distribution.amount = amount
+                    distribution.updated_at = now
+                    to_update.append(distribution)
+
+        with transaction.atomic():
+            MovementDistribution.objects.bulk_update(to_update, ['amount', 'updated_at'])
+            refresh_balances(
+                [distribution.member_id for distributions in rows.values() for distribution in distributions]
+                + [movement.member_id for movement in movements.values()]
+            )
+            household_changed(*{movement.household_id for movement in movements.values()})
+        return len(to_update)
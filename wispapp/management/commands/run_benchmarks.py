@@ -0,0 +1,208 @@
+import json
+import logging
+import random
+import subprocess
+import time
+import uuid
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+from wispapp.instrumentation import percentile
+from wispapp.jobs import run_pending
+from wispapp.models import Category, Household, Salary
+from wispapp.synthetic import delete_households, generate_household, month_periods
+
+# Movements per request of the movement_batch path
+BATCH_SIZE = 25
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the key request paths (movement create, batch create, salary update, the prorrata recompute "
+        "job it queues, movement list, detailed balances, member me) on a generated household "
+        "and write the timings and query counts as JSON, to compare between commits. "
+        "The response cache is off unless --cache is given, so reads measure the full path."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help="Requests per path")
+        parser.add_argument('--members', type=int, default=4)
+        parser.add_argument('--years', type=int, default=2)
+        parser.add_argument('--movements-per-month', type=int, default=40)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--cache', action='store_true', help="Keep the response cache on")
+        parser.add_argument('--output', help="Write the results to this JSON file instead of stdout")
+        parser.add_argument('--compare', help="Results JSON of an earlier run to compare with")
+        parser.add_argument('--keep', action='store_true', help="Keep the generated household")
+
+    def handle(self, *args, **options):
+        if min(options['iterations'], options['members'], options['years']) < 1:
+            raise CommandError("--iterations, --members and --years must be at least 1")
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}")
+
+        months = options['years'] * 12
+        started = time.perf_counter()
+        household, users, _ = generate_household(
+            f'benchmark-{uuid.uuid4().hex[:8]}',
+            members=options['members'],
+            months=months,
+            movements_per_month=options['movements_per_month'],
+            start='2023-01',
+            rng=random.Random(options['seed']),
+        )
+        self.stderr.write(f"Generated household in {time.perf_counter() - started:.1f}s")
+
+        request_logger = logging.getLogger('wispapp.requests')
+        request_level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        try:
+            # The in-process test client sends requests for the 'testserver' host
+            with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                WISP_RESPONSE_CACHE=options['cache'],
+                WISP_RECOMPUTE_ASYNC=True,
+                WISP_RECOMPUTE_DELAY_SECONDS=0,
+            ):
+                results = self.run_paths(household, users[0], months, options['iterations'])
+        finally:
+            request_logger.setLevel(request_level)
+            if not options['keep']:
+                delete_households(Household.objects.filter(id=household.id))
+
+        report = {
+            'commit': self.git_commit(),
+            'timestamp': timezone.now().isoformat(),
+            'vendor': connection.vendor,
+            'dataset': {
+                'members': options['members'],
+                'periods': months,
+                'movements_per_month': options['movements_per_month'],
+                'seed': options['seed'],
+            },
+            'iterations': options['iterations'],
+            'response_cache': options['cache'],
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        if baseline is not None:
+            self.compare(baseline, report)
+
+    def run_paths(self, household, user, months, iterations):
+        client = Client(headers={'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'})
+        categories = list(Category.objects.filter(household=household).select_related('distribution_type'))
+        # Salaries of the second to last period split the prorrata movements of the last one
+        salary_period, last_period = month_periods('2023-01', months)[-2:]
+        salaries = list(Salary.objects.filter(member__household=household, period__period=salary_period))
+
+        def create_movement(i):
+            return client.post('/api/movements/', {
+                'amount': '42.50',
+                'date': f'{last_period}-{i % 28 + 1:02d}',
+                'category_id': categories[i % len(categories)].id,
+            }, content_type='application/json')
+
+        def create_batch(i):
+            return client.post('/api/movements/batch/', [
+                {
+                    'amount': f'{10 + n}.00',
+                    'date': f'{last_period}-{n % 28 + 1:02d}',
+                    'category_id': categories[n % len(categories)].id,
+                }
+                for n in range(BATCH_SIZE)
+            ], content_type='application/json')
+
+        def update_salary(i):
+            salary = salaries[i % len(salaries)]
+            return client.patch(
+                f'/api/salaries/{salary.id}/', {'amount': f'{3000 + i}.00'}, content_type='application/json'
+            )
+
+        def run_recompute(i):
+            # The job queued by the salary update, as the worker runs it
+            return run_pending()
+
+        # name: (request, expected status, untimed preparation)
+        paths = {
+            'movement_create': (create_movement, 201, None),
+            'salary_update_recompute': (update_salary, 200, None),
+            'recompute_job': (run_recompute, 1, update_salary),
+            'movement_list': (lambda i: client.get('/api/movements/'), 200, None),
+            'detailed_balances': (lambda i: client.get('/api/members/detailed_balances/'), 200, None),
+            'member_me': (lambda i: client.get('/api/members/me/'), 200, None),
+            # Last, so the movements it adds do not change what the other paths measure
+            'movement_batch': (create_batch, 201, None),
+        }
+        return {
+            name: self.measure(name, request, status, prepare, iterations)
+            for name, (request, status, prepare) in paths.items()
+        }
+
+    def measure(self, name, request, status, prepare, iterations):
+        # One warm-up request so connection setup and first imports are not timed
+        if prepare:
+            prepare(-1)
+        self.check_status(name, request(-1), status)
+        durations, queries = [], []
+        for i in range(iterations):
+            if prepare:
+                prepare(i)
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = request(i)
+                durations.append((time.perf_counter() - start) * 1000)
+            self.check_status(name, response, status)
+            queries.append(len(captured))
+        return {
+            'p50_ms': round(percentile(durations, 0.5), 2),
+            'p95_ms': round(percentile(durations, 0.95), 2),
+            'mean_ms': round(sum(durations) / len(durations), 2),
+            'max_ms': round(max(durations), 2),
+            'queries': percentile(queries, 0.5),
+            'max_queries': max(queries),
+        }
+
+    def check_status(self, name, outcome, expected):
+        # Responses are checked on their status code, job runs on the number of jobs run
+        actual = getattr(outcome, 'status_code', outcome)
+        if actual != expected:
+            detail = getattr(outcome, 'content', b'')[:200]
+            raise CommandError(f"{name}: expected {expected}, got {actual}: {detail!r}")
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, baseline, report):
+        self.stderr.write(f"Compared with {baseline.get('commit')} ({baseline.get('timestamp')}):")
+        for name, result in report['results'].items():
+            before = baseline.get('results', {}).get(name)
+            if before is None:
+                self.stderr.write(f"  {name:<26} new")
+                continue
+            change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0.0
+            line = (
+                f"  {name:<26} p50 {before['p50_ms']:>8.2f} -> {result['p50_ms']:>8.2f} ms ({change:+.0f}%)"
+                f"  queries {before['queries']} -> {result['queries']}"
+            )
+            style = self.style.ERROR if result['queries'] > before['queries'] or change > 20 else self.style.SUCCESS
+            self.stderr.write(style(line))
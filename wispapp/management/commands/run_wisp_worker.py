@@ -0,0 +1,36 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from wispapp.jobs import prune_jobs, run_pending
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued prorrata recomputes (see wispapp/jobs.py). Polls the job table "
+        "every --interval seconds; several workers can run side by side."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds between polls of an empty queue")
+        parser.add_argument('--once', action='store_true', help="Run the due jobs and exit")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            self.stdout.write(f"Ran {run_pending()} jobs")
+            return
+
+        self.stdout.write(f"Worker polling every {options['interval']}s")
+        pruned_at = None
+        try:
+            while True:
+                close_old_connections()
+                if pruned_at is None or time.monotonic() - pruned_at > 3600:
+                    prune_jobs()
+                    pruned_at = time.monotonic()
+                ran = run_pending(limit=100)
+                if ran:
+                    self.stdout.write(f"Ran {ran} jobs")
+                else:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Worker stopped")
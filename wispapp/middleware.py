@@ -0,0 +1,100 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.middleware.clickjacking import XFrameOptionsMiddleware
+from django.middleware.common import CommonMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+from django.middleware.security import SecurityMiddleware
+
+# Async-native versions of Django's stock middlewares.
+#
+# Under ASGI Django runs the hooks of sync middlewares through
+# sync_to_async(thread_sensitive=True): two thread hops per middleware and one
+# per process_view, every request, all queued on the same thread. That thread
+# then caps the throughput of the async views. These hooks only read headers and
+# cookies and set attributes, so they run inline on the event loop instead.
+# The few that can reach the database (saving a changed session or queued
+# messages, sessions-backed CSRF) still go through a thread when they do.
+# Under WSGI they behave exactly like Django's.
+
+
+class InlineHooksMixin:
+    """Run a MiddlewareMixin's hooks on the event loop under ASGI.
+
+    Subclasses override `hook_blocks` to send a hook through a thread when it
+    may do I/O for this request.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if self.async_mode and hasattr(self, 'process_view'):
+            # Django calls coroutine view hooks without a thread
+            self.process_view = self.aprocess_view
+
+    def hook_blocks(self, hook, request, response=None):
+        return False
+
+    async def run_hook(self, hook, request, *args):
+        method = getattr(self, hook)
+        if self.hook_blocks(hook, request, *args[:1]):
+            return await sync_to_async(method, thread_sensitive=True)(request, *args)
+        return method(request, *args)
+
+    async def __acall__(self, request):
+        response = None
+        if hasattr(self, 'process_request'):
+            response = await self.run_hook('process_request', request)
+        response = response or await self.get_response(request)
+        if hasattr(self, 'process_response'):
+            response = await self.run_hook('process_response', request, response)
+        return response
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        if self.hook_blocks('process_view', request):
+            return await sync_to_async(type(self).process_view, thread_sensitive=True)(
+                self, request, view_func, view_args, view_kwargs
+            )
+        return type(self).process_view(self, request, view_func, view_args, view_kwargs)
+
+
+class AsyncCommonMiddleware(InlineHooksMixin, CommonMiddleware):
+    pass
+
+
+class AsyncSecurityMiddleware(InlineHooksMixin, SecurityMiddleware):
+    pass
+
+
+class AsyncSessionMiddleware(InlineHooksMixin, SessionMiddleware):
+    """Loads sessions lazily like Django's, and only saves changed ones, in a thread"""
+
+    def hook_blocks(self, hook, request, response=None):
+        session = getattr(request, 'session', None)
+        return hook == 'process_response' and session is not None and (
+            session.modified or settings.SESSION_SAVE_EVERY_REQUEST
+        )
+
+
+class AsyncCsrfViewMiddleware(InlineHooksMixin, CsrfViewMiddleware):
+    """Cookie-based CSRF runs inline; CSRF_USE_SESSIONS reads the session, in a thread"""
+
+    def hook_blocks(self, hook, request, response=None):
+        return settings.CSRF_USE_SESSIONS
+
+
+class AsyncAuthenticationMiddleware(InlineHooksMixin, AuthenticationMiddleware):
+    pass
+
+
+class AsyncMessageMiddleware(InlineHooksMixin, MessageMiddleware):
+    """Messages are stored, possibly in the session, only when the request read or added some"""
+
+    def hook_blocks(self, hook, request, response=None):
+        storage = getattr(request, '_messages', None)
+        return hook == 'process_response' and storage is not None and (storage.used or storage.added_new)
+
+
+class AsyncXFrameOptionsMiddleware(InlineHooksMixin, XFrameOptionsMiddleware):
+    pass
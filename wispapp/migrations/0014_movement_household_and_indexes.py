@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_movement_household(apps, schema_editor):
+    Member = apps.get_model("wispapp", "Member")
+    Movement = apps.get_model("wispapp", "Movement")
+    Movement.objects.update(
+        household_id=Subquery(
+            Member.objects.filter(pk=OuterRef("member_id")).values("household_id")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("wispapp", "0013_memberbalance"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="movement",
+            name="household",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="movements",
+                to="wispapp.household",
+            ),
+        ),
+        migrations.RunPython(backfill_movement_household, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="movement",
+            index=models.Index(
+                fields=["household", "date", "id"], name="movement_household_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="movement",
+            index=models.Index(
+                fields=["household", "period"], name="movement_household_period_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="movement",
+            index=models.Index(
+                fields=["household", "category"], name="movement_household_cat_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="salary",
+            index=models.Index(
+                fields=["period", "member"], name="salary_period_member_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:37
+
+import calendar
+from datetime import date
+
+import django.core.validators
+from django.db import migrations, models
+
+
+def parse_month(period_str):
+    """(year, month) of a period string, or None if it is not a valid month"""
+    try:
+        year, month = map(int, period_str.split("-"))
+        date(year, month, 1)
+    except ValueError:
+        return None
+    return year, month
+
+
+def merge_and_backfill_periods(apps, schema_editor):
+    """Merge periods of the same month into their oldest row, then normalize it to YYYY-MM and fill start/end"""
+    Period = apps.get_model("wispapp", "Period")
+    Movement = apps.get_model("wispapp", "Movement")
+    Salary = apps.get_model("wispapp", "Salary")
+
+    # '2025-4' and '2025-04' are the same month; unparseable strings only merge with themselves
+    keepers = {}
+    for period in Period.objects.order_by("id"):
+        keeper = keepers.setdefault(parse_month(period.period) or period.period, period)
+        if keeper.id != period.id:
+            Movement.objects.filter(period_id=period.id).update(period_id=keeper.id)
+            Salary.objects.filter(period_id=period.id).update(period_id=keeper.id)
+            period.delete()
+
+    for key, period in keepers.items():
+        if not isinstance(key, tuple):
+            continue
+        year, month = key
+        period.period = f"{year:04d}-{month:02d}"
+        period.start = date(year, month, 1)
+        period.end = date(year, month, calendar.monthrange(year, month)[1])
+        period.save(update_fields=["period", "start", "end"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("wispapp", "0014_movement_household_and_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="period",
+            name="end",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="period",
+            name="start",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.RunPython(merge_and_backfill_periods, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="period",
+            name="start",
+            field=models.DateField(blank=True, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name="period",
+            name="period",
+            field=models.CharField(
+                max_length=100,
+                unique=True,
+                validators=[
+                    django.core.validators.RegexValidator(
+                        "^\\d{4}-(0[1-9]|1[0-2])$",
+                        "Period must be formatted as YYYY-MM",
+                    )
+                ],
+            ),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:39
+
+from django.db import migrations, models
+
+
+def add_distribution_types(apps, schema_editor):
+    Distribution_type = apps.get_model("wispapp", "Distribution_type")
+    for name in ["equal", "prorrata", "fixed", "exclude", "custom"]:
+        Distribution_type.objects.get_or_create(name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("wispapp", "0015_period_calendar_bounds"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="distribution_weights",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(add_distribution_types, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:47
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("wispapp", "0016_distribution_strategies"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="household",
+            name="change_version",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="household",
+            name="changed_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:51
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("wispapp", "0017_household_change_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Tombstone",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "object_type",
+                    models.CharField(
+                        choices=[
+                            ("movement", "Movement"),
+                            ("distribution", "Distribution"),
+                            ("salary", "Salary"),
+                            ("category", "Category"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("object_id", models.BigIntegerField()),
+                ("deleted_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="movementdistribution",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name="salary",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name="movement",
+            index=models.Index(
+                fields=["household", "updated_at"], name="movement_household_sync_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="movementdistribution",
+            index=models.Index(fields=["updated_at"], name="distribution_sync_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="salary",
+            index=models.Index(fields=["updated_at"], name="salary_sync_idx"),
+        ),
+        migrations.AddField(
+            model_name="tombstone",
+            name="household",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="tombstones",
+                to="wispapp.household",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="tombstone",
+            index=models.Index(
+                fields=["household", "deleted_at"], name="tombstone_household_idx"
+            ),
+        ),
+    ]
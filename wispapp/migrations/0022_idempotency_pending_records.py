@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:46
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wispapp', '0021_period_versions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='idempotencyrecord',
+            name='response_body',
+            field=models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+        migrations.AlterField(
+            model_name='idempotencyrecord',
+            name='status_code',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+    ]
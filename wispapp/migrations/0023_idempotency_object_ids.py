@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wispapp', '0022_idempotency_pending_records'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencyrecord',
+            name='object_ids',
+            field=models.JSONField(default=list),
+        ),
+    ]
@@ -1,10 +1,29 @@
+import calendar
+from datetime import date
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.validators import RegexValidator
 from django.db.models import Sum
+from django.utils import timezone
+
+
+def month_bounds(period_str):
+    """First and last day of a YYYY-MM period string, or (None, None) if it is not one"""
+    try:
+        year, month = map(int, period_str.split('-'))
+        return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+    except (AttributeError, ValueError):
+        return None, None
 
 class Household(models.Model):
     name = models.CharField(max_length=255)
     members = models.ManyToManyField(User, related_name='households')
+    # Bumped by every write to the household's data, see versions.household_changed
+    change_version = models.PositiveBigIntegerField(default=0)
+    changed_at = models.DateTimeField(default=timezone.now)
+    # Last write to data shared by every period (categories, members), keys the cached period summaries
+    shared_changed_at = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
         return self.name
@@ -17,9 +36,19 @@ class Member(models.Model):
     def __str__(self):
         return self.name
 
+    def get_ledger(self):
+        """Materialized balance row for this member, or None if it has not been built yet"""
+        try:
+            return self.ledger
+        except MemberBalance.DoesNotExist:
+            return None
+
     @property
     def total_owed(self):
         """Sum of all movement distributions where this member is responsible for a share"""
+        ledger = self.get_ledger()
+        if ledger is not None:
+            return ledger.total_owed
         return MovementDistribution.objects.filter(
             member=self
         ).aggregate(total=Sum('amount'))['total'] or 0
@@ -27,6 +56,9 @@ class Member(models.Model):
     @property
     def total_paid(self):
         """Sum of all movements where this member was the payer"""
+        ledger = self.get_ledger()
+        if ledger is not None:
+            return ledger.total_paid
         return Movement.objects.filter(
             member=self
         ).aggregate(total=Sum('amount'))['total'] or 0
@@ -48,6 +80,8 @@ class Category(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     distribution_type = models.ForeignKey(Distribution_type, on_delete=models.CASCADE, default=1)
+    # {member_id: weight} used by the 'fixed' distribution type
+    distribution_weights = models.JSONField(null=True, blank=True)
 
     class Meta:
         verbose_name_plural = "Categories"
@@ -57,7 +91,14 @@ class Category(models.Model):
         return f"{self.name} ({self.household.name})"
 
 class Period(models.Model):
-    period = models.CharField(max_length=100)
+    period = models.CharField(max_length=100, unique=True, validators=[RegexValidator(r'^\d{4}-(0[1-9]|1[0-2])$', "Period must be formatted as YYYY-MM")])
+    # Calendar bounds of the month, derived from `period` on save
+    start = models.DateField(unique=True, null=True, blank=True)
+    end = models.DateField(null=True, blank=True)
+
+    def save(self, *args, **kwargs):
+        self.start, self.end = month_bounds(self.period)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.period
@@ -69,9 +110,19 @@ class Movement(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='movements')
     description = models.TextField(blank=True, null=True)
     period = models.ForeignKey(Period, on_delete=models.CASCADE, default=0)
+    # Denormalized from member.household so household filters do not need a join
+    household = models.ForeignKey(Household, on_delete=models.CASCADE, null=True, blank=True, related_name='movements')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['household', 'date', 'id'], name='movement_household_date_idx'),
+            models.Index(fields=['household', 'period'], name='movement_household_period_idx'),
+            models.Index(fields=['household', 'category'], name='movement_household_cat_idx'),
+            models.Index(fields=['household', 'updated_at'], name='movement_household_sync_idx'),
+        ]
+
     def __str__(self):
         return f"{self.member.name} - ${self.amount} - {self.category.name}"
 
@@ -79,6 +130,13 @@ class Salary(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     period = models.ForeignKey(Period, on_delete=models.CASCADE, default=0)
     member = models.ForeignKey(Member, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['period', 'member'], name='salary_period_member_idx'),
+            models.Index(fields=['updated_at'], name='salary_sync_idx'),
+        ]
 
     def __str__(self):
         return f'Salary for {self.member} during {self.period}'
@@ -88,4 +146,138 @@ class MovementDistribution(models.Model):
     member = models.ForeignKey(Member, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     is_payer = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Set explicitly by bulk_update callers, which bypass auto_now
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], name='distribution_sync_idx'),
+        ]
+
+class MemberBalance(models.Model):
+    """Denormalized totals behind Member.total_paid / total_owed, maintained by wispapp.ledger"""
+    member = models.OneToOneField(Member, on_delete=models.CASCADE, related_name='ledger')
+    total_paid = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_owed = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Balance for {self.member}'
+
+class Tombstone(models.Model):
+    """A deleted household row, kept so the sync endpoint can tell clients to drop it"""
+    MOVEMENT = 'movement'
+    DISTRIBUTION = 'distribution'
+    SALARY = 'salary'
+    CATEGORY = 'category'
+    OBJECT_TYPES = [
+        (MOVEMENT, 'Movement'),
+        (DISTRIBUTION, 'Distribution'),
+        (SALARY, 'Salary'),
+        (CATEGORY, 'Category'),
+    ]
+
+    household = models.ForeignKey(Household, on_delete=models.CASCADE, related_name='tombstones')
+    object_type = models.CharField(max_length=20, choices=OBJECT_TYPES)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['household', 'deleted_at'], name='tombstone_household_idx'),
+        ]
+
+    def __str__(self):
+        return f'Deleted {self.object_type} {self.object_id}'
+
+
+class PeriodVersion(models.Model):
+    """Bumped by every write to the movements or distributions of a household period.
+
+    Cached period summaries are keyed on it, so writes from any process, the
+    recompute worker included, invalidate them whatever the cache backend.
+    """
+    household = models.ForeignKey(Household, on_delete=models.CASCADE, related_name='period_versions')
+    period = models.ForeignKey(Period, on_delete=models.CASCADE, related_name='household_versions')
+    version = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['household', 'period'], name='period_version_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.period} of household {self.household_id} at version {self.version}'
+
+
+class RecomputeJob(models.Model):
+    """Queued recompute of the prorrata distributions split with the salaries of a period.
+
+    There is at most one pending job per (household, period): salary edits made
+    while one is waiting join it instead of queueing another recompute.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    household = models.ForeignKey(Household, on_delete=models.CASCADE, related_name='recompute_jobs')
+    period = models.ForeignKey(Period, on_delete=models.CASCADE, related_name='recompute_jobs')
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    requests = models.PositiveIntegerField(default=1)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    movements = models.PositiveIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['household', 'period'],
+                condition=models.Q(status='pending'),
+                name='recompute_job_pending_unique'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='recompute_job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f'Recompute {self.period} of household {self.household_id} ({self.status})'
+
+
+class IdempotencyRecord(models.Model):
+    """Idempotency-Key of a committed write and its response, replayed to retries of it"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_records')
+    key = models.CharField(max_length=255)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    # Empty while the response of the committed write is being serialized
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response_body = models.JSONField(encoder=DjangoJSONEncoder, null=True)
+    # Primary keys of the created rows, to rebuild a response that was never stored
+    object_ids = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='idempotency_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.method} {self.path} ({self.key})'
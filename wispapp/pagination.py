@@ -0,0 +1,66 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.pagination import CursorPagination
+
+
+class WispCursorPagination(CursorPagination):
+    """Keyset pagination: each page is a range scan from the cursor, whatever the history depth.
+
+    The default page size comes from the WISP_PAGE_SIZE setting, read on every
+    request, and clients can ask for a different one with ?page_size=, up to
+    max_page_size.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def get_page_size(self, request):
+        self.page_size = default_page_size()
+        return super().get_page_size(request)
+
+
+class MovementCursorPagination(WispCursorPagination):
+    ordering = ('-date', '-id')
+
+
+class SalaryCursorPagination(WispCursorPagination):
+    # Calendar order: needs the queryset annotated with period_start
+    ordering = ('-period_start', '-id')
+
+
+class RecomputeJobCursorPagination(WispCursorPagination):
+    ordering = ('-id',)
+
+
+def encode_movement_cursor(movement):
+    """Opaque cursor pointing after `movement` in ('-date', '-id') order"""
+    return urlsafe_b64encode(f'{movement.date.isoformat()}|{movement.id}'.encode()).decode()
+
+
+def decode_movement_cursor(cursor):
+    """(date, id) of an encode_movement_cursor value, raising ValueError when invalid"""
+    movement_date, movement_id = urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return date.fromisoformat(movement_date), int(movement_id)
+
+
+def movements_after(queryset, cursor):
+    """Movements of `queryset` that come after `cursor` in ('-date', '-id') order"""
+    ordered = queryset.order_by(*MovementCursorPagination.ordering)
+    if not cursor:
+        return ordered
+    movement_date, movement_id = decode_movement_cursor(cursor)
+    return ordered.filter(Q(date__lt=movement_date) | Q(date=movement_date, id__lt=movement_id))
+
+
+def default_page_size():
+    return getattr(settings, 'WISP_PAGE_SIZE', 50)
+
+
+def requested_page_size(query_params):
+    """?page_size= clamped to WispCursorPagination's limits"""
+    try:
+        size = int(query_params.get(WispCursorPagination.page_size_query_param, default_page_size()))
+    except ValueError:
+        return default_page_size()
+    return max(1, min(size, WispCursorPagination.max_page_size))
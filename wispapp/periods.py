@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import serializers
+from .models import Period, month_bounds
+
+
+def shift_period_string(period_str, months):
+    """Shift a period string (YYYY-MM) by a number of months"""
+    year, month = map(int, period_str.split('-'))
+    index = year * 12 + (month - 1) + months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+class PeriodCache:
+    """Period rows keyed by their YYYY-MM string, kept in the Django cache.
+
+    Saved and deleted periods are dropped from the cache, so every process sharing
+    the cache backend sees the change. The default local memory cache is per
+    process: run several processes (web workers, run_wisp_worker) with a shared
+    WISP_CACHE_BACKEND, or each keeps the periods it cached for up to
+    WISP_PERIOD_CACHE_TIMEOUT seconds after another one renamed or deleted them.
+    """
+    prefix = 'wisp:period'
+
+    def key(self, period_str):
+        return f'{self.prefix}:{period_str}'
+
+    def id_key(self, period_id):
+        # The string a period id is cached under, to drop it after a rename
+        return f'{self.prefix}-id:{period_id}'
+
+    def timeout(self):
+        return getattr(settings, 'WISP_PERIOD_CACHE_TIMEOUT', 300)
+
+    def get(self, period_str):
+        return cache.get(self.key(period_str))
+
+    def put(self, period):
+        cache.set_many({self.key(period.period): period, self.id_key(period.id): period.period}, self.timeout())
+
+    def discard(self, period):
+        """Drop `period` under its current string and under the one its id was cached with"""
+        cached_str = cache.get(self.id_key(period.id))
+        keys = {self.key(period.period), self.id_key(period.id)}
+        if cached_str is not None:
+            keys.add(self.key(cached_str))
+        cache.delete_many(list(keys))
+
+
+period_cache = PeriodCache()
+
+
+def get_period(period_str):
+    """Period row for a YYYY-MM string, created if needed and cached.
+
+    Rows are only cached once the transaction that read or created them commits,
+    so a rolled back period never ends up in the cache.
+    """
+    period = period_cache.get(period_str)
+    if period is None:
+        period = Period.objects.get_or_create(period=period_str)[0]
+        transaction.on_commit(lambda: period_cache.put(period))
+    return period
+
+
+def period_for_date(day):
+    """Period containing a date"""
+    return get_period(day.strftime('%Y-%m'))
+
+
+def period_offset(period, months):
+    """Period `months` months away from `period` (negative for earlier ones)"""
+    return get_period(shift_period_string(period.period, months))
+
+
+def periods_between(start=None, end=None):
+    """Periods from `start` to `end` (YYYY-MM strings, both optional and included), matched on calendar bounds"""
+    periods = Period.objects.all()
+    if start:
+        first_day = month_bounds(start)[0]
+        if first_day is None:
+            raise serializers.ValidationError(f"Invalid start period {start!r}, expected YYYY-MM")
+        periods = periods.filter(start__gte=first_day)
+    if end:
+        last_day = month_bounds(end)[1]
+        if last_day is None:
+            raise serializers.ValidationError(f"Invalid end period {end!r}, expected YYYY-MM")
+        periods = periods.filter(end__lte=last_day)
+    return periods
+
+
+@receiver(post_save, sender=Period)
+@receiver(post_delete, sender=Period)
+def invalidate_period(sender, instance, **kwargs):
+    # Dropped right away for this transaction, and again on commit in case another
+    # process cached the old row in between
+    period_cache.discard(instance)
+    transaction.on_commit(lambda: period_cache.discard(instance))
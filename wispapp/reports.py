@@ -0,0 +1,68 @@
+from django.db.models import Count, Sum
+from .models import Movement, MovementDistribution
+
+
+def period_summary(household_id, periods):
+    """Totals of a household's movements over the given periods.
+
+    Returns totals by period, by category, by distribution type, paid by member
+    and owed by member. Distribution type totals are rolled up from the category
+    ones, so this is four grouped aggregates regardless of the number of
+    movements or periods.
+    """
+    movements = Movement.objects.filter(household_id=household_id, period__in=periods)
+
+    by_category = list(
+        movements.values('category_id', 'category__name', 'category__distribution_type__name')
+        .annotate(total=Sum('amount'), count=Count('id'))
+        .order_by('category__name')
+    )
+    by_period = list(
+        movements.values('period_id', 'period__period')
+        .annotate(total=Sum('amount'), count=Count('id'))
+        .order_by('period__period')
+    )
+    paid_by_member = list(
+        movements.values('member_id', 'member__name')
+        .annotate(total=Sum('amount'), count=Count('id'))
+        .order_by('member__name')
+    )
+    owed_by_member = list(
+        MovementDistribution.objects.filter(movement__household_id=household_id, movement__period__in=periods)
+        .values('member_id', 'member__name')
+        .annotate(total=Sum('amount'))
+        .order_by('member__name')
+    )
+
+    # Distribution type totals are a roll-up of the category totals
+    by_distribution_type = {}
+    for row in by_category:
+        name = row['category__distribution_type__name']
+        entry = by_distribution_type.setdefault(name, {'distribution_type': name, 'total': 0, 'count': 0})
+        entry['total'] += row['total']
+        entry['count'] += row['count']
+
+    return {
+        'total': float(sum(row['total'] for row in by_category)),
+        'count': sum(row['count'] for row in by_category),
+        'by_period': [
+            {'period': {'id': row['period_id'], 'period': row['period__period']}, 'total': float(row['total']), 'count': row['count']}
+            for row in by_period
+        ],
+        'by_category': [
+            {'category': {'id': row['category_id'], 'name': row['category__name']}, 'total': float(row['total']), 'count': row['count']}
+            for row in by_category
+        ],
+        'by_distribution_type': [
+            {'distribution_type': entry['distribution_type'], 'total': float(entry['total']), 'count': entry['count']}
+            for entry in sorted(by_distribution_type.values(), key=lambda entry: entry['distribution_type'])
+        ],
+        'paid_by_member': [
+            {'member': {'id': row['member_id'], 'name': row['member__name']}, 'total': float(row['total']), 'count': row['count']}
+            for row in paid_by_member
+        ],
+        'owed_by_member': [
+            {'member': {'id': row['member_id'], 'name': row['member__name']}, 'total': float(row['total'])}
+            for row in owed_by_member
+        ],
+    }
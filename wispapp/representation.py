@@ -0,0 +1,69 @@
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+# ?fields= and ?expand= on API reads.
+#
+# Serializers list their nested objects in `expandable_fields`. Lists render them
+# slim, as the related id plus a few flat names, unless the request expands them
+# with ?expand=member,category. Other reads and writes render them nested.
+# ?fields=id,amount keeps only the given fields of a read.
+
+
+def parse_names(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+def representation_options(query_params, slim=False):
+    """Serializer context for the ?fields= and ?expand= of a request"""
+    return {
+        'fields': parse_names(query_params.get('fields')) or None,
+        'expand': parse_names(query_params.get('expand')),
+        'slim': slim,
+    }
+
+
+class DynamicFieldsMixin:
+    """Serializer whose fields follow the `fields`, `expand` and `slim` options of its context.
+
+    `expandable_fields` maps each nested field to the flat fields that stand in
+    for it when it is not expanded, as {name: source}. The options only apply to
+    the top level serializer (or the child of a top level list), so expanded
+    objects render in full.
+    """
+    expandable_fields = {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        parent = self.parent
+        if parent is not None and not (isinstance(parent, serializers.ListSerializer) and parent.parent is None):
+            return fields
+
+        if self.context.get('slim'):
+            expand = self.context.get('expand') or set()
+            for name, flat_fields in self.expandable_fields.items():
+                if name in expand or name not in fields:
+                    continue
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+                for flat_name, source in flat_fields.items():
+                    fields[flat_name] = serializers.CharField(source=source, read_only=True, allow_null=True)
+
+        only = self.context.get('fields')
+        if only:
+            fields = {name: field for name, field in fields.items() if field.write_only or name in only}
+        return fields
+
+
+class DynamicFieldsViewMixin:
+    """Pass ?fields= and ?expand= to the viewset's serializers; lists render slim by default"""
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context.update(representation_options(self.request.query_params, slim=self.action == 'list'))
+        if self.request.method not in SAFE_METHODS:
+            # ?fields= would drop writable fields from validation
+            context['fields'] = None
+        return context
+
+    def expanded(self, name):
+        """Whether the responses of this request render the nested `name`, to select_related what they read"""
+        return self.action != 'list' or name in parse_names(self.request.query_params.get('expand'))
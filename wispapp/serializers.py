@@ -1,15 +1,21 @@
 from rest_framework import serializers
-from .models import Movement, Member, Category, Distribution_type, Salary, Period, Household, MovementDistribution
-from django.db.models import Sum
-from datetime import datetime, timedelta
+from .models import Movement, Member, Category, Distribution_type, Salary, Period, Household, MovementDistribution, RecomputeJob
+from django.db import transaction
 from django.contrib.auth.models import User
+from .distributions import build_distributions, replace_distributions, save_distributions, split_options
+from .idempotency import save_record
+from .jobs import enqueue_recompute
+from .ledger import reload_ledger
+from .periods import period_for_date
+from .representation import DynamicFieldsMixin
+from .versions import household_changed
 
 class HouseholdSerializer(serializers.ModelSerializer):
     class Meta:
         model = Household
         fields = ['id', 'name']
 
-class MemberSerializer(serializers.ModelSerializer):
+class MemberSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     household = HouseholdSerializer(read_only=True)
     total_owed = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     total_paid = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
@@ -19,25 +25,59 @@ class MemberSerializer(serializers.ModelSerializer):
         model = Member
         fields = ['id', 'name', 'household', 'total_owed', 'total_paid', 'balance']
 
+    expandable_fields = {'household': {'household_name': 'household.name'}}
+
 class DistributionTypeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Distribution_type
         fields = ['id', 'name']
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     distribution_type = DistributionTypeSerializer(read_only=True)
+    distribution_type_id = serializers.PrimaryKeyRelatedField(
+        queryset=Distribution_type.objects.all(),
+        source='distribution_type',
+        write_only=True,
+        required=False
+    )
 
     class Meta:
         model = Category
-        fields = ['id', 'name', 'household', 'distribution_type', 'created_at', 'updated_at']
+        fields = ['id', 'name', 'household', 'distribution_type', 'distribution_type_id', 'distribution_weights', 'created_at', 'updated_at']
         read_only_fields = ['household', 'created_at', 'updated_at']
 
+    expandable_fields = {'distribution_type': {'distribution_type_name': 'distribution_type.name'}}
+
+    def validate_distribution_weights(self, value):
+        # Weights of the 'fixed' distribution type: {member id: positive number}
+        if value is None:
+            return value
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("Distribution weights must map member ids to weights")
+        if self.instance is not None:
+            household_id = self.instance.household_id
+        else:
+            household_id = self.context['request'].user.member.household_id
+        member_ids = set(Member.objects.filter(household_id=household_id).values_list('id', flat=True))
+        weights = {}
+        for member_id, weight in value.items():
+            try:
+                member_id = int(member_id)
+            except (TypeError, ValueError):
+                raise serializers.ValidationError(f"{member_id!r} is not a member id")
+            if member_id not in member_ids:
+                raise serializers.ValidationError(f"Member {member_id} does not belong to the household")
+            if isinstance(weight, bool) or not isinstance(weight, (int, float)) or not weight > 0:
+                raise serializers.ValidationError(f"The weight of member {member_id} must be a positive number")
+            weights[str(member_id)] = weight
+        return weights
+
 class PeriodSerializer(serializers.ModelSerializer):
     class Meta:
         model = Period
         fields = ['id', 'period']
 
-class SalarySerializer(serializers.ModelSerializer):
+class SalarySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     period = PeriodSerializer(read_only=True)
     member = MemberSerializer(read_only=True)
     period_id = serializers.PrimaryKeyRelatedField(
@@ -55,15 +95,20 @@ class SalarySerializer(serializers.ModelSerializer):
         model = Salary
         fields = ['id', 'amount', 'period', 'member', 'period_id', 'member_id']
 
+    expandable_fields = {
+        'period': {'period_name': 'period.period'},
+        'member': {'member_name': 'member.name'},
+    }
+
     def create(self, validated_data):
         # Get the current user's member instance to verify household access
         request = self.context.get('request')
         if request and hasattr(request, 'user'):
-            current_member = Member.objects.get(user=request.user)
+            current_member = request.user.member
             member = validated_data.get('member')
             
             # Verify that the member belongs to the same household
-            if member.household != current_member.household:
+            if member.household_id != current_member.household_id:
                 raise serializers.ValidationError("You can only create salaries for members in your household")
             
             return super().create(validated_data)
@@ -73,91 +118,69 @@ class SalarySerializer(serializers.ModelSerializer):
         # Get the current user's member instance to verify household access
         request = self.context.get('request')
         if request and hasattr(request, 'user'):
-            current_member = Member.objects.get(user=request.user)
+            current_member = request.user.member
             member = validated_data.get('member', instance.member)
             
             # Verify that the member belongs to the same household
-            if member.household != current_member.household:
+            if member.household_id != current_member.household_id:
                 raise serializers.ValidationError("You can only update salaries for members in your household")
         
+        previous_period = instance.period
         # Update the salary
         updated_salary = super().update(instance, validated_data)
         
-        # Get the household and period
-        household = updated_salary.member.household
-        period = updated_salary.period
-        
-        # Get all prorrata movements in this period for this household
-        prorrata_movements = Movement.objects.filter(
-            member__household=household,
-            period=period,
-            category__distribution_type__name='prorrata'
-        )
-        
-        # Get total household salary for the period
-        total_salary = Salary.objects.filter(
-            member__household=household,
-            period=period
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        if total_salary == 0:
-            return updated_salary
-        
-        # Update distributions for each movement
-        for movement in prorrata_movements:
-            # Delete existing distributions
-            MovementDistribution.objects.filter(movement=movement).delete()
-            
-            # Get all household members
-            household_members = Member.objects.filter(household=household)
-            
-            # Create new distributions based on updated salary proportions
-            for household_member in household_members:
-                member_salary = Salary.objects.filter(
-                    member=household_member,
-                    period=period
-                ).first()
-                
-                if not member_salary:
-                    continue
-                
-                # Calculate new proportional share
-                share_amount = (member_salary.amount / total_salary) * movement.amount
-                
-                MovementDistribution.objects.create(
-                    movement=movement,
-                    member=household_member,
-                    amount=share_amount,
-                    is_payer=(household_member == movement.member)
-                )
+        # Queue the recompute of the prorrata movements split with this period's salaries
+        # (and of the period it was moved from); the view returns the jobs
+        jobs = [
+            enqueue_recompute(updated_salary.member.household_id, period)
+            for period in {previous_period, updated_salary.period}
+        ]
+        self.recompute_jobs = [job for job in jobs if job is not None]
         
         return updated_salary
 
-class MovementSerializer(serializers.ModelSerializer):
+class RecomputeJobSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    period = PeriodSerializer(read_only=True)
+
+    class Meta:
+        model = RecomputeJob
+        fields = [
+            'id', 'period', 'status', 'requests', 'attempts', 'movements', 'error',
+            'created_at', 'run_after', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
+
+    expandable_fields = {'period': {'period_name': 'period.period'}}
+
+
+class MovementSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     period = serializers.PrimaryKeyRelatedField(read_only=True)
     member = MemberSerializer(read_only=True)
     category = CategorySerializer(read_only=True)
     category_id = serializers.PrimaryKeyRelatedField(
-        queryset=Category.objects.all(),
+        queryset=Category.objects.select_related('distribution_type'),
         source='category',
         write_only=True
     )
+    # Options for the 'exclude' and 'custom' distribution types
+    excluded_member_ids = serializers.ListField(child=serializers.IntegerField(), write_only=True, required=False)
+    shares = serializers.DictField(
+        child=serializers.DecimalField(max_digits=10, decimal_places=2),
+        write_only=True,
+        required=False
+    )
 
     class Meta:
         model = Movement
-        fields = ['id', 'amount', 'date', 'member', 'category', 'category_id', 'description', 'period', 'created_at', 'updated_at']
+        fields = ['id', 'amount', 'date', 'member', 'category', 'category_id', 'description', 'period', 'excluded_member_ids', 'shares', 'created_at', 'updated_at']
         read_only_fields = ['member', 'created_at', 'updated_at']
 
-    def get_previous_period(self, current_period):
-        """Get the previous period based on the current period string (YYYY-MM)"""
-        year, month = map(int, current_period.period.split('-'))
-        if month == 1:
-            year -= 1
-            month = 12
-        else:
-            month -= 1
-        previous_period_str = f"{year:04d}-{month:02d}"
-        return Period.objects.get_or_create(period=previous_period_str)[0]
+    expandable_fields = {
+        'member': {'member_name': 'member.name'},
+        'category': {'category_name': 'category.name', 'distribution_type': 'category.distribution_type.name'},
+    }
+    # Updating any of these splits the movement again
+    split_fields = ['amount', 'category', 'date']
 
     def create(self, validated_data):
         # Get the current user's member instance
@@ -165,75 +188,71 @@ class MovementSerializer(serializers.ModelSerializer):
         if not request or not hasattr(request, 'user'):
             raise serializers.ValidationError("User context is required")
         
-        member = Member.objects.get(user=request.user)
+        member = request.user.member
         validated_data['member'] = member
+        validated_data['household_id'] = member.household_id
         
-        # Infer period from date
-        movement_date = validated_data['date']
-        period_str = movement_date.strftime('%Y-%m')
+        # Per-movement options of the distribution strategy
+        options = {
+            'excluded_member_ids': validated_data.pop('excluded_member_ids', None),
+            'shares': validated_data.pop('shares', None),
+        }
         
-        # Get or create the period
-        period, created = Period.objects.get_or_create(period=period_str)
-        validated_data['period'] = period
+        # Infer period from date
+        validated_data['period'] = period_for_date(validated_data['date'])
         
-        # Create the movement
-        movement = super().create(validated_data)
+        # Split the movement before writing anything, so an invalid split (e.g. missing
+        # salaries) leaves no orphan movement and no lock is held while salaries are read
+        movement = Movement(**validated_data)
+        members = list(Member.objects.filter(household_id=member.household_id))
+        distributions = build_distributions([movement], members, [options])
         
-        # Get all members in the household
-        household_members = Member.objects.filter(household=member.household)
-        total_members = household_members.count()
+        # Write the movement and its distributions in a single transaction
+        with transaction.atomic():
+            movement.save()
+            save_distributions([movement], members, distributions)
+            save_record(request, [movement])
         
-        # Get the distribution type
-        distribution_type = movement.category.distribution_type.name
-        
-        if distribution_type == 'equal':
-            # Equal distribution: divide amount equally among all members
-            share_amount = movement.amount / total_members
-            for household_member in household_members:
-                MovementDistribution.objects.create(
-                    movement=movement,
-                    member=household_member,
-                    amount=share_amount,
-                    is_payer=(household_member == member)
-                )
-                
-        elif distribution_type == 'prorrata':
-            # Get the previous period for salary calculations
-            previous_period = self.get_previous_period(period)
-            
-            # Get total household salary for the previous period
-            total_salary = Salary.objects.filter(
-                member__household=member.household,
-                period=previous_period
-            ).aggregate(total=Sum('amount'))['total'] or 0
-            
-            if total_salary == 0:
-                raise serializers.ValidationError(f"Cannot create prorrata distribution: no salaries found for the previous period ({previous_period.period})")
-            
-            # Create distribution based on salary proportions from previous period
-            for household_member in household_members:
-                member_salary = Salary.objects.filter(
-                    member=household_member,
-                    period=previous_period
-                ).first()
-                
-                if not member_salary:
-                    raise serializers.ValidationError(f"No salary found for member {household_member.name} in the previous period ({previous_period.period})")
-                
-                # Calculate proportional share
-                share_amount = (member_salary.amount / total_salary) * movement.amount
-                
-                MovementDistribution.objects.create(
-                    movement=movement,
-                    member=household_member,
-                    amount=share_amount,
-                    is_payer=(household_member == member)
-                )
-        else:
-            raise serializers.ValidationError(f"Unknown distribution type: {distribution_type}")
+        # The ledger was loaded with request.user, before save_distributions added to it
+        reload_ledger(member)
         
         return movement
 
+    def update(self, instance, validated_data):
+        options = {
+            'excluded_member_ids': validated_data.pop('excluded_member_ids', None),
+            'shares': validated_data.pop('shares', None),
+        }
+        if 'date' in validated_data:
+            validated_data['period'] = period_for_date(validated_data['date'])
+        resplit = any(options.values()) or any(
+            getattr(instance, field) != validated_data[field]
+            for field in self.split_fields if field in validated_data
+        )
+        previous_period_id, previous_category_id = instance.period_id, instance.category_id
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+
+        if not resplit:
+            with transaction.atomic():
+                instance.save()
+                household_changed(instance.household_id, period_ids=[instance.period_id])
+            return instance
+
+        # Split before writing, as on create. Without new options a movement of the
+        # same category keeps the members and shares it was split with; recomputes
+        # only rewrite salary-based splits, so these options can be read unlocked.
+        members = list(Member.objects.filter(household_id=instance.household_id))
+        if not any(options.values()) and instance.category_id == previous_category_id:
+            options = split_options(MovementDistribution.objects.filter(movement=instance), members)
+        distributions = build_distributions([instance], members, [options])
+
+        with transaction.atomic():
+            replace_distributions(instance, members, distributions)
+            household_changed(instance.household_id, period_ids=[previous_period_id])
+        reload_ledger(instance.member)
+        return instance
+
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
 
@@ -0,0 +1,141 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db.models import Sum
+from .models import MovementDistribution
+
+CENT = Decimal('0.01')
+
+
+def pairwise_rows(household_id):
+    """(debtor_id, creditor_id, total) rows of the gross matrix, as a single grouped aggregate"""
+    return (
+        MovementDistribution.objects.filter(
+            movement__household_id=household_id,
+            is_payer=False
+        )
+        .values('member_id', 'movement__member_id')
+        .annotate(total=Sum('amount'))
+        .values_list('member_id', 'movement__member_id', 'total')
+    )
+
+
+def build_matrix(rows):
+    """Fold pairwise_rows into {debtor_id: {creditor_id: amount}}"""
+    matrix = defaultdict(dict)
+    for debtor_id, creditor_id, total in rows:
+        if debtor_id != creditor_id:
+            matrix[debtor_id][creditor_id] = total
+    return matrix
+
+
+def pairwise_matrix(household_id):
+    """Gross amounts owed between household members, as {debtor_id: {creditor_id: amount}}.
+
+    A member owes the payer of a movement their non-payer share of it. The whole
+    matrix comes from a single grouped aggregate.
+    """
+    return build_matrix(pairwise_rows(household_id))
+
+
+async def apairwise_matrix(household_id):
+    """Async version of pairwise_matrix"""
+    return build_matrix([row async for row in pairwise_rows(household_id)])
+
+
+def member_balances(current_member, members, matrix):
+    """What `current_member` owes and is owed by each other member, read from the gross matrix"""
+    balances = []
+    for member in members:
+        if member.id == current_member.id:
+            continue
+
+        # How much the current member owes this member, and the other way around
+        owed_to_member = matrix.get(current_member.id, {}).get(member.id, 0)
+        member_owes = matrix.get(member.id, {}).get(current_member.id, 0)
+
+        balances.append({
+            'member': {
+                'id': member.id,
+                'name': member.name
+            },
+            'you_owe': float(owed_to_member),
+            'owes_you': float(member_owes),
+            'net_balance': float(member_owes - owed_to_member)
+        })
+    return balances
+
+
+def net_balances(matrix):
+    """Net position per member: positive means the household owes them money"""
+    net = defaultdict(Decimal)
+    for debtor_id, row in matrix.items():
+        for creditor_id, amount in row.items():
+            net[debtor_id] -= amount
+            net[creditor_id] += amount
+    return net
+
+
+def minimal_transfers(net):
+    """Settle net positions with at most N - 1 transfers.
+
+    Repeatedly matches the largest debtor with the largest creditor. Amounts are
+    rounded to cents. Returns a list of (from_id, to_id, amount).
+    """
+    creditors = sorted(
+        ((amount.quantize(CENT), member_id) for member_id, amount in net.items() if amount.quantize(CENT) > 0),
+        reverse=True
+    )
+    debtors = sorted(
+        ((-amount.quantize(CENT), member_id) for member_id, amount in net.items() if amount.quantize(CENT) < 0),
+        reverse=True
+    )
+
+    transfers = []
+    i = j = 0
+    while i < len(debtors) and j < len(creditors):
+        debt, debtor_id = debtors[i]
+        credit, creditor_id = creditors[j]
+        amount = min(debt, credit)
+        transfers.append((debtor_id, creditor_id, amount))
+        debtors[i] = (debt - amount, debtor_id)
+        creditors[j] = (credit - amount, creditor_id)
+        if debtors[i][0] == 0:
+            i += 1
+        if creditors[j][0] == 0:
+            j += 1
+    return transfers
+
+
+def household_settlement(household_id, members):
+    """Full settlement report for a household: member net balances, gross matrix and transfers"""
+    matrix = pairwise_matrix(household_id)
+    net = net_balances(matrix)
+    names = {member.id: member.name for member in members}
+
+    return {
+        'members': [
+            {
+                'id': member.id,
+                'name': member.name,
+                'net_balance': float(net.get(member.id, 0))
+            }
+            for member in members
+        ],
+        'matrix': [
+            {
+                'from': debtor_id,
+                'to': creditor_id,
+                'amount': float(amount)
+            }
+            for debtor_id, row in sorted(matrix.items())
+            for creditor_id, amount in sorted(row.items())
+        ],
+        'transfers': [
+            {
+                'from': {'id': debtor_id, 'name': names.get(debtor_id)},
+                'to': {'id': creditor_id, 'name': names.get(creditor_id)},
+                'amount': float(amount)
+            }
+            for debtor_id, creditor_id, amount in minimal_transfers(net)
+        ]
+    }
@@ -0,0 +1,139 @@
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from rest_framework import serializers
+
+# Distribution_type name -> strategy function
+STRATEGIES = {}
+
+
+def register_strategy(name, uses_salaries=False):
+    """Register a distribution strategy for categories whose distribution type is `name`.
+
+    A strategy is called as strategy(movement, members, context) and returns the
+    shares of every member in one call, as a list of (member, amount) pairs.
+    `context` holds:
+
+    - salaries: {member_id: salary} of the period before the movement, only
+      loaded for strategies registered with uses_salaries=True
+    - salary_period: the Period those salaries belong to
+    - options: per-movement options given when the movement was created
+      (excluded_member_ids, shares)
+
+    Strategies registered with uses_salaries=True are also recomputed when a
+    salary of their period changes.
+    """
+    def decorator(strategy):
+        strategy.uses_salaries = uses_salaries
+        STRATEGIES[name] = strategy
+        return strategy
+    return decorator
+
+
+def get_strategy(name):
+    try:
+        return STRATEGIES[name]
+    except KeyError:
+        raise serializers.ValidationError(f"Unknown distribution type: {name}")
+
+
+def salary_based_types():
+    """Names of the distribution types whose shares depend on salaries"""
+    return [name for name, strategy in STRATEGIES.items() if strategy.uses_salaries]
+
+
+def allocate(amount, weights):
+    """Split `amount` into cents proportionally to `weights` with largest-remainder rounding.
+
+    Every part is a whole number of cents and the parts always add up exactly to
+    `amount`. Leftover cents go to the largest fractional remainders, ties to the
+    earliest weight. Returns a list of Decimals aligned with `weights`.
+    """
+    weights = [Decimal(weight) for weight in weights]
+    total_weight = sum(weights)
+    if not weights or total_weight <= 0:
+        raise serializers.ValidationError("Cannot split an amount without positive weights")
+
+    total_cents = int((abs(Decimal(amount)) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+    sign = -1 if amount < 0 else 1
+    cents = []
+    remainders = []
+    for index, weight in enumerate(weights):
+        whole, remainder = divmod(total_cents * weight, total_weight)
+        cents.append(int(whole))
+        remainders.append((-remainder, index))
+    for _, index in sorted(remainders)[:total_cents - sum(cents)]:
+        cents[index] += 1
+    return [sign * Decimal(part).scaleb(-2) for part in cents]
+
+
+def weighted_shares(amount, members, weights):
+    """Split `amount` proportionally to {member_id: weight}, members without a weight get nothing"""
+    weighted = [member for member in members if member.id in weights]
+    parts = allocate(amount, [weights[member.id] for member in weighted])
+    return list(zip(weighted, parts))
+
+
+@register_strategy('equal')
+def equal(movement, members, context):
+    """Divide the amount equally among all members"""
+    return weighted_shares(movement.amount, members, {member.id: 1 for member in members})
+
+
+@register_strategy('prorrata', uses_salaries=True)
+def prorrata(movement, members, context):
+    """Divide the amount proportionally to the salaries of the previous period"""
+    salaries = context.get('salaries') or {}
+    salary_period = context.get('salary_period')
+    if sum(salaries.values()) == 0:
+        raise serializers.ValidationError(f"Cannot create prorrata distribution: no salaries found for the previous period ({salary_period})")
+    for member in members:
+        if member.id not in salaries:
+            raise serializers.ValidationError(f"No salary found for member {member.name} in the previous period ({salary_period})")
+    return weighted_shares(movement.amount, members, salaries)
+
+
+@register_strategy('fixed')
+def fixed_weight(movement, members, context):
+    """Divide the amount with the fixed per-member weights configured on the category"""
+    try:
+        weights = {
+            int(member_id): Decimal(str(weight))
+            for member_id, weight in (movement.category.distribution_weights or {}).items()
+        }
+    except (AttributeError, TypeError, ValueError, InvalidOperation):
+        raise serializers.ValidationError(f"Category {movement.category.name} has invalid distribution weights")
+    weights = {member.id: weights[member.id] for member in members if weights.get(member.id, 0) > 0}
+    if not weights:
+        raise serializers.ValidationError(f"Category {movement.category.name} has no distribution weights for the household members")
+    return weighted_shares(movement.amount, members, weights)
+
+
+@register_strategy('exclude')
+def exclude_members(movement, members, context):
+    """Divide the amount equally among the members not excluded from the movement"""
+    excluded = set(context.get('options', {}).get('excluded_member_ids') or [])
+    included = [member for member in members if member.id not in excluded]
+    if not included:
+        raise serializers.ValidationError("At least one household member must share the movement")
+    return weighted_shares(movement.amount, included, {member.id: 1 for member in included})
+
+
+@register_strategy('custom')
+def custom_shares(movement, members, context):
+    """Use the explicit per-member amounts given with the movement, of its sign and adding up to its amount"""
+    shares = context.get('options', {}).get('shares') or {}
+    if not shares:
+        raise serializers.ValidationError("Custom distributions require the shares of each member")
+    members_by_id = {member.id: member for member in members}
+    try:
+        shares = {int(member_id): Decimal(str(amount)) for member_id, amount in shares.items()}
+    except (TypeError, ValueError, InvalidOperation):
+        raise serializers.ValidationError("Shares must map member ids to amounts")
+    unknown = [member_id for member_id in shares if member_id not in members_by_id]
+    if unknown:
+        raise serializers.ValidationError(f"Members {unknown} do not belong to the household")
+    opposite = [member_id for member_id, amount in shares.items() if amount and (amount < 0) != (movement.amount < 0)]
+    if opposite:
+        raise serializers.ValidationError(f"Shares of members {opposite} must have the sign of the movement amount")
+    if sum(shares.values()) != movement.amount:
+        raise serializers.ValidationError(f"Shares add up to {sum(shares.values())} instead of the movement amount {movement.amount}")
+    return [(members_by_id[member_id], amount) for member_id, amount in shares.items()]
@@ -0,0 +1,170 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import serializers
+from .models import Category, Movement, MovementDistribution, Salary, Tombstone
+
+# Delta sync for offline clients.
+#
+# A sync token holds the household, its change version and the time of the sync
+# that issued it. When the version has not moved, nothing changed and no query
+# runs. A token of another household (the member moved) gets a full sync.
+# Otherwise rows updated since the token time are returned, reading back an
+# overlap window so rows written by transactions that committed after the
+# previous sync are not missed. Clients apply rows by id, so rows sent twice
+# are harmless.
+
+# Tombstone object type -> key of its ids in the response
+DELETED_KEYS = {
+    Tombstone.MOVEMENT: 'movements',
+    Tombstone.DISTRIBUTION: 'distributions',
+    Tombstone.SALARY: 'salaries',
+    Tombstone.CATEGORY: 'categories',
+}
+
+
+class SyncMovementSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Movement
+        fields = ['id', 'amount', 'date', 'member', 'category', 'period', 'description', 'created_at', 'updated_at']
+
+
+class SyncDistributionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MovementDistribution
+        fields = ['id', 'movement', 'member', 'amount', 'is_payer', 'created_at', 'updated_at']
+
+
+class SyncSalarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Salary
+        fields = ['id', 'amount', 'period', 'member', 'updated_at']
+
+
+class SyncCategorySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Category
+        fields = ['id', 'name', 'distribution_type', 'distribution_weights', 'created_at', 'updated_at']
+
+
+def overlap():
+    return timedelta(seconds=getattr(settings, 'WISP_SYNC_OVERLAP_SECONDS', 60))
+
+
+def tombstone_retention():
+    return timedelta(days=getattr(settings, 'WISP_SYNC_TOMBSTONE_DAYS', 90))
+
+
+def encode_token(household_id, version, moment):
+    return urlsafe_b64encode(f'{household_id}|{version}|{moment.isoformat()}'.encode()).decode()
+
+
+def decode_token(token):
+    """(household_id, change_version, datetime) of a sync token.
+
+    Tokens issued before they held the household decode with a None household.
+    """
+    try:
+        parts = urlsafe_b64decode(token.encode()).decode().split('|')
+        household_id = int(parts.pop(0)) if len(parts) == 3 else None
+        version, moment = parts
+        version, moment = int(version), datetime.fromisoformat(moment)
+    except ValueError:
+        raise serializers.ValidationError(f"Invalid sync token: {token!r}")
+    if timezone.is_naive(moment):
+        raise serializers.ValidationError(f"Invalid sync token: {token!r}")
+    return household_id, version, moment
+
+
+def record_deletions(household_id, object_type, ids):
+    """Leave tombstones for deleted rows of a household; call it in the deleting transaction"""
+    if not household_id:
+        return []
+    now = timezone.now()
+    return Tombstone.objects.bulk_create([
+        Tombstone(household_id=household_id, object_type=object_type, object_id=object_id, deleted_at=now)
+        for object_id in ids
+    ])
+
+
+def record_movement_deletions(household_id, movements):
+    """Tombstones for a queryset of movements about to be deleted and for their distributions"""
+    movement_ids = list(movements.values_list('id', flat=True))
+    record_deletions(household_id, Tombstone.MOVEMENT, movement_ids)
+    record_deletions(
+        household_id,
+        Tombstone.DISTRIBUTION,
+        MovementDistribution.objects.filter(movement_id__in=movement_ids).values_list('id', flat=True)
+    )
+
+
+def member_moved(member, previous_household_id):
+    """A member changed household: their salaries leave the previous household and join the new one"""
+    salaries = Salary.objects.filter(member=member)
+    record_deletions(previous_household_id, Tombstone.SALARY, salaries.values_list('id', flat=True))
+    salaries.update(updated_at=timezone.now())
+
+
+def prune_tombstones():
+    """Delete tombstones older than the retention; tokens older than it get a full sync"""
+    return Tombstone.objects.filter(deleted_at__lt=timezone.now() - tombstone_retention()).delete()[0]
+
+
+def household_changes(household, since=None):
+    """Rows of `household` changed since the `since` token, or all of them without one.
+
+    Returns the response body of the sync endpoint: a new token, whether this is
+    a full sync the client should replace its data with, the changed rows and
+    the ids of deleted rows.
+    """
+    now = timezone.now()
+    token = encode_token(household.id, household.change_version, now)
+    changed_since = None
+    if since:
+        household_id, version, moment = decode_token(since)
+        if household_id != household.id:
+            # Issued for another household: the client's data is not a base for a delta
+            moment = None
+        elif version == household.change_version:
+            # Keep the client's token so its window does not move past writes still in flight
+            return empty_changes(since)
+        if moment is not None and moment > now - tombstone_retention():
+            changed_since = moment - overlap()
+
+    movements = Movement.objects.filter(household_id=household.id)
+    distributions = MovementDistribution.objects.filter(movement__household_id=household.id)
+    salaries = Salary.objects.filter(member__household_id=household.id)
+    categories = Category.objects.filter(household_id=household.id)
+    deleted = {key: [] for key in DELETED_KEYS.values()}
+
+    if changed_since is not None:
+        movements = movements.filter(updated_at__gt=changed_since)
+        distributions = distributions.filter(updated_at__gt=changed_since)
+        salaries = salaries.filter(updated_at__gt=changed_since)
+        categories = categories.filter(updated_at__gt=changed_since)
+        tombstones = Tombstone.objects.filter(household_id=household.id, deleted_at__gt=changed_since)
+        for object_type, object_id in tombstones.values_list('object_type', 'object_id'):
+            deleted[DELETED_KEYS[object_type]].append(object_id)
+
+    return {
+        'token': token,
+        'full': changed_since is None,
+        'movements': SyncMovementSerializer(movements.order_by('id'), many=True).data,
+        'distributions': SyncDistributionSerializer(distributions.order_by('id'), many=True).data,
+        'salaries': SyncSalarySerializer(salaries.order_by('id'), many=True).data,
+        'categories': SyncCategorySerializer(categories.order_by('id'), many=True).data,
+        'deleted': deleted,
+    }
+
+
+def empty_changes(token):
+    return {
+        'token': token,
+        'full': False,
+        'movements': [],
+        'distributions': [],
+        'salaries': [],
+        'categories': [],
+        'deleted': {key: [] for key in DELETED_KEYS.values()},
+    }
@@ -0,0 +1,96 @@
+import calendar
+import random
+from datetime import date
+from decimal import Decimal
+from django.contrib.auth.models import User
+from .importers import MovementImporter
+from .models import Category, Distribution_type, Household, Member, Salary
+from .periods import get_period, shift_period_string
+
+# Synthetic household data for benchmarks and load tests.
+
+# (category, distribution type, movements per month or None for the rest, amount range)
+CATEGORY_SPECS = [
+    ('Rent', 'prorrata', 1, (800, 2000)),
+    ('Utilities', 'prorrata', 2, (40, 250)),
+    ('Groceries', 'equal', None, (5, 150)),
+    ('Restaurants', 'equal', None, (15, 120)),
+    ('Transport', 'equal', None, (2, 60)),
+]
+
+
+def month_periods(start, months):
+    """`months` consecutive YYYY-MM strings from `start`"""
+    return [shift_period_string(start, offset) for offset in range(months)]
+
+
+def movement_rows(members, categories, periods, per_month, rng):
+    """Import rows for `per_month` movements in every period, paid by random members"""
+    spread = [spec for spec in CATEGORY_SPECS if spec[2] is None]
+    for period_str in periods:
+        year, month = map(int, period_str.split('-'))
+        days = calendar.monthrange(year, month)[1]
+        specs = [spec for spec in CATEGORY_SPECS for _ in range(spec[2] or 0)]
+        specs += [rng.choice(spread) for _ in range(max(per_month - len(specs), 0))]
+        for name, _, _, (low, high) in specs:
+            yield {
+                'date': date(year, month, rng.randint(1, days)).isoformat(),
+                'amount': f'{rng.uniform(low, high):.2f}',
+                'category': categories[name].name,
+                'member': rng.choice(members).name,
+                'description': f'{name} {period_str}',
+            }
+
+
+def generate_household(name, members=3, months=24, movements_per_month=30, start='2023-01', rng=None):
+    """Create a household with members, monthly salaries and movements over `months` periods.
+
+    Salaries start one month before the movements, since prorrata movements are
+    split with the previous month's salaries. Movements go through the bulk
+    importer, so distributions, balances and the change version are maintained
+    as in production. Returns (household, users, import report).
+    """
+    rng = rng or random.Random()
+    household = Household.objects.create(name=name)
+    users = []
+    for index in range(members):
+        user = User.objects.create_user(f'{name}-{index}')
+        Member.objects.create(user=user, name=user.username, household=household)
+        users.append(user)
+    household.members.add(*users)
+    household_members = list(Member.objects.filter(household=household).order_by('id'))
+
+    types = {
+        type_name: Distribution_type.objects.get_or_create(name=type_name)[0]
+        for type_name in {spec[1] for spec in CATEGORY_SPECS}
+    }
+    categories = {
+        spec[0]: Category(name=spec[0], household=household, distribution_type=types[spec[1]])
+        for spec in CATEGORY_SPECS
+    }
+    Category.objects.bulk_create(categories.values())
+
+    base_salaries = {member.id: rng.randrange(1500, 6000) for member in household_members}
+    Salary.objects.bulk_create([
+        Salary(
+            member=member,
+            period=get_period(period_str),
+            amount=Decimal(base_salaries[member.id] * rng.uniform(0.95, 1.05)).quantize(Decimal('0.01'))
+        )
+        for period_str in month_periods(shift_period_string(start, -1), months + 1)
+        for member in household_members
+    ])
+
+    rows = movement_rows(household_members, categories, month_periods(start, months), movements_per_month, rng)
+    importer = MovementImporter(household_members[0])
+    report = importer.run((line_number, row, None) for line_number, row in enumerate(rows, start=1))
+    return household, users, report
+
+
+def delete_households(households):
+    """Delete generated households with their users"""
+    user_ids = list(User.objects.filter(member__household__in=households).values_list('id', flat=True))
+    count = households.count()
+    households.delete()
+    User.objects.filter(id__in=user_ids).delete()
+    return count
@@ -1,3 +1,1226 @@
-from django.test import TestCase
+import asyncio
+import csv
+import importlib
+import json
+import logging
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+import tempfile
+from base64 import urlsafe_b64encode
+from unittest import mock
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.handlers.base import BaseHandler
+from django.test import AsyncClient, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+from .caching import reset_stats, stats
+from .instrumentation import InstrumentationMiddleware
+from .distributions import recompute_prorrata
+from .idempotency import fingerprint
+from .jobs import run_pending
+from .models import (
+    Category, Distribution_type, Household, IdempotencyRecord, Member, MemberBalance, Movement, MovementDistribution, Period,
+    RecomputeJob, Salary, Tombstone
+)
+from .periods import get_period, period_cache
+from .settlements import minimal_transfers
+from .strategies import allocate
+from .synthetic import generate_household
+from .versions import household_changed
 
-# Create your tests here.
+
+class WispTestCase(APITestCase):
+    """Household with three members, an equal and a prorrata category and salaries for 2025-04"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Keep the per request log lines out of the test output
+        request_logger = logging.getLogger('wispapp.requests')
+        cls.addClassCleanup(request_logger.setLevel, request_logger.level)
+        request_logger.setLevel(logging.ERROR)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.household = Household.objects.create(name='Home')
+        cls.equal = Distribution_type.objects.get_or_create(name='equal')[0]
+        cls.prorrata = Distribution_type.objects.get_or_create(name='prorrata')[0]
+        cls.users = []
+        for i, salary in enumerate([1000, 2000, 3000]):
+            user = User.objects.create_user(f'user{i}', password='secret')
+            member = Member.objects.create(user=user, name=f'user{i}', household=cls.household)
+            cls.household.members.add(user)
+            Salary.objects.create(
+                member=member,
+                period=Period.objects.get_or_create(period='2025-04')[0],
+                amount=salary
+            )
+            cls.users.append(user)
+        cls.food = Category.objects.create(name='Food', household=cls.household, distribution_type=cls.equal)
+        cls.rent = Category.objects.create(name='Rent', household=cls.household, distribution_type=cls.prorrata)
+
+    def setUp(self):
+        # Caches are keyed on ids, which are reused between tests
+        cache.clear()
+
+    def authenticate(self, user=None):
+        # Go through JWT authentication like real clients, so budgets include resolving the user
+        token = RefreshToken.for_user(user or self.users[0]).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def create_movement(self, category, amount='90.00', movement_date=date(2025, 5, 10), user=None):
+        self.authenticate(user)
+        # Run the on_commit hooks (cache invalidation) as a real commit would
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/movements/', {
+                'amount': amount,
+                'date': movement_date.isoformat(),
+                'category_id': category.id
+            }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return Movement.objects.get(pk=response.data['id'])
+
+    def assertLedgersMatch(self):
+        """Every MemberBalance row equals the aggregates it materializes"""
+        balances = MemberBalance.objects.all()
+        self.assertTrue(balances)
+        for balance in balances:
+            paid = Movement.objects.filter(member_id=balance.member_id).aggregate(total=Sum('amount'))['total']
+            owed = MovementDistribution.objects.filter(member_id=balance.member_id).aggregate(total=Sum('amount'))['total']
+            self.assertEqual((balance.total_paid, balance.total_owed), (paid or 0, owed or 0), balance.member)
+
+
+class QueryBudgetTests(WispTestCase):
+    """Read endpoints must cost a fixed number of queries, whatever the amount of data"""
+
+    # Budgets include the authentication query, which also loads the member and household
+    budgets = {
+        '/api/movements/': 2,
+        '/api/members/': 2,
+        '/api/members/me/': 1,
+        '/api/members/detailed_balances/': 3,
+        '/api/salaries/': 2,
+        '/api/categories/': 2,
+        '/api/async/movements/': 2,
+        '/api/async/members/me/': 1,
+        '/api/async/members/detailed_balances/': 3,
+    }
+
+    def count_queries(self, url):
+        self.authenticate()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(queries)
+
+    def assert_budget(self, url, budget):
+        count = self.count_queries(url)
+        self.assertLessEqual(count, budget, f"{url} ran {count} queries, budget is {budget}")
+        return count
+
+    def test_list_endpoints_stay_within_budget(self):
+        for category in [self.food, self.rent]:
+            self.create_movement(category)
+        for url, budget in self.budgets.items():
+            with self.subTest(url=url):
+                self.assert_budget(url, budget)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.create_movement(self.food)
+        counts = {url: self.count_queries(url) for url in self.budgets}
+        for _ in range(5):
+            self.create_movement(self.food)
+            self.create_movement(self.rent)
+        for url in self.budgets:
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), counts[url])
+
+    def test_movement_retrieve_within_budget(self):
+        movement = self.create_movement(self.rent)
+        self.assert_budget(f'/api/movements/{movement.id}/', 2)
+
+    def test_period_summaries_within_budget(self):
+        movement = self.create_movement(self.food)
+        self.create_movement(self.rent)
+        # Including the period versions, which key the response cache
+        self.assert_budget(f'/api/periods/{movement.period_id}/summary/', 7)
+        # The range also lists its period ids
+        self.assert_budget('/api/periods/summary/?start=2025-01&end=2025-12', 7)
+
+    def test_household_balances_within_budget(self):
+        self.create_movement(self.food)
+        self.assert_budget(f'/api/households/{self.household.id}/balances/', 4)
+
+
+class PaginationTests(WispTestCase):
+
+    def test_movements_are_cursor_paginated_by_date(self):
+        for day in range(1, 6):
+            self.create_movement(self.food, movement_date=date(2025, 5, day))
+        self.authenticate()
+
+        ids = []
+        url = '/api/movements/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 2)
+            ids += [movement['id'] for movement in response.data['results']]
+            url = response.data['next']
+
+        expected = list(Movement.objects.order_by('-date', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+
+    def test_salaries_are_paginated_by_month(self):
+        # Created out of calendar order, so period ids do not follow the months
+        for period_str in ['2025-06', '2024-12', '2025-01']:
+            period = Period.objects.create(period=period_str)
+            for user in self.users:
+                Salary.objects.create(member=user.member, period=period, amount=1000)
+        self.authenticate()
+
+        months = []
+        url = '/api/salaries/'
+        with override_settings(WISP_PAGE_SIZE=5):
+            while url:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(len(response.data['results']), 5)
+                months += [salary['period_name'] for salary in response.data['results']]
+                url = response.data['next']
+
+        self.assertEqual(months, sorted(months, reverse=True))
+        self.assertEqual(len(months), 12)
+
+    def test_salaries_without_household_are_an_empty_page(self):
+        user = User.objects.create_user('loner', password='secret')
+        Member.objects.create(user=user, name='loner')
+        self.authenticate(user)
+
+        response = self.client.get('/api/salaries/')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['results'], [])
+
+
+class AsyncViewTests(WispTestCase):
+
+    def test_async_endpoints_match_sync_ones(self):
+        for day in range(1, 4):
+            self.create_movement(self.food, movement_date=date(2025, 5, day))
+        self.create_movement(self.rent)
+        self.authenticate()
+        for path in [
+            'movements/?page_size=2',
+            'movements/?expand=member,category&fields=id,member,category',
+            'members/me/',
+            'members/detailed_balances/'
+        ]:
+            with self.subTest(path=path):
+                expected = self.client.get(f'/api/{path}').json()
+                response = self.client.get(f'/api/async/{path}')
+                self.assertEqual(response.status_code, 200, response.content)
+                if 'results' in expected:
+                    self.assertEqual(response.json()['results'], expected['results'])
+                else:
+                    self.assertEqual(response.json(), expected)
+
+    def test_async_movements_follow_cursor(self):
+        for day in range(1, 6):
+            self.create_movement(self.food, movement_date=date(2025, 5, day))
+        self.authenticate()
+        ids = []
+        url = '/api/async/movements/?page_size=2'
+        while url:
+            response = self.client.get(url).json()
+            ids += [movement['id'] for movement in response['results']]
+            url = response['next']
+        self.assertEqual(ids, list(Movement.objects.order_by('-date', '-id').values_list('id', flat=True)))
+
+    async def test_async_requests_do_not_hop_through_middlewares(self):
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.users[0]).access_token))()
+        # The client builds its middleware chain, and the view hooks Django would wrap, here
+        with mock.patch('django.core.handlers.base.sync_to_async', wraps=sync_to_async) as handler_hops, \
+                mock.patch('django.utils.deprecation.sync_to_async', wraps=sync_to_async) as middleware_hops:
+            response = await AsyncClient().get('/api/async/members/me/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(handler_hops.called)
+        self.assertFalse(middleware_hops.called)
+
+    def test_async_reads_share_the_sync_cache(self):
+        self.create_movement(self.food)
+        self.authenticate()
+        reset_stats()
+        self.client.get('/api/members/detailed_balances/')
+        response = self.client.get('/api/async/members/detailed_balances/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(stats()['detailed_balances'], {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_async_endpoints_require_a_token(self):
+        self.assertEqual(self.client.get('/api/async/members/me/').status_code, 401)
+
+
+class RepresentationTests(WispTestCase):
+
+    def test_lists_are_slim_unless_expanded(self):
+        movement = self.create_movement(self.rent)
+        row = self.client.get('/api/movements/').data['results'][0]
+        self.assertEqual(row['member'], self.users[0].member.id)
+        self.assertEqual(
+            (row['member_name'], row['category'], row['category_name'], row['distribution_type']),
+            ('user0', self.rent.id, 'Rent', 'prorrata')
+        )
+
+        row = self.client.get('/api/movements/?expand=member').data['results'][0]
+        self.assertEqual(row['member']['household']['name'], 'Home')
+        self.assertEqual(row['category'], self.rent.id)
+        self.assertNotIn('member_name', row)
+
+        # Single objects stay nested
+        self.assertEqual(self.client.get(f'/api/movements/{movement.id}/').data['category']['name'], 'Rent')
+
+    def test_fields_selects_the_rendered_fields(self):
+        self.create_movement(self.food)
+        row = self.client.get('/api/movements/?fields=id,amount,category_name').data['results'][0]
+        self.assertEqual(set(row), {'id', 'amount', 'category_name'})
+        salary = self.client.get('/api/salaries/?fields=amount,member_name').data['results'][0]
+        self.assertEqual(set(salary), {'amount', 'member_name'})
+
+
+class ConditionalGetTests(WispTestCase):
+
+    def test_unchanged_reads_answer_not_modified(self):
+        self.create_movement(self.food)
+        for url in ['/api/movements/', '/api/members/', '/api/members/detailed_balances/', '/api/async/movements/']:
+            with self.subTest(url=url):
+                self.authenticate()
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                etag = response['ETag']
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                # Only the authentication query
+                self.assertEqual(len(queries), 1)
+
+    def test_writes_change_the_etag(self):
+        self.authenticate()
+        etag = self.client.get('/api/movements/')['ETag']
+        self.create_movement(self.rent)
+        response = self.client.get('/api/movements/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # Changed during the current second: only the ETag is reliable
+        self.assertNotIn('Last-Modified', response)
+        Household.objects.filter(pk=self.household.pk).update(changed_at=timezone.now() - timedelta(seconds=10))
+        response = self.client.get('/api/movements/')
+        last_modified = response['Last-Modified']
+        self.assertEqual(self.client.get('/api/movements/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        self.client.patch(f'/api/categories/{self.food.id}/', {'name': 'Groceries'}, format='json')
+        response = self.client.get('/api/movements/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+
+    def test_renaming_shared_rows_changes_the_etag(self):
+        legacy = Distribution_type.objects.create(name='legacy')
+        Category.objects.create(name='Old', household=self.household, distribution_type=legacy)
+        self.authenticate()
+        april = Period.objects.get(period='2025-04')
+        for url, data, read_url, name in [
+            (f'/api/distribution-types/{legacy.id}/', {'name': 'archived'}, '/api/categories/?expand=distribution_type', 'archived'),
+            (f'/api/periods/{april.id}/', {'period': '2030-04'}, '/api/salaries/', '2030-04'),
+        ]:
+            with self.subTest(url=url):
+                etag = self.client.get(read_url)['ETag']
+                self.assertEqual(self.client.patch(url, data, format='json').status_code, 200)
+                response = self.client.get(read_url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(name, response.content.decode())
+
+    def test_changed_at_follows_the_clock(self):
+        self.authenticate()
+        for _ in range(5):
+            self.client.patch(f'/api/categories/{self.food.id}/', {'name': 'Groceries'}, format='json')
+        self.household.refresh_from_db()
+        self.assertLessEqual(self.household.changed_at, timezone.now())
+
+
+class ResponseCacheTests(WispTestCase):
+
+    def summary_status(self, url):
+        self.authenticate()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(queries)
+
+    def test_repeated_reads_are_served_from_cache(self):
+        self.create_movement(self.food)
+        url = '/api/periods/summary/?start=2025-01&end=2025-12'
+        data, misses = self.summary_status(url)
+        cached, hits = self.summary_status(url)
+        self.assertEqual(cached, data)
+        self.assertLess(hits, misses)
+
+    def test_writes_invalidate_only_their_periods(self):
+        may = self.create_movement(self.food).period_id
+        june = self.create_movement(self.food, movement_date=date(2025, 6, 1)).period_id
+        may_url = f'/api/periods/{may}/summary/'
+        june_url = f'/api/periods/{june}/summary/'
+        self.summary_status(may_url)
+        june_data = self.summary_status(june_url)[0]
+
+        self.create_movement(self.food, amount='10.00', movement_date=date(2025, 6, 2))
+        self.assertEqual(self.summary_status(may_url)[0]['total'], 90.0)
+        self.assertEqual(self.summary_status(june_url)[0]['total'], june_data['total'] + 10)
+
+        # Category names appear in every period
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/categories/{self.food.id}/', {'name': 'Groceries'}, format='json')
+        self.assertEqual(self.summary_status(may_url)[0]['by_category'][0]['category']['name'], 'Groceries')
+
+    def test_movement_pages_follow_writes(self):
+        self.create_movement(self.food)
+        self.authenticate()
+        self.assertEqual(len(self.client.get('/api/movements/').data['results']), 1)
+        self.create_movement(self.rent)
+        self.assertEqual(len(self.client.get('/api/movements/').data['results']), 2)
+
+
+class SyncTests(WispTestCase):
+
+    def sync(self, since=None):
+        self.authenticate()
+        response = self.client.get('/api/sync/', {'since': since} if since else {})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def test_sync_returns_only_changes(self):
+        first = self.create_movement(self.food)
+        full = self.sync()
+        self.assertTrue(full['full'])
+        self.assertEqual([movement['id'] for movement in full['movements']], [first.id])
+        self.assertEqual(len(full['distributions']), 3)
+        self.assertEqual(len(full['salaries']), 3)
+
+        # Nothing changed: no query beyond authentication and the same token back
+        with CaptureQueriesContext(connection) as queries:
+            unchanged = self.sync(full['token'])
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(unchanged['token'], full['token'])
+        self.assertEqual(unchanged['movements'], [])
+
+        second = self.create_movement(self.rent)
+        delta = self.sync(full['token'])
+        self.assertFalse(delta['full'])
+        self.assertIn(second.id, [movement['id'] for movement in delta['movements']])
+        self.assertEqual(
+            {distribution['movement'] for distribution in delta['distributions']} - {first.id},
+            {second.id}
+        )
+
+    def test_deletions_leave_tombstones(self):
+        movement = self.create_movement(self.food)
+        distribution_ids = set(MovementDistribution.objects.filter(movement=movement).values_list('id', flat=True))
+        token = self.sync()['token']
+        self.authenticate()
+        self.assertEqual(self.client.delete(f'/api/movements/{movement.id}/').status_code, 204)
+
+        delta = self.sync(token)
+        self.assertEqual(delta['deleted']['movements'], [movement.id])
+        self.assertEqual(set(delta['deleted']['distributions']), distribution_ids)
+
+    def test_token_of_another_household_gets_a_full_sync(self):
+        self.create_movement(self.food)
+        token = self.sync()['token']
+        # Same change version as the household the token was issued for
+        version = Household.objects.get(pk=self.household.pk).change_version
+        other = Household.objects.create(name='Other', change_version=version)
+        category = Category.objects.create(name='Travel', household=other, distribution_type=self.equal)
+        Member.objects.filter(user=self.users[0]).update(household=other)
+
+        moved = self.sync(token)
+        self.assertTrue(moved['full'])
+        self.assertEqual([row['id'] for row in moved['categories']], [category.id])
+        self.assertEqual(moved['movements'], [])
+
+        # Tokens issued before they held the household
+        legacy = urlsafe_b64encode(f'{other.change_version}|{timezone.now().isoformat()}'.encode()).decode()
+        self.assertTrue(self.sync(legacy)['full'])
+
+    def test_invalid_token_is_rejected(self):
+        self.authenticate()
+        self.assertEqual(self.client.get('/api/sync/', {'since': 'nope'}).status_code, 400)
+
+
+class InstrumentationTests(WispTestCase):
+
+    def test_requests_are_logged_per_endpoint(self):
+        self.create_movement(self.food)
+        self.authenticate()
+        with self.assertLogs('wispapp.requests', logging.INFO) as logs:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/members/detailed_balances/')
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['endpoint'], 'MemberViewSet.detailed_balances')
+        self.assertEqual(record['queries'], len(queries))
+        self.assertEqual(record['response_bytes'], len(response.content))
+
+    def test_middleware_runs_natively_under_asgi(self):
+        handler = BaseHandler()
+        with override_settings(DEBUG=True), self.assertNoLogs('django.request', 'DEBUG'):
+            handler.load_middleware(is_async=True)
+        hooks = [
+            hook for hook in handler._view_middleware + handler._template_response_middleware
+            if isinstance(getattr(hook, '__self__', None), InstrumentationMiddleware)
+        ]
+        self.assertEqual(len(hooks), 2)
+        self.assertTrue(all(iscoroutinefunction(hook) for hook in hooks))
+
+    async def test_async_requests_count_their_queries(self):
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.users[0]).access_token))()
+        with self.assertLogs('wispapp.requests', logging.INFO) as logs:
+            response = await self.async_client.get(
+                '/api/async/members/me/', headers={'Authorization': f'Bearer {token}'}
+            )
+        self.assertEqual(response.status_code, 200)
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['endpoint'], 'async_views.member_me')
+        self.assertGreater(record['queries'], 0)
+
+    @override_settings(WISP_RESPONSE_CACHE=False)
+    async def test_overlapping_async_requests_count_their_own_queries(self):
+        await sync_to_async(self.create_movement)(self.food)
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.users[0]).access_token))()
+        headers = {'Authorization': f'Bearer {token}'}
+        urls = ['/api/async/members/me/', '/api/async/movements/']
+
+        async def query_counts(*requests):
+            with self.assertLogs('wispapp.requests', logging.INFO) as logs:
+                for response in await asyncio.gather(*requests):
+                    self.assertEqual(response.status_code, 200)
+            return {
+                record['endpoint']: record['queries']
+                for record in (json.loads(log.getMessage()) for log in logs.records)
+            }
+
+        alone = {}
+        for url in urls:
+            alone.update(await query_counts(self.async_client.get(url, headers=headers)))
+        self.assertNotEqual(*alone.values())
+        together = await query_counts(*(self.async_client.get(url, headers=headers) for url in urls))
+        self.assertEqual(together, alone)
+
+    def test_staff_endpoint_summarizes_requests(self):
+        self.authenticate()
+        self.client.get('/api/movements/')
+        self.users[0].is_staff = True
+        self.users[0].save()
+        summary = self.client.get('/api/instrumentation/endpoints/').data
+        self.assertIn('MovementViewSet.list', [row['endpoint'] for row in summary])
+
+
+class MovementWriteTests(WispTestCase):
+
+    def post_movement(self, amount='90.00', key=None, category=None, movement_date='2025-05-10'):
+        self.authenticate()
+        headers = {'Idempotency-Key': key} if key else {}
+        return self.client.post('/api/movements/', {
+            'amount': amount,
+            'date': movement_date,
+            'category_id': (category or self.food).id
+        }, format='json', headers=headers)
+
+    def patch_movement(self, movement, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.patch(f'/api/movements/{movement.id}/', data, format='json')
+
+    def test_updates_split_the_movement_again(self):
+        movement = self.create_movement(self.food, amount='90.00')
+        for data in [{'amount': '100.01'}, {'category_id': self.rent.id}, {'date': '2025-05-20', 'amount': '60.00'}]:
+            with self.subTest(data=data):
+                response = self.patch_movement(movement, data)
+                self.assertEqual(response.status_code, 200, response.content)
+                movement.refresh_from_db()
+                shares = MovementDistribution.objects.filter(movement=movement).order_by('member_id')
+                self.assertEqual(sum(share.amount for share in shares), movement.amount)
+                self.assertLedgersMatch()
+        self.assertEqual([share.amount for share in shares], [Decimal('10.00'), Decimal('20.00'), Decimal('30.00')])
+        self.assertEqual(response.data['member']['total_paid'], '60.00')
+
+        # No salaries for 2025-05, the period before June: nothing changes
+        response = self.patch_movement(movement, {'date': '2025-06-02'})
+        self.assertEqual(response.status_code, 400)
+        movement.refresh_from_db()
+        self.assertEqual(movement.date, date(2025, 5, 20))
+        self.assertLedgersMatch()
+
+    def test_updates_keep_the_members_and_shares_of_the_split(self):
+        first, second, third = [user.member for user in self.users]
+        category = Category.objects.create(
+            name='Gift', household=self.household,
+            distribution_type=Distribution_type.objects.get_or_create(name='exclude')[0]
+        )
+        self.authenticate()
+        response = self.client.post('/api/movements/', {
+            'amount': '90.00', 'date': '2025-05-10', 'category_id': category.id, 'excluded_member_ids': [second.id]
+        }, format='json')
+        movement = Movement.objects.get(pk=response.data['id'])
+
+        self.assertEqual(self.patch_movement(movement, {'amount': '60.00'}).status_code, 200)
+        self.assertEqual(
+            dict(MovementDistribution.objects.filter(movement=movement).values_list('member_id', 'amount')),
+            {first.id: Decimal('30.00'), third.id: Decimal('30.00')}
+        )
+        self.assertLedgersMatch()
+
+    def test_failed_split_leaves_no_movement(self):
+        # No salaries for 2025-05, the period before this prorrata movement
+        response = self.post_movement(category=self.rent, movement_date='2025-06-10')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Movement.objects.exists())
+
+    def test_retries_with_the_same_key_replay_the_first_response(self):
+        first = self.post_movement(key='abc')
+        retry = self.post_movement(key='abc')
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Movement.objects.count(), 1)
+
+        self.assertEqual(self.post_movement(amount='10.00', key='abc').status_code, 422)
+        self.assertEqual(self.post_movement(key='other').status_code, 201)
+        self.assertEqual(Movement.objects.count(), 2)
+
+    def test_create_response_has_the_updated_totals(self):
+        self.post_movement()
+        response = self.post_movement(key='abc')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.data['member']['total_paid'], '180.00')
+        self.assertEqual(response.data['member']['total_owed'], '60.00')
+        self.assertEqual(self.post_movement(key='abc').data['member'], response.data['member'])
+
+    def test_failed_requests_do_not_use_up_the_key(self):
+        self.assertEqual(self.post_movement(amount='-', key='abc').status_code, 400)
+        self.assertEqual(self.post_movement(key='abc').status_code, 201)
+
+    def test_key_is_taken_with_the_movement_insert(self):
+        first = self.post_movement(key='abc')
+        # A concurrent request with the same key that missed the first one's record
+        with mock.patch('wispapp.idempotency.find_record', side_effect=[None, IdempotencyRecord.objects.get()]):
+            retry = self.post_movement(key='abc')
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Movement.objects.count(), 1)
+        self.assertLedgersMatch()
+
+    def test_key_of_a_response_being_serialized_conflicts(self):
+        # Committed, but its response is not stored yet
+        request = self.post_movement().wsgi_request
+        IdempotencyRecord.objects.create(
+            user=self.users[0], key='abc', method='POST', path=request.path, fingerprint=fingerprint(request),
+            object_ids=[Movement.objects.get().id]
+        )
+        self.assertEqual(self.post_movement(key='abc').status_code, 409)
+        self.assertEqual(Movement.objects.count(), 1)
+
+    def test_response_lost_after_the_commit_is_rebuilt(self):
+        with mock.patch('wispapp.idempotency.store_response', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                self.post_movement(key='abc')
+        self.assertEqual(self.post_movement(key='abc').status_code, 409)
+
+        with self.settings(WISP_IDEMPOTENCY_PENDING_SECONDS=0):
+            retry = self.post_movement(key='abc')
+        self.assertEqual(retry.status_code, 201, retry.content)
+        self.assertEqual(retry.data['id'], Movement.objects.get().id)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(IdempotencyRecord.objects.get().response_body, retry.data)
+        self.assertEqual(Movement.objects.count(), 1)
+
+    def post_batch(self, items):
+        self.authenticate()
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/movements/batch/', items, format='json')
+        return response, len(queries)
+
+    def batch_items(self, count):
+        categories = [self.food, self.rent]
+        return [
+            {'amount': f'{10 + i}.00', 'date': f'2025-05-{i % 28 + 1:02d}', 'category_id': categories[i % 2].id}
+            for i in range(count)
+        ]
+
+    def test_batch_creates_movements_with_constant_queries(self):
+        # The first batch creates the period and caches the previous one
+        self.post_batch(self.batch_items(2))
+        response, few = self.post_batch(self.batch_items(2))
+        self.assertEqual(response.status_code, 201, response.content)
+        response, many = self.post_batch(self.batch_items(20))
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(many, few)
+        self.assertEqual(response.data['created'], 20)
+        self.assertEqual(Movement.objects.count(), 24)
+        self.assertEqual([result['index'] for result in response.data['results']], list(range(20)))
+        self.assertEqual(response.data['results'][3]['movement']['amount'], '13.00')
+        totals = Movement.objects.annotate(distributed=Sum('movementdistribution__amount'))
+        self.assertTrue(all(movement.distributed == movement.amount for movement in totals))
+
+    def test_batch_retries_with_the_same_key_replay_the_first_response(self):
+        self.authenticate()
+        headers = {'Idempotency-Key': 'abc'}
+        first = self.client.post('/api/movements/batch/', self.batch_items(3), format='json', headers=headers)
+        retry = self.client.post('/api/movements/batch/', self.batch_items(3), format='json', headers=headers)
+        self.assertEqual(first.status_code, 201, first.content)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(Movement.objects.count(), 3)
+
+    def test_batch_response_lost_after_the_commit_is_rebuilt(self):
+        self.authenticate()
+        headers = {'Idempotency-Key': 'abc'}
+        with mock.patch('wispapp.idempotency.store_response', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                self.client.post('/api/movements/batch/', self.batch_items(3), format='json', headers=headers)
+        Movement.objects.filter(amount='11.00').delete()
+
+        with self.settings(WISP_IDEMPOTENCY_PENDING_SECONDS=0):
+            retry = self.client.post('/api/movements/batch/', self.batch_items(3), format='json', headers=headers)
+        self.assertEqual(retry.status_code, 201, retry.content)
+        self.assertEqual([result['index'] for result in retry.data['results']], [0, 2])
+        self.assertEqual(retry.data['results'][1]['movement']['amount'], '12.00')
+        self.assertEqual(Movement.objects.count(), 2)
+
+    def test_batch_payer_is_the_requesting_member(self):
+        items = self.batch_items(2)
+        items[0]['member'] = 'user1'
+        response, _ = self.post_batch(items)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(set(Movement.objects.values_list('member__name', flat=True)), {'user0'})
+
+    def test_batch_is_all_or_nothing(self):
+        items = self.batch_items(3)
+        items[1]['category_id'] = 0
+        response, _ = self.post_batch(items)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result['status'] for result in response.data['results']], [424, 400, 424])
+        self.assertIn('category', response.data['results'][1]['errors'][0])
+        self.assertFalse(Movement.objects.exists())
+
+
+@override_settings(WISP_RECOMPUTE_DELAY_SECONDS=0)
+class RecomputeJobTests(WispTestCase):
+
+    def rent_shares(self, movement):
+        return dict(MovementDistribution.objects.filter(movement=movement).values_list('member__name', 'amount'))
+
+    def test_salary_edits_are_coalesced_into_one_job(self):
+        movement = self.create_movement(self.rent, amount='600.00')
+        self.assertEqual(self.rent_shares(movement)['user0'], Decimal('100.00'))
+        salary = Salary.objects.get(member__name='user0', period__period='2025-04')
+
+        for amount in ['2000.00', '3000.00']:
+            response = self.client.patch(f'/api/salaries/{salary.id}/', {'amount': amount}, format='json')
+            self.assertEqual(response.status_code, 200, response.content)
+        job = RecomputeJob.objects.get()
+        self.assertEqual(response.data['recompute_jobs'][0]['id'], job.id)
+        self.assertEqual((job.status, job.requests), (RecomputeJob.PENDING, 2))
+        # The request returned before recomputing
+        self.assertEqual(self.rent_shares(movement)['user0'], Decimal('100.00'))
+
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(self.rent_shares(movement)['user0'], Decimal('225.00'))
+        response = self.client.get(f'/api/jobs/{job.id}/')
+        self.assertEqual((response.data['status'], response.data['movements']), (RecomputeJob.DONE, 1))
+
+    def test_worker_writes_invalidate_cached_summaries(self):
+        movement = self.create_movement(self.rent, amount='600.00')
+        url = f'/api/periods/{movement.period_id}/summary/'
+
+        def user0_owes():
+            response = self.client.get(url)
+            return {row['member']['name']: row['total'] for row in response.data['owed_by_member']}['user0']
+
+        self.assertEqual(user0_owes(), 100.0)
+        salary = Salary.objects.get(member__name='user0', period__period='2025-04')
+        self.client.patch(f'/api/salaries/{salary.id}/', {'amount': '3000.00'}, format='json')
+        # The worker's on_commit hooks never reach this process: only the database tells
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(user0_owes(), 225.0)
+
+    def test_members_gaining_or_losing_a_salary(self):
+        movement = self.create_movement(self.rent, amount='600.00')
+        april = Period.objects.get(period='2025-04')
+        third = self.users[2].member
+        salary = Salary.objects.get(member=third, period=april)
+        removed = MovementDistribution.objects.get(movement=movement, member=third)
+
+        salary.delete()
+        self.assertEqual(recompute_prorrata(self.household.id, april), 1)
+        self.assertEqual(self.rent_shares(movement), {'user0': Decimal('200.00'), 'user1': Decimal('400.00')})
+        self.assertTrue(
+            Tombstone.objects.filter(object_type=Tombstone.DISTRIBUTION, object_id=removed.id, household=self.household).exists()
+        )
+        self.assertLedgersMatch()
+
+        Salary.objects.create(member=third, period=april, amount=3000)
+        self.assertEqual(recompute_prorrata(self.household.id, april), 1)
+        self.assertEqual(
+            self.rent_shares(movement),
+            {'user0': Decimal('100.00'), 'user1': Decimal('200.00'), 'user2': Decimal('300.00')}
+        )
+        self.assertLedgersMatch()
+
+    def test_failed_jobs_are_retried(self):
+        job = RecomputeJob.objects.create(household=self.household, period=Period.objects.get(period='2025-04'))
+        with mock.patch('wispapp.jobs.recompute_prorrata', side_effect=RuntimeError('boom')):
+            with self.assertLogs('wispapp.jobs', 'ERROR'):
+                self.assertEqual(run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (RecomputeJob.PENDING, 1))
+        self.assertIn('boom', job.error)
+        self.assertGreater(job.run_after, job.finished_at)
+
+    @override_settings(WISP_RECOMPUTE_ASYNC=False)
+    def test_recompute_runs_inline_when_async_is_off(self):
+        movement = self.create_movement(self.rent, amount='600.00')
+        salary = Salary.objects.get(member__name='user0', period__period='2025-04')
+        response = self.client.patch(f'/api/salaries/{salary.id}/', {'amount': '3000.00'}, format='json')
+        self.assertEqual(response.data['recompute_jobs'], [])
+        self.assertEqual(self.rent_shares(movement)['user0'], Decimal('225.00'))
+
+
+class SyntheticDataTests(WispTestCase):
+
+    def test_generated_household_is_consistent(self):
+        household, users, report = generate_household('synthetic-test', members=3, months=2, movements_per_month=10)
+        self.assertEqual(report, {'created': 20, 'errors': []})
+        movements = Movement.objects.filter(household=household)
+        self.assertEqual(
+            set(movements.values_list('category__distribution_type__name', flat=True)), {'equal', 'prorrata'}
+        )
+        totals = movements.annotate(distributed=Sum('movementdistribution__amount'))
+        for movement in totals:
+            self.assertEqual(movement.distributed, movement.amount)
+
+
+class LedgerTests(WispTestCase):
+    """MemberBalance rows stay equal to the aggregates through cascading deletes"""
+
+    def setUp(self):
+        super().setUp()
+        for user in self.users[:2]:
+            self.create_movement(self.food, amount='90.00', user=user)
+            self.create_movement(self.rent, amount='600.00', user=user)
+        self.authenticate()
+
+    def delete(self, url):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, 204, response.content)
+
+    def test_writes_update_balances_without_aggregates(self):
+        with CaptureQueriesContext(connection) as queries:
+            movement = self.create_movement(self.rent, amount='300.00')
+        self.assertFalse([query['sql'] for query in queries if 'SUM(' in query['sql']])
+        self.assertLedgersMatch()
+
+        self.client.patch(f'/api/movements/{movement.id}/', {'amount': '330.00'}, format='json')
+        self.assertLedgersMatch()
+        self.delete(f'/api/movements/{movement.id}/')
+        self.assertLedgersMatch()
+
+        # Members without a balance row yet get it built from the aggregates
+        MemberBalance.objects.filter(member=self.users[2].member).delete()
+        self.create_movement(self.food, amount='30.00')
+        self.assertLedgersMatch()
+        self.assertTrue(MemberBalance.objects.filter(member=self.users[2].member).exists())
+
+    def test_category_delete(self):
+        self.delete(f'/api/categories/{self.food.id}/')
+        self.assertLedgersMatch()
+
+    def test_member_delete(self):
+        self.delete(f'/api/members/{self.users[1].member.id}/')
+        self.assertLedgersMatch()
+
+    def test_distribution_type_delete(self):
+        self.delete(f'/api/distribution-types/{self.prorrata.id}/')
+        self.assertLedgersMatch()
+
+    def test_household_delete(self):
+        self.delete(f'/api/households/{self.household.id}/')
+        self.assertFalse(Movement.objects.exists())
+        self.assertLedgersMatch()
+
+
+class ImportTests(WispTestCase):
+
+    CSV = (
+        "date,amount,category,member,description\n"
+        "2024-01-10,600.00,Rent,user1,No salaries for 2023-12\n"
+        "2025-05-10,ninety,Food,,\n"
+        "2025-05-11,90.00,Food,,Market\n"
+        "2025-05-12,600.00,Rent,user2,\n"
+        "2025-05-13,30.00,Travel,,\n"
+    )
+
+    def import_file(self, name, content, **data):
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/movements/import/',
+                {'file': SimpleUploadedFile(name, content.encode()), **data},
+                format='multipart'
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def assertSplitExactly(self):
+        for movement in Movement.objects.all():
+            total = MovementDistribution.objects.filter(movement=movement).aggregate(total=Sum('amount'))['total']
+            self.assertEqual(total, movement.amount)
+
+    def test_csv_import_reports_errors_by_row(self):
+        report = self.import_file('movements.csv', self.CSV)
+        self.assertEqual(report['created'], 2)
+        # The unsplittable rent row is only found when its chunk is written, after the other errors
+        self.assertEqual([error['row'] for error in report['errors']], [2, 3, 6])
+        self.assertIn('salaries', report['errors'][0]['errors'][0])
+        self.assertIn('amount:', report['errors'][1]['errors'][0])
+        self.assertIn("Unknown category 'Travel'", report['errors'][2]['errors'][0])
+
+        self.assertEqual(
+            sorted(Movement.objects.values_list('member__name', 'amount')),
+            [('user0', Decimal('90.00')), ('user2', Decimal('600.00'))]
+        )
+        self.assertSplitExactly()
+        self.assertEqual(MemberBalance.objects.get(member__name='user2').total_paid, Decimal('600.00'))
+
+    def test_ndjson_import(self):
+        lines = [
+            json.dumps({'date': '2025-05-10', 'amount': '90.00', 'category': self.food.id}),
+            '{"date": ',
+            '',
+            json.dumps(['not', 'an', 'object']),
+            json.dumps({'date': '2025-05-11', 'amount': '60.00', 'category': 'Rent', 'description': 'Deposit'}),
+        ]
+        report = self.import_file('movements.txt', '\n'.join(lines), format='ndjson')
+        self.assertEqual(report['created'], 2)
+        self.assertEqual([error['row'] for error in report['errors']], [2, 4])
+        self.assertIn('Invalid JSON', report['errors'][0]['errors'][0])
+        self.assertEqual(Movement.objects.get(amount='60.00').description, 'Deposit')
+        self.assertSplitExactly()
+
+    def test_command_writes_in_chunks(self):
+        rows = [
+            json.dumps({'date': f'2025-05-{day:02}', 'amount': '30.00', 'category': 'Food', 'member': 'user1'})
+            for day in range(1, 6)
+        ]
+        rows.insert(2, json.dumps({'date': '2025-05-06', 'amount': '30.00', 'category': 'Food', 'member': 'nobody'}))
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as upload:
+            upload.write('\n'.join(rows))
+            upload.flush()
+            out, err = StringIO(), StringIO()
+            with mock.patch('wispapp.importers.household_changed', wraps=household_changed) as changed:
+                call_command('import_movements', upload.name, '--user', 'user0', '--batch-size', '2', stdout=out, stderr=err)
+
+        self.assertIn('Imported 5 movements, 1 rows rejected', out.getvalue())
+        self.assertIn("Row 3: member: Unknown household member 'nobody'", err.getvalue())
+        # Five valid rows in chunks of two
+        self.assertEqual(changed.call_count, 3)
+        self.assertEqual(MemberBalance.objects.get(member__name='user1').total_paid, Decimal('150.00'))
+        self.assertSplitExactly()
+
+
+class ExportTests(WispTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.may = self.create_movement(self.rent, amount='600.00')
+        self.april = self.create_movement(self.food, amount='100.00', movement_date=date(2025, 4, 30))
+        self.june = self.create_movement(self.food, amount='90.00', movement_date=date(2025, 6, 1))
+
+    def export(self, **params):
+        response = self.client.get('/api/movements/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_has_a_row_per_distribution(self):
+        response, content = self.export(type='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertEqual(len(rows), 9)
+        # Oldest first
+        self.assertEqual([int(row['movement_id']) for row in rows[::3]], [self.april.id, self.may.id, self.june.id])
+        may = [row for row in rows if int(row['movement_id']) == self.may.id]
+        self.assertEqual(
+            [(row['member'], row['share'], row['is_payer']) for row in may],
+            [('user0', '100.00', 'True'), ('user1', '200.00', 'False'), ('user2', '300.00', 'False')]
+        )
+        self.assertEqual({(row['period'], row['distribution_type']) for row in may}, {('2025-05', 'prorrata')})
+
+    def test_ndjson_within_periods(self):
+        response, content = self.export(type='ndjson', start='2025-05', end='2025-06')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([record['id'] for record in records], [self.may.id, self.june.id])
+        june = records[1]
+        self.assertEqual((june['period'], june['amount'], june['category']), ('2025-06', '90.00', 'Food'))
+        self.assertEqual(sum(Decimal(share['amount']) for share in june['distributions']), Decimal('90.00'))
+
+        content = self.export(type='ndjson', end='2025-04')[1]
+        self.assertEqual([json.loads(line)['id'] for line in content.splitlines()], [self.april.id])
+
+    def test_unknown_type(self):
+        self.assertEqual(self.client.get('/api/movements/export/', {'type': 'xml'}).status_code, 400)
+
+
+class SettlementTests(WispTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ids = {user.username: user.member.id for user in self.users}
+        self.create_movement(self.food, amount='100.00')
+        self.create_movement(self.rent, amount='600.00', user=self.users[2])
+        # Paid by user1 for the two others
+        excluded = Category.objects.create(
+            name='Gifts',
+            household=self.household,
+            distribution_type=Distribution_type.objects.get_or_create(name='exclude')[0]
+        )
+        self.authenticate(self.users[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/movements/', {
+                'amount': '60.00',
+                'date': '2025-05-10',
+                'category_id': excluded.id,
+                'excluded_member_ids': [self.ids['user1']]
+            }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.authenticate()
+
+    def test_household_settlement(self):
+        response = self.client.get(f'/api/households/{self.household.id}/balances/')
+        self.assertEqual(response.status_code, 200)
+        names = {member_id: name for name, member_id in self.ids.items()}
+        # Food splits into 33.34 for the payer and 33.33 for the others
+        self.assertEqual(
+            {(names[row['from']], names[row['to']]): row['amount'] for row in response.data['matrix']},
+            {
+                ('user1', 'user0'): 33.33, ('user2', 'user0'): 33.33,
+                ('user0', 'user1'): 30.0, ('user2', 'user1'): 30.0,
+                ('user0', 'user2'): 100.0, ('user1', 'user2'): 200.0,
+            }
+        )
+        self.assertEqual(
+            {row['name']: row['net_balance'] for row in response.data['members']},
+            {'user0': -63.34, 'user1': -173.33, 'user2': 236.67}
+        )
+        self.assertEqual(
+            [(row['from']['name'], row['to']['name'], row['amount']) for row in response.data['transfers']],
+            [('user1', 'user2', 173.33), ('user0', 'user2', 63.34)]
+        )
+
+    def test_detailed_balances(self):
+        response = self.client.get('/api/members/detailed_balances/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {row['member']['name']: (row['you_owe'], row['owes_you'], row['net_balance']) for row in response.data},
+            {'user1': (30.0, 33.33, 3.33), 'user2': (100.0, 33.33, -66.67)}
+        )
+
+    def test_transfers_are_rounded_to_cents(self):
+        net = {1: Decimal('-10.004'), 2: Decimal('-5.003'), 3: Decimal('15.007'), 4: Decimal('0.002')}
+        self.assertEqual(
+            minimal_transfers(net),
+            [(1, 3, Decimal('10.00')), (2, 3, Decimal('5.00'))]
+        )
+
+
+class PeriodTests(WispTestCase):
+
+    def test_get_period_caches_committed_rows(self):
+        get_period('2025-07')
+        # Not committed yet, the row could still be rolled back
+        self.assertIsNone(period_cache.get('2025-07'))
+        with self.captureOnCommitCallbacks(execute=True):
+            period = get_period('2025-08')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_period('2025-08'), period)
+
+    def test_saved_and_deleted_periods_leave_the_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            period = get_period('2025-08')
+        period.period = '2025-09'
+        period.save()
+        self.assertIsNone(period_cache.get('2025-08'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(get_period('2025-09'), period)
+        period.delete()
+        self.assertIsNone(period_cache.get('2025-09'))
+
+    def test_periods_renamed_by_another_process_leave_the_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            period = get_period('2025-08')
+        # Loaded without the cache, as another process would
+        renamed = Period.objects.get(pk=period.pk)
+        renamed.period = '2025-10'
+        with self.captureOnCommitCallbacks(execute=True):
+            renamed.save()
+        self.assertIsNone(period_cache.get('2025-08'))
+        self.assertNotEqual(get_period('2025-08'), period)
+
+    def test_calendar_bounds_migration_merges_same_month(self):
+        migration = importlib.import_module('wispapp.migrations.0015_period_calendar_bounds')
+        april = Period.objects.get(period='2025-04')
+        # Saved without save(), as rows written before the bounds existed
+        duplicate, july = Period.objects.bulk_create([Period(period='2025-4'), Period(period='2025-7')])
+        salary = Salary.objects.create(member=self.users[0].member, period=duplicate, amount=500)
+
+        migration.merge_and_backfill_periods(apps, None)
+        self.assertFalse(Period.objects.filter(id=duplicate.id).exists())
+        salary.refresh_from_db()
+        self.assertEqual(salary.period_id, april.id)
+        july.refresh_from_db()
+        self.assertEqual((july.period, july.start, july.end), ('2025-07', date(2025, 7, 1), date(2025, 7, 31)))
+
+
+class RepairDistributionsTests(WispTestCase):
+
+    def shares(self, movement):
+        return list(MovementDistribution.objects.filter(movement=movement).order_by('id').values_list('amount', flat=True))
+
+    def corrupt(self, movement, amounts):
+        for distribution, amount in zip(MovementDistribution.objects.filter(movement=movement).order_by('id'), amounts):
+            distribution.amount = Decimal(amount)
+            distribution.save()
+
+    def test_refunds_stay_proportional(self):
+        refund = self.create_movement(self.food, amount='-90.00')
+        self.corrupt(refund, ['-40.00', '-20.00', '-20.00'])
+        empty = self.create_movement(self.food, amount='90.00')
+        self.corrupt(empty, ['0', '0', '0'])
+
+        out = StringIO()
+        call_command('repair_distributions', '--dry-run', stdout=out)
+        self.assertIn('2 movements', out.getvalue())
+        call_command('repair_distributions', stdout=StringIO())
+
+        self.assertEqual(self.shares(refund), [Decimal('-45.00'), Decimal('-22.50'), Decimal('-22.50')])
+        self.assertEqual(self.shares(empty), [Decimal('30.00')] * 3)
+        balance = MemberBalance.objects.get(member=self.users[0].member)
+        self.assertEqual(balance.total_owed, Decimal('-15.00'))
+
+
+class StrategyTests(WispTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.members = [user.member for user in self.users]
+        self.authenticate()
+
+    def category(self, type_name, **fields):
+        distribution_type = Distribution_type.objects.get_or_create(name=type_name)[0]
+        return Category.objects.create(name=type_name, household=self.household, distribution_type=distribution_type, **fields)
+
+    def post_movement(self, category, amount='90.00', **options):
+        return self.client.post('/api/movements/', {
+            'amount': amount,
+            'date': '2025-05-10',
+            'category_id': category.id,
+            **options
+        }, format='json')
+
+    def shares(self, response):
+        self.assertEqual(response.status_code, 201, response.content)
+        return dict(
+            MovementDistribution.objects.filter(movement_id=response.data['id']).values_list('member_id', 'amount')
+        )
+
+    def test_fixed_weights(self):
+        first, _, third = self.members
+        response = self.client.post('/api/categories/', {
+            'name': 'Car',
+            'distribution_type_id': Distribution_type.objects.get_or_create(name='fixed')[0].id,
+            'distribution_weights': {first.id: 1, third.id: 3}
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        category = Category.objects.get(pk=response.data['id'])
+        self.assertEqual(
+            self.shares(self.post_movement(category, amount='100.00')),
+            {first.id: Decimal('25.00'), third.id: Decimal('75.00')}
+        )
+
+    def test_invalid_distribution_weights(self):
+        first = self.members[0]
+        for weights in [[1, 2], {'99999': 1}, {'x': 1}, {first.id: 0}, {first.id: -1}, {first.id: '1'}, {first.id: True}]:
+            response = self.client.post('/api/categories/', {'name': 'Car', 'distribution_weights': weights}, format='json')
+            self.assertEqual(response.status_code, 400, weights)
+            self.assertIn('distribution_weights', response.data)
+
+        # Weights stored before validation existed fail the movement, not the server
+        category = self.category('fixed', distribution_weights=[1, 2])
+        self.assertEqual(self.post_movement(category).status_code, 400)
+
+    def test_exclude(self):
+        first, second, third = self.members
+        category = self.category('exclude')
+        self.assertEqual(
+            self.shares(self.post_movement(category, excluded_member_ids=[second.id])),
+            {first.id: Decimal('45.00'), third.id: Decimal('45.00')}
+        )
+        response = self.post_movement(category, excluded_member_ids=[member.id for member in self.members])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('At least one household member', str(response.data))
+
+    def test_custom(self):
+        first, second, _ = self.members
+        category = self.category('custom')
+        self.assertEqual(
+            self.shares(self.post_movement(category, shares={first.id: '10.00', second.id: '80.00'})),
+            {first.id: Decimal('10.00'), second.id: Decimal('80.00')}
+        )
+        response = self.post_movement(category, shares={first.id: '10.00', second.id: '70.00'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('add up to 80.00', str(response.data))
+        response = self.post_movement(category, shares={first.id: '10.00', '99999': '80.00'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('do not belong to the household', str(response.data))
+        response = self.post_movement(category, shares={first.id: '100.00', second.id: '-10.00'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(f'[{second.id}] must have the sign', str(response.data))
+        # Failed splits write nothing
+        self.assertEqual(Movement.objects.filter(category=category).count(), 1)
+
+    def test_registered_types_cannot_be_renamed(self):
+        url = f'/api/distribution-types/{self.equal.id}/'
+        response = self.client.patch(url, {'name': 'even'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cannot be renamed', str(response.data['name']))
+        self.assertEqual(self.client.patch(url, {'name': 'equal'}, format='json').status_code, 200)
+        self.assertEqual(self.post_movement(self.food).status_code, 201)
+
+
+class AllocationTests(WispTestCase):
+
+    def test_allocate_sums_exactly_to_amount(self):
+        self.assertEqual(allocate(Decimal('100.00'), [1, 1, 1]), [Decimal('33.34'), Decimal('33.33'), Decimal('33.33')])
+        self.assertEqual(allocate(Decimal('-0.05'), [1000, 2000, 3000]), [Decimal('-0.01'), Decimal('-0.02'), Decimal('-0.02')])
+
+    def test_distributions_add_up_to_movement_amount(self):
+        for category in [self.food, self.rent]:
+            movement = self.create_movement(category, amount='100.01')
+            total = MovementDistribution.objects.filter(movement=movement).aggregate(total=Sum('amount'))['total']
+            self.assertEqual(total, movement.amount)
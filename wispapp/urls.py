@@ -1,8 +1,9 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import (
     MovementViewSet, MemberViewSet, CategoryViewSet, DistributionTypeViewSet,
-    SalaryViewSet, PeriodViewSet, UserCreate, HouseholdViewSet, JoinHouseholdView, UserViewSet
+    SalaryViewSet, RecomputeJobViewSet, PeriodViewSet, UserCreate, HouseholdViewSet, JoinHouseholdView, UserViewSet, CacheStatsView, EndpointStatsView, SyncView
 )
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
@@ -15,6 +16,7 @@ router.register(r'members', MemberViewSet, basename='member')
 router.register(r'categories', CategoryViewSet, basename='category')
 router.register(r'distribution-types', DistributionTypeViewSet)
 router.register(r'salaries', SalaryViewSet, basename='salary')
+router.register(r'jobs', RecomputeJobViewSet, basename='recompute-job')
 router.register(r'periods', PeriodViewSet)
 router.register(r'households', HouseholdViewSet, basename='household')
 router.register(r'users', UserViewSet)
@@ -24,6 +26,12 @@ urlpatterns = [
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('households/join/', JoinHouseholdView.as_view(), name='join_household'),
+    path('cache/stats/', CacheStatsView.as_view(), name='cache_stats'),
+    path('instrumentation/endpoints/', EndpointStatsView.as_view(), name='endpoint_stats'),
+    path('sync/', SyncView.as_view(), name='sync'),
+    path('async/movements/', async_views.movement_list, name='async_movement_list'),
+    path('async/members/me/', async_views.member_me, name='async_member_me'),
+    path('async/members/detailed_balances/', async_views.detailed_balances, name='async_detailed_balances'),
     path('', include(router.urls)),
 ]
 
@@ -0,0 +1,119 @@
+from functools import partial, wraps
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from .caching import cached_response, household_key
+from .models import Household, Member, PeriodVersion
+
+
+def household_changed(*household_ids, period_ids=None):
+    """Bump the change version of the given households, which invalidates their cached reads.
+
+    Call it in the same transaction as every write to household data (movements,
+    distributions, salaries, categories, members) so clients polling with an
+    old ETag get the new data. `period_ids` narrows the change to the movements
+    and distributions of those periods (empty when no period data changed);
+    leave it out when data shared by every period changed.
+    """
+    household_ids = {household_id for household_id in household_ids if household_id}
+    if not household_ids:
+        return
+    now = timezone.now()
+    changes = {'change_version': F('change_version') + 1, 'changed_at': now}
+    if period_ids is None:
+        changes['shared_changed_at'] = now
+    Household.objects.filter(id__in=household_ids).update(**changes)
+
+    period_ids = {period_id for period_id in period_ids or [] if period_id}
+    if period_ids:
+        versions = PeriodVersion.objects.filter(household_id__in=household_ids, period_id__in=period_ids)
+        if versions.update(version=F('version') + 1) < len(household_ids) * len(period_ids):
+            # First change of some of the periods: create their counters and
+            # count the change again, so concurrent first writers both bump them
+            PeriodVersion.objects.bulk_create(
+                [
+                    PeriodVersion(household_id=household_id, period_id=period_id)
+                    for household_id in household_ids
+                    for period_id in period_ids
+                ],
+                ignore_conflicts=True
+            )
+            versions.update(version=F('version') + 1)
+
+
+def household_validators(member):
+    """(etag, last_modified timestamp) of what `member` reads, or (None, None) without a household.
+
+    Uses the household loaded with the member at authentication, so it costs no
+    query. Responses differ per member, so the member is part of the ETag.
+    """
+    household = member.household if member is not None else None
+    if household is None:
+        return None, None
+    return f'"{household.id}.{household.change_version}.{member.id}"', int(household.changed_at.timestamp())
+
+
+def not_modified(request, member):
+    """A 304 response if the client already has the current version of the member's household data"""
+    etag, last_modified = household_validators(member)
+    if etag is None:
+        return None
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def add_validators(response, member):
+    """Set ETag and Last-Modified on a successful read and make clients revalidate it"""
+    etag, last_modified = household_validators(member)
+    if etag is not None and response.status_code in (200, 304):
+        response['ETag'] = etag
+        # Last-Modified has one second resolution: a household changed during the
+        # current second may change again within it, only the ETag tells them apart
+        if last_modified < int(timezone.now().timestamp()):
+            response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Authorization'])
+    return response
+
+
+def request_member(request):
+    try:
+        return request.user.member
+    except (AttributeError, Member.DoesNotExist):
+        return None
+
+
+def conditional_on_household(view_method):
+    """Answer a viewset read with 304 Not Modified when the household has not changed.
+
+    The check runs before the view method, so an unchanged poll never runs the
+    queryset or the serializers.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        member = request_member(request)
+        response = not_modified(request, member)
+        if response is None:
+            response = view_method(self, request, *args, **kwargs)
+        return add_validators(response, member)
+    return wrapper
+
+
+class HouseholdConditionalMixin:
+    """Conditional GET on list and retrieve, keyed on the household change version.
+
+    Set `list_cache_kind` to also keep the serialized list pages in the response cache.
+    """
+    list_cache_kind = None
+
+    @conditional_on_household
+    def list(self, request, *args, **kwargs):
+        member = request_member(request)
+        if self.list_cache_kind is None or member is None or member.household is None:
+            return super().list(request, *args, **kwargs)
+        key = household_key(self.list_cache_kind, member.household, request.build_absolute_uri())
+        return cached_response(self.list_cache_kind, key, partial(super().list, request, *args, **kwargs))
+
+    @conditional_on_household
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
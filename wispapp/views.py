@@ -1,38 +1,165 @@
+import io
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
 from rest_framework import viewsets, generics, status, permissions
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.views import APIView
 from rest_framework.decorators import action
-from .models import Movement, Member, Category, Distribution_type, Salary, Period, Household, MovementDistribution
-from .serializers import MovementSerializer, MemberSerializer, CategorySerializer, DistributionTypeSerializer, SalarySerializer, PeriodSerializer, UserSerializer, HouseholdSerializer
+from rest_framework.parsers import MultiPartParser
+from .models import Movement, Member, Category, Distribution_type, Salary, Period, Household, MovementDistribution, RecomputeJob, Tombstone
+from .serializers import MovementSerializer, MemberSerializer, CategorySerializer, DistributionTypeSerializer, SalarySerializer, PeriodSerializer, UserSerializer, HouseholdSerializer, RecomputeJobSerializer
 from django_filters.rest_framework import DjangoFilterBackend
 from django.contrib.auth.models import User
 from rest_framework.exceptions import ValidationError
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import F
+from .exporters import CONTENT_TYPES, EXPORT_FORMATS, STREAMERS, export_movements
+from .idempotency import IdempotentCreateMixin, idempotent, save_record
+from .importers import FORMATS, MovementImporter, guess_format, read_rows
+from .instrumentation import endpoint_stats
+from .ledger import add_to_balances, balance_changes, movement_member_ids, refresh_balances
+from .pagination import MovementCursorPagination, RecomputeJobCursorPagination, SalaryCursorPagination
+from .periods import periods_between
+from .reports import period_summary
+from .representation import DynamicFieldsViewMixin
+from .settlements import household_settlement, member_balances, pairwise_matrix
+from .strategies import STRATEGIES
+from .sync import household_changes, member_moved, record_deletions, record_movement_deletions
+from .caching import cached_response, household_key, period_key, reset_stats, stats
+from .versions import HouseholdConditionalMixin, conditional_on_household, household_changed
 
-class MovementViewSet(viewsets.ModelViewSet):
+class MovementViewSet(IdempotentCreateMixin, HouseholdConditionalMixin, DynamicFieldsViewMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = MovementSerializer
+    pagination_class = MovementCursorPagination
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['period', 'category']
+    list_cache_kind = 'movements'
     
     def get_queryset(self):
         member = self.request.user.member
-        if not member.household:
+        if not member.household_id:
             return Movement.objects.none()
-        return Movement.objects.filter(member__household=member.household)
+        # Everything MovementSerializer reads, so a page costs a constant number of queries
+        queryset = Movement.objects.filter(household_id=member.household_id).select_related(
+            'member',
+            'category__distribution_type'
+        )
+        if self.expanded('member'):
+            queryset = queryset.select_related('member__household', 'member__ledger')
+        return queryset
 
-class MemberViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_movements(self, request):
+        """Bulk import movements from an uploaded CSV or NDJSON file"""
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError("Upload the movements as a 'file' field")
+        file_format = request.data.get('format') or guess_format(upload.name)
+        if file_format not in FORMATS:
+            raise ValidationError(f"Unknown import format: {file_format}")
+
+        importer = MovementImporter(request.user.member)
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig')
+        report = importer.run(read_rows(stream, file_format))
+        return Response(report, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'])
+    @idempotent(rebuild=lambda view, movement_ids: view.batch_created(movement_ids))
+    def batch(self, request):
+        """Create a JSON array of movements in one transaction, all of them or none, with a result per item"""
+        items = request.data
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ValidationError("Send a JSON array of movements")
+        limit = getattr(settings, 'WISP_BATCH_MAX_MOVEMENTS', 500)
+        if not 0 < len(items) <= limit:
+            raise ValidationError(f"Send between 1 and {limit} movements")
+
+        # The requesting member pays, as for a single create
+        importer = MovementImporter(request.user.member, choose_payer=False, on_write=lambda movements: save_record(request, movements))
+        movements = importer.create_all((index, item, None) for index, item in enumerate(items))
+        if importer.errors:
+            # Valid items were not created either: 424 Failed Dependency
+            errors = {error['row']: error['errors'] for error in importer.errors}
+            results = [
+                {'index': index, 'status': 400, 'errors': errors[index]} if index in errors
+                else {'index': index, 'status': 424}
+                for index in range(len(items))
+            ]
+            return Response({'created': 0, 'results': results}, status=status.HTTP_400_BAD_REQUEST)
+
+        return self.batch_created([movement.id for movement in movements])
+
+    def batch_created(self, movement_ids):
+        """201 response of a batch that created `movement_ids`, in item order, without those deleted since"""
+        created = self.get_queryset().in_bulk(movement_ids)
+        indexes = [index for index, pk in enumerate(movement_ids) if pk in created]
+        data = self.get_serializer([created[movement_ids[index]] for index in indexes], many=True).data
+        results = [{'index': index, 'status': 201, 'movement': movement} for index, movement in zip(indexes, data)]
+        return Response({'created': len(results), 'results': results}, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream the household movements and distributions as ?type=csv|ndjson, optionally within ?start=YYYY-MM&end=YYYY-MM"""
+        member = request.user.member
+        if not member.household_id:
+            return Response({'error': 'No household found'}, status=status.HTTP_404_NOT_FOUND)
+        export_format = request.query_params.get('type', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError(f"Unknown export type: {export_format}")
+
+        movements = export_movements(
+            member.household_id,
+            start=request.query_params.get('start'),
+            end=request.query_params.get('end')
+        )
+        response = StreamingHttpResponse(STREAMERS[export_format](movements), content_type=CONTENT_TYPES[export_format])
+        response['Content-Disposition'] = f'attachment; filename="movements.{export_format}"'
+        return response
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            record_movement_deletions(instance.household_id, Movement.objects.filter(pk=instance.pk))
+            distributions = list(MovementDistribution.objects.filter(movement=instance).only('member_id', 'amount'))
+            instance.delete()
+            add_to_balances(*balance_changes([instance], distributions, sign=-1))
+            household_changed(instance.household_id, instance.member.household_id, period_ids=[instance.period_id])
+
+class MemberViewSet(HouseholdConditionalMixin, DynamicFieldsViewMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = MemberSerializer
 
     def get_queryset(self):
         member = self.request.user.member
-        if not member.household:
+        if not member.household_id:
             return Member.objects.none()
-        return Member.objects.filter(household=member.household)
+        return Member.objects.filter(household_id=member.household_id).select_related('household', 'ledger')
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            member = serializer.save()
+            household_changed(member.household_id)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            # The member's movements, shares and salaries go with them
+            movements = Movement.objects.filter(member=instance)
+            member_ids = movement_member_ids(movements) - {instance.id}
+            record_movement_deletions(instance.household_id, movements)
+            record_deletions(
+                instance.household_id,
+                Tombstone.DISTRIBUTION,
+                MovementDistribution.objects.filter(member=instance).exclude(movement__member=instance).values_list('id', flat=True)
+            )
+            record_deletions(instance.household_id, Tombstone.SALARY, instance.salary_set.values_list('id', flat=True))
+            instance.delete()
+            refresh_balances(member_ids)
+            household_changed(instance.household_id)
 
     @action(detail=False, methods=['get'])
+    @conditional_on_household
     def me(self, request):
         try:
             member = request.user.member
@@ -42,85 +169,191 @@ class MemberViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Member not found'}, status=status.HTTP_404_NOT_FOUND)
 
     @action(detail=False, methods=['get'])
+    @conditional_on_household
     def detailed_balances(self, request):
         try:
             current_member = request.user.member
-            if not current_member.household:
+            if not current_member.household_id:
                 return Response({'error': 'No household found'}, status=status.HTTP_404_NOT_FOUND)
-
-            # Get all members in the household
-            household_members = Member.objects.filter(household=current_member.household)
-            
-            # Calculate detailed balances
-            detailed_balances = []
-            for member in household_members:
-                if member.id == current_member.id:
-                    continue
-
-                # Calculate how much the current member owes this member
-                owed_to_member = MovementDistribution.objects.filter(
-                    movement__member=member,
-                    member=current_member,
-                    is_payer=False
-                ).aggregate(total=Sum('amount'))['total'] or 0
-
-                # Calculate how much this member owes the current member
-                member_owes = MovementDistribution.objects.filter(
-                    movement__member=current_member,
-                    member=member,
-                    is_payer=False
-                ).aggregate(total=Sum('amount'))['total'] or 0
-
-                detailed_balances.append({
-                    'member': {
-                        'id': member.id,
-                        'name': member.name
-                    },
-                    'you_owe': float(owed_to_member),
-                    'owes_you': float(member_owes),
-                    'net_balance': float(member_owes - owed_to_member)
-                })
-
-            return Response(detailed_balances)
+            key = household_key('detailed_balances', current_member.household, current_member.id)
+            return cached_response('detailed_balances', key, lambda: self.build_detailed_balances(current_member))
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class CategoryViewSet(viewsets.ModelViewSet):
+    def build_detailed_balances(self, current_member):
+        household_members = Member.objects.filter(household_id=current_member.household_id)
+        matrix = pairwise_matrix(current_member.household_id)
+        return Response(member_balances(current_member, household_members, matrix))
+
+class CategoryViewSet(HouseholdConditionalMixin, DynamicFieldsViewMixin, viewsets.ModelViewSet):
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticated]
+    list_cache_kind = 'categories'
 
     def get_queryset(self):
-        member = Member.objects.get(user=self.request.user)
-        if not member.household:
+        member = self.request.user.member
+        if not member.household_id:
             return Category.objects.none()
-        return Category.objects.filter(household=member.household)
+        return Category.objects.filter(household_id=member.household_id).select_related('distribution_type')
 
     def perform_create(self, serializer):
-        member = Member.objects.get(user=self.request.user)
-        if not member.household:
+        member = self.request.user.member
+        if not member.household_id:
             raise ValidationError("You must belong to a household to create categories")
-        serializer.save(household=member.household)
+        with transaction.atomic():
+            serializer.save(household_id=member.household_id)
+            household_changed(member.household_id)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            category = serializer.save()
+            household_changed(category.household_id)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            # Deleting a category deletes its movements
+            member_ids = movement_member_ids(instance.movements.all())
+            record_movement_deletions(instance.household_id, instance.movements.all())
+            record_deletions(instance.household_id, Tombstone.CATEGORY, [instance.id])
+            instance.delete()
+            refresh_balances(member_ids)
+            household_changed(instance.household_id)
 
 class DistributionTypeViewSet(viewsets.ModelViewSet):
     queryset = Distribution_type.objects.all()
     serializer_class = DistributionTypeSerializer
 
-class SalaryViewSet(viewsets.ModelViewSet):
+    def perform_update(self, serializer):
+        # Strategies are looked up by type name: renaming would leave the categories of the type unsplittable
+        name = serializer.instance.name
+        if name in STRATEGIES and serializer.validated_data.get('name', name) != name:
+            raise ValidationError({'name': f"Distribution type {name} has a registered strategy and cannot be renamed"})
+        with transaction.atomic():
+            distribution_type = serializer.save()
+            # Every household with a category of this type reads its name
+            household_changed(*Category.objects.filter(distribution_type=distribution_type).values_list('household_id', flat=True))
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            # Deleting a distribution type deletes its categories and their movements, in every household
+            movements = Movement.objects.filter(category__distribution_type=instance)
+            member_ids = movement_member_ids(movements)
+            categories = Category.objects.filter(distribution_type=instance)
+            household_ids = set(categories.values_list('household_id', flat=True))
+            for household_id in household_ids:
+                record_movement_deletions(household_id, movements.filter(household_id=household_id))
+                record_deletions(
+                    household_id,
+                    Tombstone.CATEGORY,
+                    categories.filter(household_id=household_id).values_list('id', flat=True)
+                )
+            instance.delete()
+            refresh_balances(member_ids)
+            household_changed(*household_ids)
+
+class SalaryViewSet(HouseholdConditionalMixin, DynamicFieldsViewMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = SalarySerializer
+    pagination_class = SalaryCursorPagination
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['period']
 
     def get_queryset(self):
         member = self.request.user.member
-        if not member.household:
-            return Salary.objects.none()
-        return Salary.objects.filter(member__household=member.household)
+        # Annotated even when empty: SalaryCursorPagination orders on period_start
+        queryset = Salary.objects.filter(member__household_id=member.household_id).select_related(
+            'period', 'member'
+        ).annotate(period_start=F('period__start'))
+        if not member.household_id:
+            return queryset.none()
+        if self.expanded('member'):
+            queryset = queryset.select_related('member__household', 'member__ledger')
+        return queryset
+
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            salary = serializer.save()
+            # Salaries only feed distributions through recompute_prorrata, which invalidates its periods
+            household_changed(salary.member.household_id, period_ids=[])
+
+    def update(self, request, *args, **kwargs):
+        # The prorrata recompute runs on the worker: return the queued jobs to poll at /jobs/<id>/
+        self.recompute_jobs = []
+        response = super().update(request, *args, **kwargs)
+        response.data['recompute_jobs'] = RecomputeJobSerializer(self.recompute_jobs, many=True).data
+        return response
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            salary = serializer.save()
+            household_changed(salary.member.household_id, period_ids=[])
+        self.recompute_jobs = serializer.recompute_jobs
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            record_deletions(instance.member.household_id, Tombstone.SALARY, [instance.id])
+            instance.delete()
+            household_changed(instance.member.household_id, period_ids=[])
+
+class RecomputeJobViewSet(DynamicFieldsViewMixin, viewsets.ReadOnlyModelViewSet):
+    """Status of the household's queued and recent prorrata recomputes"""
+    permission_classes = [IsAuthenticated]
+    serializer_class = RecomputeJobSerializer
+    pagination_class = RecomputeJobCursorPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['status', 'period']
+
+    def get_queryset(self):
+        member = self.request.user.member
+        if not member.household_id:
+            return RecomputeJob.objects.none()
+        return RecomputeJob.objects.filter(household_id=member.household_id).select_related('period')
 
 class PeriodViewSet(viewsets.ModelViewSet):
     queryset = Period.objects.all()
     serializer_class = PeriodSerializer
 
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            period = serializer.save()
+            # Every household with movements or salaries in the period reads its name
+            household_ids = set(Movement.objects.filter(period=period).values_list('household_id', flat=True))
+            household_ids |= set(Salary.objects.filter(period=period).values_list('member__household_id', flat=True))
+            household_changed(*household_ids, period_ids=[period.id])
+
+    @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
+    def summary(self, request, pk=None):
+        period = self.get_object()
+        member = request.user.member
+        if not member.household_id:
+            return Response({'error': 'No household found'}, status=status.HTTP_404_NOT_FOUND)
+
+        def build():
+            data = period_summary(member.household_id, [period])
+            data['period'] = PeriodSerializer(period).data
+            return Response(data)
+        return cached_response('period_summary', period_key('period_summary', member.household, [period.id], period.period), build)
+
+    @action(detail=False, methods=['get'], url_path='summary', permission_classes=[IsAuthenticated])
+    def range_summary(self, request):
+        """Summary over every period between ?start=YYYY-MM and ?end=YYYY-MM, both included"""
+        member = request.user.member
+        if not member.household_id:
+            return Response({'error': 'No household found'}, status=status.HTTP_404_NOT_FOUND)
+        start = request.query_params.get('start')
+        end = request.query_params.get('end')
+        if not start or not end:
+            raise ValidationError("start and end query parameters (YYYY-MM) are required")
+        periods = list(periods_between(start, end))
+
+        def build():
+            data = period_summary(member.household_id, periods)
+            data['start'] = start
+            data['end'] = end
+            return Response(data)
+        key = period_key('period_summary', member.household, [period.id for period in periods], start, end)
+        return cached_response('period_summary', key, build)
+
 class HouseholdViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = HouseholdSerializer
@@ -128,12 +361,42 @@ class HouseholdViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Household.objects.filter(members=self.request.user)
 
+    @action(detail=True, methods=['get'])
+    def balances(self, request, pk=None):
+        household = self.get_object()
+
+        def build():
+            members = list(Member.objects.filter(household=household).order_by('id'))
+            return Response(household_settlement(household.id, members))
+        return cached_response('household_balances', household_key('household_balances', household), build)
+
     def perform_create(self, serializer):
-        household = serializer.save()
-        member = self.request.user.member
-        member.household = household
-        member.save()
-        household.members.add(self.request.user)
+        with transaction.atomic():
+            household = serializer.save()
+            member = self.request.user.member
+            previous_household_id = member.household_id
+            member.household = household
+            member.save()
+            household.members.add(self.request.user)
+            member_moved(member, previous_household_id)
+            household_changed(previous_household_id, household.id)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            household = serializer.save()
+            # The household name is not part of any period data
+            household_changed(household.id, period_ids=[])
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            # Drops the cached reads, in case the id is ever reused
+            household_changed(instance.id)
+            # Its movements go with it, its members stay without a household
+            member_ids = movement_member_ids(instance.movements.all()) | set(
+                instance.member_household.values_list('id', flat=True)
+            )
+            instance.delete()
+            refresh_balances(member_ids)
 
 class JoinHouseholdView(generics.CreateAPIView):
     permission_classes = [IsAuthenticated]
@@ -144,9 +407,13 @@ class JoinHouseholdView(generics.CreateAPIView):
         try:
             household = Household.objects.get(name=household_name)
             member = request.user.member
-            member.household = household
-            member.save()
-            household.members.add(request.user)
+            with transaction.atomic():
+                previous_household_id = member.household_id
+                member.household = household
+                member.save()
+                household.members.add(request.user)
+                member_moved(member, previous_household_id)
+                household_changed(previous_household_id, household.id)
             return Response({'status': 'success'}, status=status.HTTP_200_OK)
         except Household.DoesNotExist:
             return Response({'error': 'Household not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -163,6 +430,42 @@ class UserCreate(generics.CreateAPIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class SyncView(APIView):
+    """Household rows changed since ?since=<token>, for offline clients. Without a token everything is returned."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        member = request.user.member
+        if not member.household_id:
+            return Response({'error': 'No household found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(household_changes(member.household, request.query_params.get('since')))
+
+class EndpointStatsView(APIView):
+    """Per endpoint query counts, DB and serialization time of this process' recent requests. DELETE resets them."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(endpoint_stats.summary())
+
+    def delete(self, request):
+        endpoint_stats.clear()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class CacheStatsView(APIView):
+    """Hit and miss counters of the response cache, to size it. DELETE resets them."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            'backend': settings.CACHES['default']['BACKEND'],
+            'enabled': settings.WISP_RESPONSE_CACHE,
+            'responses': stats()
+        })
+
+    def delete(self, request):
+        reset_stats()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer